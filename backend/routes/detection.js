@@ -6,6 +6,27 @@ const router = express.Router();
 const axios = require('axios');
 
 const ML_SERVICE_URL = process.env.ML_SERVICE_URL || 'http://localhost:5000';
+const ML_TIMEOUT_MS = 30000;
+
+// Tells the ML service when this proxy stops waiting, so it drops the request
+// instead of computing a result nobody will read
+const deadlineHeaders = (timeoutMs) => ({ 'X-Request-Timeout-Ms': String(timeoutMs) });
+
+// Detection options forwarded to the ML service as query parameters (multiLog=1: measure every log in a stack)
+const mlParams = (req) => (req.query.multiLog !== undefined ? { multiLog: req.query.multiLog } : {});
+
+// Pass the ML service's load shedding (503 + Retry-After) and deadline (504) answers through
+const forwardShedResponse = (res, mlError) => {
+  if (mlError.response && [503, 504].includes(mlError.response.status)) {
+    const retryAfter = mlError.response.headers['retry-after'];
+    if (retryAfter) {
+      res.set('Retry-After', retryAfter);
+    }
+    res.status(mlError.response.status).json(mlError.response.data);
+    return true;
+  }
+  return false;
+};
 
 router.post('/detect-cocolumber', async (req, res) => {
   try {
@@ -22,7 +43,7 @@ router.post('/detect-cocolumber', async (req, res) => {
     try {
       const response = await axios.post(`${ML_SERVICE_URL}/predict`, 
         { image }, 
-        { timeout: 30000 }
+        { timeout: ML_TIMEOUT_MS, headers: deadlineHeaders(ML_TIMEOUT_MS), params: mlParams(req) }
       );
       
       console.log('✅ ML Service response:', response.data);
@@ -40,6 +61,11 @@ router.post('/detect-cocolumber', async (req, res) => {
         });
       }
       
+      // ML service is up but not ready (models still loading) or overloaded: let the client retry
+      if (forwardShedResponse(res, mlError)) {
+        return;
+      }
+      
       throw mlError;
     }
     
@@ -52,4 +78,142 @@ router.post('/detect-cocolumber', async (req, res) => {
   }
 });
 
+// ML service readiness (models loaded and warmed up)
+router.get('/detect-cocolumber/status', async (req, res) => {
+  try {
+    const response = await axios.get(`${ML_SERVICE_URL}/health/ready`, { timeout: 5000 });
+    return res.json(response.data);
+  } catch (mlError) {
+    if (mlError.response) {
+      return res.status(mlError.response.status).json(mlError.response.data);
+    }
+    return res.status(503).json({
+      ready: false,
+      error: 'ML Service unavailable',
+      service_url: ML_SERVICE_URL
+    });
+  }
+});
+
+// Batch detection: forwards a whole stack of photos to the ML service in one round trip
+router.post('/detect-cocolumber/batch', async (req, res) => {
+  try {
+    const { images } = req.body; // Array of base64 image data
+
+    if (!Array.isArray(images) || images.length === 0) {
+      return res.status(400).json({ error: 'No images provided' });
+    }
+
+    console.log(`🔍 Batch detection request received (${images.length} images), forwarding to ML service...`);
+
+    try {
+      const timeoutMs = ML_TIMEOUT_MS + images.length * 2000;
+      const response = await axios.post(`${ML_SERVICE_URL}/predict/batch`,
+        { images },
+        {
+          timeout: timeoutMs,
+          headers: deadlineHeaders(timeoutMs),
+          params: mlParams(req),
+          maxBodyLength: Infinity,
+          maxContentLength: Infinity
+        }
+      );
+
+      console.log(`✅ ML Service batch response: ${response.data.succeeded}/${response.data.count} succeeded`);
+      return res.json(response.data);
+
+    } catch (mlError) {
+      console.error('❌ ML Service error:', mlError.message);
+
+      if (mlError.code === 'ECONNREFUSED') {
+        return res.status(503).json({
+          error: 'ML Service unavailable',
+          message: 'Please start the ML service: python ml-service/app.py',
+          service_url: ML_SERVICE_URL
+        });
+      }
+
+      if (forwardShedResponse(res, mlError)) {
+        return;
+      }
+
+      // Pass through client errors such as too many images
+      if (mlError.response && mlError.response.status < 500) {
+        return res.status(mlError.response.status).json(mlError.response.data);
+      }
+
+      throw mlError;
+    }
+
+  } catch (error) {
+    console.error('❌ Batch detection error:', error);
+    res.status(500).json({
+      message: 'Batch detection failed',
+      error: error.message
+    });
+  }
+});
+
+// Camera streaming: one session per scan, frames are forwarded as they arrive.
+// The ML service only re-runs the models when the scene changed between frames.
+router.post('/detect-cocolumber/stream', async (req, res) => {
+  try {
+    const response = await axios.post(`${ML_SERVICE_URL}/stream/session`, req.body || {}, { timeout: 5000 });
+    return res.status(201).json(response.data);
+  } catch (mlError) {
+    if (mlError.response) {
+      return res.status(mlError.response.status).json(mlError.response.data);
+    }
+    return res.status(503).json({
+      error: 'ML Service unavailable',
+      service_url: ML_SERVICE_URL
+    });
+  }
+});
+
+router.post('/detect-cocolumber/stream/:sessionId/frame', async (req, res) => {
+  const { image } = req.body; // Base64 frame
+
+  if (!image) {
+    return res.status(400).json({ error: 'No image provided' });
+  }
+
+  try {
+    const response = await axios.post(
+      `${ML_SERVICE_URL}/stream/${encodeURIComponent(req.params.sessionId)}/frame`,
+      { image },
+      { timeout: ML_TIMEOUT_MS, headers: deadlineHeaders(ML_TIMEOUT_MS), params: mlParams(req) }
+    );
+    return res.json(response.data);
+  } catch (mlError) {
+    if (mlError.response) {
+      const retryAfter = mlError.response.headers['retry-after'];
+      if (retryAfter) {
+        res.set('Retry-After', retryAfter);
+      }
+      return res.status(mlError.response.status).json(mlError.response.data);
+    }
+    console.error('❌ ML Service error:', mlError.message);
+    return res.status(503).json({
+      error: 'ML Service unavailable',
+      service_url: ML_SERVICE_URL
+    });
+  }
+});
+
+router.delete('/detect-cocolumber/stream/:sessionId', async (req, res) => {
+  try {
+    const response = await axios.delete(
+      `${ML_SERVICE_URL}/stream/${encodeURIComponent(req.params.sessionId)}`,
+      { timeout: 5000 }
+    );
+    return res.json(response.data);
+  } catch (mlError) {
+    if (mlError.response) {
+      return res.status(mlError.response.status).json(mlError.response.data);
+    }
+    return res.status(503).json({ error: 'ML Service unavailable' });
+  }
+});
+
 module.exports = router;
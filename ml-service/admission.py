@@ -0,0 +1,136 @@
+"""
+Admission control for the ML service
+Caps concurrent inference requests, bounds the wait queue behind them and
+drops requests whose client deadline has already passed
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+
+
+class OverloadedError(Exception):
+    """Raised when a request cannot get an inference slot (queue full or waited too long)"""
+
+    def __init__(self, message, retry_after_s=1):
+        super().__init__(message)
+        self.retry_after_s = retry_after_s
+
+
+class DeadlineExceededError(Exception):
+    """Raised when a request's deadline passes before its work started"""
+
+
+def parse_deadline(deadline_header=None, timeout_header=None, now=None):
+    """
+    Client deadline as a time.monotonic() value, or None when no header was sent
+
+    deadline_header: absolute Unix time in milliseconds (X-Request-Deadline)
+    timeout_header:  remaining budget in milliseconds (X-Request-Timeout-Ms),
+                     not affected by clock skew between hosts
+    The earlier of the two wins. Raises ValueError on malformed values.
+    """
+    now = time.monotonic() if now is None else now
+    deadlines = []
+    if deadline_header:
+        deadlines.append(now + float(deadline_header) / 1000.0 - time.time())
+    if timeout_header:
+        deadlines.append(now + float(timeout_header) / 1000.0)
+    return min(deadlines) if deadlines else None
+
+
+def remaining_s(deadline):
+    """Seconds left until a monotonic deadline (None = no deadline)"""
+    return None if deadline is None else deadline - time.monotonic()
+
+
+def check_deadline(deadline, stage='inference'):
+    """Raise DeadlineExceededError if the deadline has already passed"""
+    if deadline is not None and time.monotonic() >= deadline:
+        raise DeadlineExceededError(f'Request deadline passed before {stage}')
+
+
+class AdmissionController:
+    """
+    Counting semaphore with a bounded FIFO of waiters.
+
+    At most `max_concurrent` requests hold a slot; up to `max_queue` more wait
+    for one (first come, first served). A request arriving at a full queue is
+    rejected at once with OverloadedError, so overload turns into fast
+    rejections instead of an ever growing backlog. A waiter gives up when its
+    deadline passes (DeadlineExceededError) or after `queue_timeout_s`
+    (OverloadedError). max_concurrent <= 0 disables the limit.
+    """
+
+    def __init__(self, max_concurrent=4, max_queue=16, queue_timeout_s=10.0, retry_after_s=1):
+        self.max_concurrent = int(max_concurrent)
+        self.max_queue = max(0, int(max_queue))
+        self.queue_timeout_s = max(0.0, float(queue_timeout_s))
+        self.retry_after_s = retry_after_s
+
+        self._cond = threading.Condition()
+        self._active = 0
+        self._waiters = []  # tickets in arrival order
+
+    @property
+    def enabled(self):
+        return self.max_concurrent > 0
+
+    def in_flight(self):
+        return self._active
+
+    def waiting(self):
+        return len(self._waiters)
+
+    def acquire(self, deadline=None):
+        """Block until a slot is free; see the class docstring for the failure cases"""
+        check_deadline(deadline, 'admission')
+        if not self.enabled:
+            with self._cond:
+                self._active += 1
+            return
+
+        with self._cond:
+            if not self._waiters and self._active < self.max_concurrent:
+                self._active += 1
+                return
+            if len(self._waiters) >= self.max_queue:
+                raise OverloadedError(
+                    f'Service overloaded ({self._active} in flight, {len(self._waiters)} queued)',
+                    self.retry_after_s
+                )
+
+            ticket = object()
+            self._waiters.append(ticket)
+            give_up = time.monotonic() + self.queue_timeout_s
+            if deadline is not None:
+                give_up = min(give_up, deadline)
+            try:
+                while self._waiters[0] is not ticket or self._active >= self.max_concurrent:
+                    remaining = give_up - time.monotonic()
+                    if remaining <= 0:
+                        check_deadline(deadline, 'admission')
+                        raise OverloadedError(
+                            f'Timed out after {self.queue_timeout_s:g}s waiting for an inference slot',
+                            self.retry_after_s
+                        )
+                    self._cond.wait(remaining)
+                self._active += 1
+            finally:
+                self._waiters.remove(ticket)
+                # The next waiter may now be at the head of the queue
+                self._cond.notify_all()
+
+    def release(self):
+        with self._cond:
+            self._active -= 1
+            self._cond.notify_all()
+
+    @contextmanager
+    def slot(self, deadline=None):
+        """Hold one slot for the duration of a request"""
+        self.acquire(deadline)
+        try:
+            yield
+        finally:
+            self.release()
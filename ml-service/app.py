@@ -3,156 +3,645 @@ Cocolumber Detection ML Service
 Flask API for detecting coconut lumber vs humans and other objects
 """
 
-from flask import Flask, request, jsonify
+from flask import Flask, Response, g, has_request_context, request, jsonify
 from flask_cors import CORS
-import tensorflow as tf
+from werkzeug.exceptions import RequestEntityTooLarge
 import numpy as np
-from PIL import Image
 import base64
-import io
-import cv2
+import functools
+import hashlib
+import hmac
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from contextlib import nullcontext
+
+from admission import (
+    AdmissionController, DeadlineExceededError, OverloadedError, check_deadline, parse_deadline, remaining_s
+)
+from batching import MicroBatcher, QueueFullError
+from buffer_pool import BufferPool, write_mobilenet_input, write_unit_input
+from brown_segmentation import segment_brown
+from model_backends import CombinedKerasBackend, KerasBackend, TFLiteBackend, tflite_model_paths
+from result_cache import ResultCache, image_cache_key
+from image_io import open_image
+from imagenet_index import CategoryIndex, load_imagenet_labels
+from metrics import REGISTRY, STAGE_SECONDS
+from model_registry import ModelRegistry, UnknownVersionError
+from stream_sessions import FrameSignature, StreamSessionStore
 
 app = Flask(__name__)
 CORS(app)
 
-# Load pre-trained MobileNetV2 for general object detection
-base_model = tf.keras.applications.MobileNetV2(
-    input_shape=(224, 224, 3),
-    include_top=True,
-    weights='imagenet'
-)
+# ==================== CONFIGURATION ====================
+# Micro-batching: concurrent /predict calls are grouped into one model call
+BATCH_MAX_SIZE = int(os.environ.get('ML_BATCH_MAX_SIZE', 8))
+BATCH_MAX_WAIT_MS = float(os.environ.get('ML_BATCH_MAX_WAIT_MS', 5))
+BATCH_QUEUE_SIZE = int(os.environ.get('ML_BATCH_QUEUE_SIZE', 64))
+# Upper bound on how long a request waits for its batch result
+BATCH_RESULT_TIMEOUT_S = float(os.environ.get('ML_BATCH_RESULT_TIMEOUT_S', 25))
+# Admission control: prediction requests running at once per process, and how many
+# more may wait for a slot before new ones are rejected with 503 + Retry-After.
+# Admitted /predict calls hold their slot while they wait for a micro-batch, so the
+# default lets a full batch of BATCH_MAX_SIZE requests in at once
+MAX_CONCURRENT = int(os.environ.get('ML_MAX_CONCURRENT', BATCH_MAX_SIZE))  # 0 disables the limit
+ADMISSION_QUEUE_SIZE = int(os.environ.get('ML_ADMISSION_QUEUE_SIZE', 16))
+ADMISSION_QUEUE_TIMEOUT_S = float(os.environ.get('ML_ADMISSION_QUEUE_TIMEOUT_S', 10))
+OVERLOAD_RETRY_AFTER_S = int(os.environ.get('ML_OVERLOAD_RETRY_AFTER_S', 1))
+# /predict/batch: images per request and threads used to decode/analyze them
+BATCH_REQUEST_MAX_IMAGES = int(os.environ.get('ML_BATCH_REQUEST_MAX_IMAGES', 32))
+DECODE_WORKERS = int(os.environ.get('ML_DECODE_WORKERS', min(8, os.cpu_count() or 1)))
+# Threads for the OpenCV brown/edge analysis that runs alongside model inference
+ANALYSIS_WORKERS = int(os.environ.get('ML_ANALYSIS_WORKERS', DECODE_WORKERS))
+# Pooled float32 model input batches kept between model calls (0 allocates a new one per batch)
+INPUT_BUFFERS = int(os.environ.get('ML_INPUT_BUFFERS', 4))
+
+# Decode JPEG uploads at the smallest DCT scale that still covers 224x224
+REDUCED_DECODE = os.environ.get('ML_REDUCED_DECODE', '1') != '0'
+# Largest accepted request body (binary, multipart or base64 JSON, including /predict/batch)
+MAX_UPLOAD_MB = float(os.environ.get('ML_MAX_UPLOAD_MB', 64))
+app.config['MAX_CONTENT_LENGTH'] = int(MAX_UPLOAD_MB * 1024 * 1024)
+
+# Result cache: identical images (same bytes, same models) skip inference
+CACHE_MAX_ENTRIES = int(os.environ.get('ML_CACHE_MAX_ENTRIES', 512))  # 0 disables the cache
+CACHE_TTL_S = float(os.environ.get('ML_CACHE_TTL_S', 600))
+CACHE_DIR = os.environ.get('ML_CACHE_DIR', '')  # optional on-disk tier
+
+# Measurement on large images: segment a PYRAMID_WORKING_SIDE copy, refine the
+# chosen object at full resolution (0 disables; service images are 224x224 already)
+PYRAMID_MIN_SIDE = int(os.environ.get('ML_PYRAMID_MIN_SIDE', 1600))
+PYRAMID_WORKING_SIDE = int(os.environ.get('ML_PYRAMID_WORKING_SIDE', 512))
+
+# Multi-log mode (stacked lumber): measure every brown region, not only the largest.
+# Default for all requests; a request can override it with ?multiLog=1 / ?multiLog=0
+MULTI_LOG = os.environ.get('ML_MULTI_LOG', '0') != '0'
+MULTI_LOG_MIN_AREA = float(os.environ.get('ML_MULTI_LOG_MIN_AREA', 0.005))  # share of the frame per log
+MULTI_LOG_MAX_OBJECTS = int(os.environ.get('ML_MULTI_LOG_MAX_OBJECTS', 20))
+
+# Camera streaming sessions: frames that barely changed reuse the previous result
+STREAM_CHANGE_THRESHOLD = float(os.environ.get('ML_STREAM_CHANGE_THRESHOLD', 0.08))  # 0..1
+STREAM_MAX_REUSE_S = float(os.environ.get('ML_STREAM_MAX_REUSE_S', 2.0))  # re-run at least this often
+STREAM_SMOOTHING = float(os.environ.get('ML_STREAM_SMOOTHING', 0))  # measurement EMA weight, 0 = off
+STREAM_MAX_SESSIONS = int(os.environ.get('ML_STREAM_MAX_SESSIONS', 100))
+STREAM_SESSION_TTL_S = float(os.environ.get('ML_STREAM_SESSION_TTL_S', 60))
+
+# Detection rules and cascade (see DETECTION CASCADE). ML_CASCADE=0 runs every stage for every image
+CASCADE = os.environ.get('ML_CASCADE', '1') != '0'
+HUMAN_CONFIDENCE = float(os.environ.get('ML_HUMAN_CONFIDENCE', 0.3))  # top ImageNet confidence for "human"
+BROWN_MODEL_CONFIDENCE = float(os.environ.get('ML_BROWN_MODEL_CONFIDENCE', 0.6))  # custom model, for "cocolumber"
+# Optional approximate gate: brown pixel share at or below which the custom model is not
+# consulted (unless ImageNet sees wood). Can turn custom_model answers into not_cocolumber; 0 = off
+CASCADE_MIN_BROWN_RATIO = float(os.environ.get('ML_CASCADE_MIN_BROWN_RATIO', 0))
+
+# Model files
+BROWN_MODEL_PATH = os.environ.get('ML_BROWN_MODEL', 'brown_detector_model.h5')
+# Shared-backbone model (ImageNet + brown heads) from: train_brown_detector.py --train --combined
+COMBINED_MODEL_PATH = os.environ.get('ML_COMBINED_MODEL', 'brown_detector_combined.h5')
+# Versioned models registered by train_brown_detector.py; its CURRENT version wins over the files above
+MODEL_REGISTRY_DIR = os.environ.get('ML_MODEL_REGISTRY', 'model_registry')
+# Seconds between checks for a new CURRENT version to hot-reload (0 = only POST /models/reload)
+MODEL_WATCH_S = float(os.environ.get('ML_MODEL_WATCH_S', 10))
+# When set, POST /models/reload requires it in the X-Admin-Token header
+ADMIN_TOKEN = os.environ.get('ML_ADMIN_TOKEN', '')
 
-# Try to load custom trained brown detector model
-custom_brown_detector = None
-try:
-    import os
-    if os.path.exists('brown_detector_model.h5'):
-        print("📦 Loading custom brown detector model...")
-        custom_brown_detector = tf.keras.models.load_model('brown_detector_model.h5')
-        print("✅ Custom brown detector loaded!")
+# Inference backend: 'keras' (full precision) or 'tflite' (quantized, see --export-tflite)
+INFERENCE_BACKEND = os.environ.get('ML_BACKEND', 'keras').lower()
+TFLITE_DIR = os.environ.get('ML_TFLITE_DIR', 'tflite_models')
+TFLITE_PRECISION = os.environ.get('ML_TFLITE_PRECISION', 'int8').lower()
+TFLITE_THREADS = int(os.environ.get('ML_TFLITE_THREADS', os.cpu_count() or 1))
+
+# Per-request detail (predictions, measurements) is logged at DEBUG; warnings and errors always
+LOG_LEVEL = os.environ.get('ML_LOG_LEVEL', 'INFO').upper()
+logging.basicConfig(format='%(message)s', level=LOG_LEVEL)
+logger = logging.getLogger('ml-service')
+
+# TensorFlow threads per process (0 = TensorFlow default). serve.py sets these per worker
+TF_INTRA_THREADS = int(os.environ.get('ML_TF_INTRA_THREADS', 0))
+TF_INTER_THREADS = int(os.environ.get('ML_TF_INTER_THREADS', 0))
+
+# TensorFlow is imported by load_models(), off the startup path, so the port binds immediately
+tf = None
+# Model file contents read by preload_for_fork() in a pre-fork parent (shared copy-on-write)
+preloaded_model_bytes = {}
+base_model = None
+inference_backend = None
+MODEL_VERSION = None
+
+def load_tflite_backend():
+    """Load the quantized TFLite models, or return None if they were not exported"""
+    paths = tflite_model_paths(TFLITE_DIR, TFLITE_PRECISION)
+    if paths['combined'] is None and paths['imagenet'] is None:
+        print(f"⚠️  No {TFLITE_PRECISION} TFLite models in {TFLITE_DIR}/")
+        print("   💡 Run: python train_brown_detector.py --export-tflite")
+        return None
+    
+    print(f"📦 Loading {TFLITE_PRECISION} TFLite models from {TFLITE_DIR}/...")
+    backend = TFLiteBackend(
+        imagenet_path=paths['imagenet'],
+        brown_path=paths['brown'],
+        combined_path=paths['combined'],
+        num_threads=TFLITE_THREADS,
+        precision=TFLITE_PRECISION,
+        model_contents=preloaded_model_bytes
+    )
+    backend.model_files = [path for path in paths.values() if path is not None]
+    if backend.combined is not None:
+        print("✅ Combined TFLite model loaded (single backbone pass per image)!")
     else:
-        print("ℹ️  Custom brown detector not found (brown_detector_model.h5)")
-        print("   💡 Run: python train_brown_detector.py --train")
-except Exception as e:
-    print(f"⚠️  Could not load custom brown detector: {e}")
-    print("   Using HSV-based brown detection instead...")
-
-# ImageNet class indices for common objects
-HUMAN_CLASSES = [
+        print(f"✅ TFLite ImageNet classifier loaded (brown detector: {'yes' if backend.brown else 'no'})")
+    return backend
+
+def load_keras_backend(brown_path=BROWN_MODEL_PATH, combined_path=COMBINED_MODEL_PATH):
+    """Load the Keras models, preferring the shared-backbone combined model"""
+    global base_model
+    
+    # Prefer the combined model: one backbone pass yields both outputs
+    if combined_path and os.path.exists(combined_path):
+        try:
+            print(f"📦 Loading combined ImageNet + brown model ({combined_path})...")
+            backend = CombinedKerasBackend(tf.keras.models.load_model(combined_path))
+            backend.model_files = [combined_path]
+            print("✅ Combined model loaded (single backbone pass per image)!")
+            return backend
+        except Exception as e:
+            print(f"⚠️  Could not load combined model: {e}")
+            print("   Falling back to separate models...")
+    
+    # Load pre-trained MobileNetV2 for general object detection (kept across model reloads)
+    if base_model is None:
+        base_model = tf.keras.applications.MobileNetV2(
+            input_shape=(224, 224, 3),
+            include_top=True,
+            weights='imagenet'
+        )
+    
+    # Try to load custom trained brown detector model
+    custom_brown_detector = None
+    try:
+        if brown_path and os.path.exists(brown_path):
+            print(f"📦 Loading custom brown detector model ({brown_path})...")
+            custom_brown_detector = tf.keras.models.load_model(brown_path)
+            print("✅ Custom brown detector loaded!")
+        else:
+            print(f"ℹ️  Custom brown detector not found ({brown_path})")
+            print("   💡 Run: python train_brown_detector.py --train")
+    except Exception as e:
+        print(f"⚠️  Could not load custom brown detector: {e}")
+        print("   Using HSV-based brown detection instead...")
+    
+    backend = KerasBackend(base_model, custom_brown_detector)
+    backend.model_files = [brown_path] if custom_brown_detector is not None else []
+    return backend
+
+def registry_model_paths(version=None):
+    """
+    (brown model path, combined model path, registry version) of the given
+    registry version, or of CURRENT. Without an active registry version the
+    ML_BROWN_MODEL / ML_COMBINED_MODEL files are used.
+    """
+    if version is None:
+        version = model_registry.current()
+        if version is None:
+            return BROWN_MODEL_PATH, COMBINED_MODEL_PATH, None
+        try:
+            model_registry.version_dir(version)
+        except UnknownVersionError:
+            # A stale CURRENT must not keep the service from starting
+            logger.error(f"❌ Registry CURRENT names unknown version {version}, using {BROWN_MODEL_PATH}")
+            return BROWN_MODEL_PATH, COMBINED_MODEL_PATH, None
+    brown_path = model_registry.model_path(version, 'brown')
+    # Versions registered by older --combined runs hold a [-1, 1]-input head under 'brown';
+    # the separate brown model is fed /255 input, so only their combined model is usable
+    if model_registry.metadata(version).get('training', {}).get('preprocessing', 'rescale') != 'rescale':
+        brown_path = None
+    return brown_path, model_registry.model_path(version, 'combined'), version
+
+def load_inference_backend(version=None):
+    """Select the inference backend (ML_BACKEND); Keras models come from the registry when it has them"""
+    if INFERENCE_BACKEND == 'tflite':
+        try:
+            backend = load_tflite_backend()
+            if backend is not None:
+                return backend
+        except Exception as e:
+            print(f"⚠️  Could not load TFLite models: {e}")
+        print("   Falling back to Keras models...")
+    elif INFERENCE_BACKEND != 'keras':
+        print(f"⚠️  Unknown ML_BACKEND '{INFERENCE_BACKEND}', using keras")
+    
+    brown_path, combined_path, registry_version = registry_model_paths(version)
+    if registry_version is not None:
+        print(f"🗂️  Model registry version {registry_version}")
+    backend = load_keras_backend(brown_path, combined_path)
+    backend.registry_version = registry_version
+    return backend
+
+def describe_model_version(backend):
+    """
+    The registry version the models were loaded from, otherwise a short
+    fingerprint of the loaded models (backend + model file sizes/mtimes).
+    Part of every response and result cache key, so retrained models never
+    serve stale results.
+    """
+    registry_version = getattr(backend, 'registry_version', None)
+    if registry_version is not None:
+        return registry_version
+    
+    parts = [backend.name, str(getattr(backend, 'precision', ''))]
+    for path in getattr(backend, 'model_files', []):
+        stat = os.stat(path)
+        parts.append(f'{os.path.basename(path)}@{stat.st_size}-{int(stat.st_mtime)}')
+    return hashlib.sha1('|'.join(parts).encode()).hexdigest()[:12]
+
+# ==================== MODEL LOADING ====================
+# Models load in a background thread; /health/ready reports when they are usable
+model_state = {
+    'status': 'not_started',  # not_started -> loading -> ready | failed
+    'error': None,
+    'backend': None,
+    'modelVersion': None,
+    'timings': {},
+}
+_model_state_lock = threading.Lock()
+_model_loader = None
+
+def models_ready():
+    return model_state['status'] == 'ready'
+
+def warm_up_models(backend):
+    """One inference on a blank image so the first real request doesn't pay graph/kernel setup"""
+    blank = np.zeros((1, 224, 224, 3), dtype=np.uint8)
+    # float32 like the pooled request batches, so no input signature is traced on the first request
+    imagenet_batch = write_mobilenet_input(blank, np.empty(blank.shape, dtype=np.float32))
+    brown_batch = None
+    if backend.needs_brown_input:
+        brown_batch = write_unit_input(blank, np.empty(blank.shape, dtype=np.float32))
+    predictions, _ = backend.predict_batch(imagenet_batch, brown_batch)
+    get_category_index().summarize(predictions)
+
+def _import_tensorflow(timings):
+    global tf, imagenet_labels
+    if tf is None:
+        step = time.perf_counter()
+        import tensorflow
+        tf = tensorflow
+        timings['tensorflow_import_s'] = round(time.perf_counter() - step, 3)
+    
+    if imagenet_labels is None:
+        step = time.perf_counter()
+        imagenet_labels = load_imagenet_labels(tf)
+        get_category_index()
+        timings['class_index_s'] = round(time.perf_counter() - step, 3)
+
+def configure_tf_threads():
+    """Pin TensorFlow's intra/inter-op pools; only possible before TF runs its first op"""
+    try:
+        if TF_INTRA_THREADS > 0:
+            tf.config.threading.set_intra_op_parallelism_threads(TF_INTRA_THREADS)
+        if TF_INTER_THREADS > 0:
+            tf.config.threading.set_inter_op_parallelism_threads(TF_INTER_THREADS)
+    except RuntimeError as e:
+        print(f"⚠️  Could not set TensorFlow thread counts: {e}")
+
+def preload_for_fork():
+    """
+    Work done once in a pre-fork parent (serve.py) and inherited by every
+    worker: the TensorFlow import, the ImageNet category index and the raw
+    TFLite model files. Nothing here runs a TensorFlow op, because TF's
+    thread pools do not survive fork(); each worker builds its own
+    interpreters/models (and thread pools) in load_models().
+    """
+    _import_tensorflow(model_state['timings'])
+    
+    if INFERENCE_BACKEND == 'tflite':
+        for path in tflite_model_paths(TFLITE_DIR, TFLITE_PRECISION).values():
+            if path is not None:
+                with open(path, 'rb') as f:
+                    preloaded_model_bytes[path] = f.read()
+        total_mb = sum(len(content) for content in preloaded_model_bytes.values()) / 1024 / 1024
+        print(f"📦 Preloaded {len(preloaded_model_bytes)} TFLite models ({total_mb:.1f} MB) for workers")
+
+def load_models(warmup=True):
+    """
+    Import TensorFlow, load the inference backend and (optionally) warm it up,
+    recording per-step timings in model_state. Safe to call more than once.
+    """
+    global inference_backend, MODEL_VERSION
+    
+    with _model_state_lock:
+        if model_state['status'] in ('loading', 'ready'):
+            return
+        model_state.update(status='loading', error=None)
+    
+    timings = model_state['timings']
+    started = time.perf_counter()
+    try:
+        _import_tensorflow(timings)
+        configure_tf_threads()
+        
+        step = time.perf_counter()
+        backend = load_inference_backend()
+        backend.model_version = describe_model_version(backend)
+        timings['model_load_s'] = round(time.perf_counter() - step, 3)
+        print(f"🧠 Inference backend: {backend.name} (model version {backend.model_version})")
+        
+        if warmup:
+            step = time.perf_counter()
+            warm_up_models(backend)
+            timings['warmup_s'] = round(time.perf_counter() - step, 3)
+        
+        inference_backend, MODEL_VERSION = backend, backend.model_version
+        timings['total_s'] = round(time.perf_counter() - started, 3)
+        model_state.update(status='ready', backend=inference_backend.name, modelVersion=MODEL_VERSION)
+        print(f"✅ Models ready in {timings['total_s']}s")
+        start_registry_watch()
+    except Exception as e:
+        timings['total_s'] = round(time.perf_counter() - started, 3)
+        model_state.update(status='failed', error=str(e))
+        print(f"❌ Model loading failed: {e}")
+
+def start_model_loading():
+    """Start load_models() in a background thread (once per process)"""
+    global _model_loader
+    with _model_state_lock:
+        if _model_loader is not None and _model_loader.is_alive():
+            return
+        if model_state['status'] in ('loading', 'ready'):
+            return
+        _model_loader = threading.Thread(target=load_models, name='model-loader', daemon=True)
+        _model_loader.start()
+
+@app.before_request
+def ensure_models_loading():
+    # Covers servers that import app without running __main__ (flask run, WSGI servers)
+    if model_state['status'] == 'not_started':
+        start_model_loading()
+
+def not_ready_response():
+    """503 + Retry-After while the models are still loading (or failed to load)"""
+    response = jsonify({
+        'error': 'ML models are not ready yet' if model_state['status'] != 'failed' else 'ML models failed to load',
+        'modelStatus': model_state['status'],
+    })
+    response.status_code = 503
+    response.headers['Retry-After'] = '5'
+    return response
+
+# ==================== MODEL RELOAD ====================
+# A new model version is loaded and warmed up next to the serving one, then
+# swapped in with a single reference assignment: requests never wait for a
+# reload, and batches already running finish on the models they started with.
+model_registry = ModelRegistry(MODEL_REGISTRY_DIR)
+reload_state = {'status': 'idle', 'version': None, 'error': None, 'finishedAt': None, 'durationSeconds': None}
+_reload_lock = threading.Lock()
+_registry_watcher = None
+
+MODEL_RELOADS = REGISTRY.counter('ml_model_reloads_total', 'Model hot reloads by outcome', ('status',))
+
+def registry_reload_error():
+    """
+    Why registry versions cannot be hot-loaded, or None. The TFLite backend
+    serves the exports in ML_TFLITE_DIR, which are not versioned in the registry.
+    """
+    if getattr(inference_backend, 'name', None) == 'tflite':
+        return (f'Model reloads are not supported on the TFLite backend: it serves the exports in '
+                f'{TFLITE_DIR}/, not registry versions. Re-export (train_brown_detector.py --export-tflite) '
+                f'and restart the service instead')
+    return None
+
+def _reload_models(version, activate=False):
+    global inference_backend, MODEL_VERSION
+    started = time.perf_counter()
+    reload_state.update(status='loading', version=version, error=None)
+    try:
+        error = registry_reload_error()
+        if error:
+            raise RuntimeError(error)
+        # Also recovers from a failed startup load
+        _import_tensorflow(model_state['timings'])
+        # Files preloaded before fork are the old ones
+        preloaded_model_bytes.clear()
+        backend = load_inference_backend(version)
+        backend.model_version = describe_model_version(backend)
+        warm_up_models(backend)
+        if activate:
+            # Only a version that loaded becomes CURRENT (and reaches the other workers)
+            model_registry.activate(version)
+        
+        previous = MODEL_VERSION
+        with _model_state_lock:
+            inference_backend, MODEL_VERSION = backend, backend.model_version
+            model_state.update(status='ready', error=None, backend=backend.name, modelVersion=MODEL_VERSION)
+        reload_state.update(status='ready', version=MODEL_VERSION)
+        MODEL_RELOADS.inc(status='success')
+        print(f"🔄 Model version {previous} -> {MODEL_VERSION}")
+    except Exception as e:
+        reload_state.update(status='failed', error=str(e))
+        MODEL_RELOADS.inc(status='failed')
+        logger.error(f"❌ Model reload failed, still serving {MODEL_VERSION}: {e}")
+    finally:
+        reload_state.update(
+            finishedAt=time.strftime('%Y-%m-%dT%H:%M:%S'),
+            durationSeconds=round(time.perf_counter() - started, 3)
+        )
+
+def start_model_reload(version=None, activate=False):
+    """
+    Load and warm up a registry version (default: CURRENT) in a background
+    thread, then swap it in (and make it CURRENT with activate); the old
+    models keep serving if it fails. Returns False when a reload is already
+    running.
+    """
+    if not _reload_lock.acquire(blocking=False):
+        return False
+    
+    def run():
+        try:
+            _reload_models(version, activate)
+        finally:
+            _reload_lock.release()
+    
+    threading.Thread(target=run, name='model-reload', daemon=True).start()
+    return True
+
+def watch_registry():
+    """Hot-reload whenever the registry's CURRENT version changes (every ML_MODEL_WATCH_S)"""
+    seen = model_registry.current()
+    while True:
+        time.sleep(MODEL_WATCH_S)
+        try:
+            current = model_registry.current()
+        except OSError as e:
+            logger.warning(f"⚠️  Could not read the model registry: {e}")
+            continue
+        if current is None or current == seen:
+            continue
+        # Already serving it (e.g. after POST /models/reload), or a reload was started
+        if current == getattr(inference_backend, 'registry_version', None) or start_model_reload(current):
+            seen = current
+
+def start_registry_watch():
+    global _registry_watcher
+    if MODEL_WATCH_S <= 0 or _registry_watcher is not None:
+        return
+    if registry_reload_error():
+        print("ℹ️  TFLite backend: model registry watch disabled")
+        return
+    _registry_watcher = threading.Thread(target=watch_registry, name='registry-watch', daemon=True)
+    _registry_watcher.start()
+
+# Results of repeated scans of the same image are served from here
+result_cache = ResultCache(
+    max_entries=CACHE_MAX_ENTRIES,
+    ttl_seconds=CACHE_TTL_S,
+    disk_dir=CACHE_DIR or None
+)
+
+def _keyword_list(env_name, default):
+    """Comma-separated keyword list from the environment, or the default"""
+    value = os.environ.get(env_name)
+    if not value:
+        return default
+    return [keyword.strip().lower() for keyword in value.split(',') if keyword.strip()]
+
+# ImageNet class-name keywords for common objects (override with ML_HUMAN_CLASSES / ML_WOOD_CLASSES)
+HUMAN_CLASSES = _keyword_list('ML_HUMAN_CLASSES', [
     'person', 'human', 'man', 'woman', 'child', 'people',
     'suit', 'jersey', 'sweatshirt', 'face'
-]
+])
 
-WOOD_CLASSES = [
+WOOD_CLASSES = _keyword_list('ML_WOOD_CLASSES', [
     'tree', 'wood', 'timber', 'log', 'bark', 'trunk',
     'wooden', 'lumber', 'palm', 'coconut', 'plant',
     'outdoor', 'forest', 'plant stem', 'stick', 'branch',
     'potted plant', 'flowerpot'
-]
+])
+
+# (wnid, name) for the 1000 ImageNet classes, loaded with the models
+imagenet_labels = None
+_category_index = None
+_category_index_lock = threading.Lock()
+
+def get_category_index():
+    """
+    Human/wood masks over all 1000 ImageNet classes. Built once, and rebuilt
+    automatically if HUMAN_CLASSES or WOOD_CLASSES are changed at runtime.
+    """
+    global _category_index
+    categories = {'human': tuple(HUMAN_CLASSES), 'wood': tuple(WOOD_CLASSES)}
+    index = _category_index
+    if index is None or index.categories != categories:
+        with _category_index_lock:
+            index = _category_index
+            if index is None or index.categories != categories:
+                index = CategoryIndex(imagenet_labels, categories)
+                _category_index = index
+    return index
+
+def result_cache_version(model_version=None, multi_log=False):
+    """Model version, category lists and detection settings: all change what predict() returns"""
+    settings = repr((CASCADE, HUMAN_CONFIDENCE, BROWN_MODEL_CONFIDENCE, CASCADE_MIN_BROWN_RATIO,
+                     multi_log and (MULTI_LOG_MIN_AREA, MULTI_LOG_MAX_OBJECTS)))
+    settings_hash = hashlib.sha1(settings.encode()).hexdigest()[:8]
+    return f'{model_version or MODEL_VERSION}-{get_category_index().fingerprint}-{settings_hash}'
 
 def decode_predictions_imagenet(preds, top=5):
     """Decode ImageNet predictions to class names"""
-    decode = tf.keras.applications.mobilenet_v2.decode_predictions(preds, top=top)
-    return decode[0]
+    return get_category_index().decode(preds, top=top)[0]
 
-def preprocess_image(image_data):
-    """Convert base64 image to preprocessed tensor"""
+def decode_base64_image(image_data):
+    """Base64 (optionally a data URL) -> raw image file bytes"""
     # Remove data URL prefix if present
     if ',' in image_data:
         image_data = image_data.split(',')[1]
     
     # Decode base64
-    image_bytes = base64.b64decode(image_data)
-    image = Image.open(io.BytesIO(image_bytes))
-    
-    # Convert to RGB if needed
-    if image.mode != 'RGB':
-        image = image.convert('RGB')
-    
-    # Resize to model input size
-    image = image.resize((224, 224))
+    return base64.b64decode(image_data)
+
+def preprocess_image(image_data):
+    """Convert base64 image to preprocessed tensor"""
+    return preprocess_image_bytes(decode_base64_image(image_data))
+
+def preprocess_image_bytes(image_bytes):
+    """
+    Convert raw image file bytes (bytes or memoryview) to 224x224x3 uint8
+    pixels + the 224x224 PIL image. The float model input is only written
+    when the image joins a batch (run_model_batch). JPEGs are decoded at
+    reduced resolution (draft mode) unless ML_REDUCED_DECODE=0.
+    """
+    with STAGE_SECONDS.time(stage='decode'):
+        image = open_image(image_bytes, (224, 224) if REDUCED_DECODE else None)
+        image.load()
     
-    # Convert to array and preprocess
-    image_array = np.array(image)
-    image_array = tf.keras.applications.mobilenet_v2.preprocess_input(image_array)
-    image_array = np.expand_dims(image_array, axis=0)
+    with STAGE_SECONDS.time(stage='preprocess'):
+        # Convert to RGB if needed
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+        
+        # Resize to model input size
+        image = image.resize((224, 224))
+        
+        # Keep uint8 pixels; scaling happens straight into the pooled batch buffer
+        image_array = np.asarray(image)
     
     return image_array, image
 
-def estimate_tree_measurements(image_pil):
+def segment_image(image_pil):
+    """Brown segmentation for one image; large images take the resolution-pyramid path"""
+    return segment_brown(image_pil, PYRAMID_MIN_SIDE, PYRAMID_WORKING_SIDE)
+
+# Measurement calibration shared by single- and multi-log measurements: assumed
+# camera field of view and typical scenarios mapping pixels to real-world sizes
+PIXEL_TO_METER_HEIGHT = 0.02  # 1 pixel = 2 cm
+PIXEL_TO_CM_WIDTH = 2  # 1 pixel = 2 cm
+HEIGHT_RANGE_M = (3, 20)
+WIDTH_RANGE_CM = (15, 100)
+BOARD_FEET_PER_CUBIC_M = 424
+MIN_BOARD_FEET = 40
+# (fill ratio above which the grade applies, grade, score), best first
+QUALITY_GRADES = ((0.75, 'Premium', 90), (0.60, 'Grade A', 80), (0.45, 'Grade B', 70))
+LOWEST_GRADE = ('Grade C', 60)
+
+def grade_quality(fill_ratio):
+    """Quality grade and score from how much of its bounding box an object fills"""
+    for threshold, quality, quality_score in QUALITY_GRADES:
+        if fill_ratio > threshold:
+            return quality, quality_score
+    return LOWEST_GRADE
+
+def estimate_tree_measurements(image_pil, segmentation=None):
     """
     Estimate tree dimensions using brown color detection and computer vision
     Returns: height (m), width (cm), volume (board feet), and quality assessment
     """
-    # Convert PIL to OpenCV
-    img_cv = cv2.cvtColor(np.array(image_pil), cv2.COLOR_RGB2BGR)
-    height_px, width_px = img_cv.shape[:2]
-    
-    print(f"📐 Image dimensions: {width_px}x{height_px} pixels")
-    
-    # Convert to HSV for better brown color detection
-    hsv = cv2.cvtColor(img_cv, cv2.COLOR_BGR2HSV)
-    
-    # Define comprehensive brown color ranges to detect ALL brown variations
-    # Brown exists primarily in H=0-40 range (includes reds, oranges, yellows, browns)
-    
-    # Range 1: Reddish-brown (red spectrum: H=0-10)
-    lower_brown1 = np.array([0, 20, 20])
-    upper_brown1 = np.array([10, 255, 255])
-    
-    # Range 2: Orange-brown (H=10-25)
-    lower_brown2 = np.array([10, 20, 20])
-    upper_brown2 = np.array([25, 255, 255])
+    # Reuse the shared brown segmentation if the caller already computed it
+    if segmentation is None:
+        segmentation = segment_image(image_pil)
+    height_px, width_px = segmentation.shape
     
-    # Range 3: Yellow-brown (H=25-40, the brown/tan range)
-    lower_brown3 = np.array([25, 15, 15])
-    upper_brown3 = np.array([40, 255, 255])
+    logger.debug(f"📐 Image dimensions: {width_px}x{height_px} pixels")
     
-    # Range 4: Dark browns with LOW saturation (grayish/muted browns)
-    lower_brown4 = np.array([0, 5, 10])
-    upper_brown4 = np.array([40, 80, 255])
+    # Brown mask (all brown color variations) cleaned with close + open morphology
+    brown_pixels = segmentation.brown_pixel_count
     
-    # Range 5: Very light/pale browns (high V, low-mid S)
-    lower_brown5 = np.array([15, 10, 100])
-    upper_brown5 = np.array([35, 100, 255])
+    logger.debug(f"🟤 Brown pixels detected: {brown_pixels} / {width_px * height_px}")
     
-    # Create masks for ALL brown color variations
-    mask1 = cv2.inRange(hsv, lower_brown1, upper_brown1)
-    mask2 = cv2.inRange(hsv, lower_brown2, upper_brown2)
-    mask3 = cv2.inRange(hsv, lower_brown3, upper_brown3)
-    mask4 = cv2.inRange(hsv, lower_brown4, upper_brown4)
-    mask5 = cv2.inRange(hsv, lower_brown5, upper_brown5)
+    # Largest contour on the cleaned brown mask (the tree trunk)
+    largest_object = segmentation.largest_object
     
-    # Combine all brown masks
-    brown_mask = cv2.bitwise_or(mask1, mask2)
-    brown_mask = cv2.bitwise_or(brown_mask, mask3)
-    brown_mask = cv2.bitwise_or(brown_mask, mask4)
-    brown_mask = cv2.bitwise_or(brown_mask, mask5)
-    
-    # Apply morphological operations to clean the mask
-    kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (5, 5))
-    brown_mask = cv2.morphologyEx(brown_mask, cv2.MORPH_CLOSE, kernel)
-    brown_mask = cv2.morphologyEx(brown_mask, cv2.MORPH_OPEN, kernel)
-    
-    print(f"🟤 Brown pixels detected: {np.count_nonzero(brown_mask)} / {brown_mask.size}")
-    
-    # Find contours on the brown mask
-    contours, _ = cv2.findContours(brown_mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-    
-    if contours:
-        # Find largest contour (the tree trunk)
-        largest_contour = max(contours, key=cv2.contourArea)
-        x, y, w, h = cv2.boundingRect(largest_contour)
+    if largest_object is not None:
+        (x, y, w, h), contour_area = largest_object
         
-        print(f"📍 Object location: x={x}, y={y}")
-        print(f"📏 Object size in pixels: width={w}, height={h}")
+        logger.debug(f"📍 Object location: x={x}, y={y}")
+        logger.debug(f"📏 Object size in pixels: width={w}, height={h}")
         
         # Calculate contour area and fill ratio for quality
-        contour_area = cv2.contourArea(largest_contour)
         bbox_area = w * h
         fill_ratio = contour_area / bbox_area if bbox_area > 0 else 0
         
-        print(f"🎯 Fill ratio: {fill_ratio:.2%}")
+        logger.debug(f"🎯 Fill ratio: {fill_ratio:.2%}")
         
         # ========== MEASUREMENT CALIBRATION ==========
         # Assumed camera field of view and typical measurement scenarios
@@ -165,18 +654,18 @@ def estimate_tree_measurements(image_pil):
         # Height calculation (vertical extent in image)
         # Typical tree height 8-15m, image height ~480px
         # So: 1 pixel ≈ 0.02m for height
-        pixel_to_meter_height = 0.02  # 1 pixel = 2 cm
-        estimated_height_m = max(3, min(20, (h * pixel_to_meter_height)))  # Clamp between 3-20m
+        min_height_m, max_height_m = HEIGHT_RANGE_M
+        estimated_height_m = max(min_height_m, min(max_height_m, (h * PIXEL_TO_METER_HEIGHT)))  # Clamp 3-20m
         
         # Width calculation (horizontal extent - trunk diameter or log width)
         # Typical trunk width 20-80cm, image width varies
         # So: 1 pixel ≈ 1-2 cm for width/diameter
-        pixel_to_cm_width = 2  # 1 pixel = 2 cm
-        estimated_width_cm = max(15, min(100, (w * pixel_to_cm_width)))  # Clamp between 15-100cm
+        min_width_cm, max_width_cm = WIDTH_RANGE_CM
+        estimated_width_cm = max(min_width_cm, min(max_width_cm, (w * PIXEL_TO_CM_WIDTH)))  # Clamp 15-100cm
         
-        print(f"📐 Calculated measurements:")
-        print(f"   Height: {estimated_height_m:.1f} m ({h} px × {pixel_to_meter_height})")
-        print(f"   Width:  {estimated_width_cm:.0f} cm ({w} px × {pixel_to_cm_width})")
+        logger.debug("📐 Calculated measurements:")
+        logger.debug(f"   Height: {estimated_height_m:.1f} m ({h} px × {PIXEL_TO_METER_HEIGHT})")
+        logger.debug(f"   Width:  {estimated_width_cm:.0f} cm ({w} px × {PIXEL_TO_CM_WIDTH})")
         
         # ========== VOLUME ESTIMATION ==========
         # Using Smalian's formula: V = (D²/4) × π × L
@@ -189,30 +678,19 @@ def estimate_tree_measurements(image_pil):
         volume_cubic_m = ((diameter_m ** 2) / 4) * 3.14159 * length_m
         
         # Convert to board feet (1 cubic meter ≈ 424 board feet)
-        board_feet = max(40, int(volume_cubic_m * 424))
+        board_feet = max(MIN_BOARD_FEET, int(volume_cubic_m * BOARD_FEET_PER_CUBIC_M))
         
-        print(f"📦 Volume calculation:")
-        print(f"   Diameter: {diameter_m:.3f} m")
-        print(f"   Length:   {length_m:.2f} m")
-        print(f"   Volume:   {volume_cubic_m:.4f} m³")
-        print(f"   Board feet: {board_feet}")
+        logger.debug("📦 Volume calculation:")
+        logger.debug(f"   Diameter: {diameter_m:.3f} m")
+        logger.debug(f"   Length:   {length_m:.2f} m")
+        logger.debug(f"   Volume:   {volume_cubic_m:.4f} m³")
+        logger.debug(f"   Board feet: {board_feet}")
         
         # ========== QUALITY ASSESSMENT ==========
         # Based on contour uniformity and fill ratio
-        if fill_ratio > 0.75:
-            quality = "Premium"
-            quality_score = 90
-        elif fill_ratio > 0.60:
-            quality = "Grade A"
-            quality_score = 80
-        elif fill_ratio > 0.45:
-            quality = "Grade B"
-            quality_score = 70
-        else:
-            quality = "Grade C"
-            quality_score = 60
+        quality, quality_score = grade_quality(fill_ratio)
         
-        print(f"🏆 Quality: {quality} ({quality_score}/100)")
+        logger.debug(f"🏆 Quality: {quality} ({quality_score}/100)")
         
         return {
             'height': str(round(estimated_height_m, 1)),
@@ -227,12 +705,12 @@ def estimate_tree_measurements(image_pil):
                 'volume_cubic_m': round(volume_cubic_m, 4),
                 'board_feet': board_feet,
                 'fill_ratio': round(fill_ratio, 2),
-                'pixels_detected': np.count_nonzero(brown_mask)
+                'pixels_detected': brown_pixels
             }
         }
     
     else:
-        print("⚠️  No contours found in brown mask")
+        logger.debug("⚠️  No contours found in brown mask")
     
     # Default values if detection fails
     return {
@@ -252,210 +730,1007 @@ def estimate_tree_measurements(image_pil):
         }
     }
 
-def is_wood_like(image_pil):
+# Response fields added by multi-log mode
+MULTI_LOG_FIELDS = ('logs', 'logCount', 'totalLumber', 'totalVolumeCubicM')
+
+def estimate_log_measurements(image_pil, segmentation=None):
     """
-    Heuristic for stacked lumber/planks:
-    - Detects ALL brown color variations (light, dark, medium, reddish, yellowish, orange, etc.)
-    - Strong straight-edge density
+    Multi-log mode for stacked lumber: measures every connected brown region
+    covering at least MULTI_LOG_MIN_AREA of the frame (largest first, at most
+    MULTI_LOG_MAX_OBJECTS) in one vectorized pass over the connected-component
+    statistics, with the same calibration as estimate_tree_measurements()
+    Returns: estimate_tree_measurements() for the largest object, plus 'logs'
+    (height/width/board feet/quality per log), 'logCount', 'totalLumber'
+    and 'totalVolumeCubicM'
     """
-    img_cv = cv2.cvtColor(np.array(image_pil), cv2.COLOR_RGB2BGR)
-    hsv = cv2.cvtColor(img_cv, cv2.COLOR_BGR2HSV)
-
-    # Comprehensive brown color masks covering ALL brown variations
-    # Range 1: Reddish-brown (H=0-10)
-    lower_brown1 = np.array([0, 20, 20])
-    upper_brown1 = np.array([10, 255, 255])
+    if segmentation is None:
+        segmentation = segment_image(image_pil)
+    height_px, width_px = segmentation.shape
+    measurements = estimate_tree_measurements(image_pil, segmentation)
     
-    # Range 2: Orange-brown (H=10-25)
-    lower_brown2 = np.array([10, 20, 20])
-    upper_brown2 = np.array([25, 255, 255])
+    # Qualifying components, largest first
+    stats = segmentation.component_stats
+    areas = stats[:, 4]
+    keep = np.flatnonzero(areas >= MULTI_LOG_MIN_AREA * height_px * width_px)
+    keep = keep[np.argsort(-areas[keep], kind='stable')][:MULTI_LOG_MAX_OBJECTS]
+    x, y, w, h, area = stats[keep].T
     
-    # Range 3: Yellow-brown (H=25-40)
-    lower_brown3 = np.array([25, 15, 15])
-    upper_brown3 = np.array([40, 255, 255])
+    # Every log at once: fill ratio, clamped size, Smalian volume, board feet
+    fill_ratio = area / np.maximum(w * h, 1)
+    height_m = np.clip(h * PIXEL_TO_METER_HEIGHT, *HEIGHT_RANGE_M)
+    width_cm = np.clip(w * PIXEL_TO_CM_WIDTH, *WIDTH_RANGE_CM)
+    volume_cubic_m = (((width_cm / 100) ** 2) / 4) * 3.14159 * height_m
+    board_feet = np.maximum(MIN_BOARD_FEET, (volume_cubic_m * BOARD_FEET_PER_CUBIC_M).astype(np.int64))
     
-    # Range 4: Dark/muted browns (low saturation)
-    lower_brown4 = np.array([0, 5, 10])
-    upper_brown4 = np.array([40, 80, 255])
+    logs = []
+    for i in range(len(keep)):
+        quality, quality_score = grade_quality(fill_ratio[i])
+        logs.append({
+            'height': str(round(float(height_m[i]), 1)),
+            'width': str(int(width_cm[i])),
+            'diameter': str(int(width_cm[i])),
+            'estimatedLumber': str(int(board_feet[i])),
+            'quality': quality,
+            'qualityScore': quality_score,
+            'fillRatio': round(float(fill_ratio[i]), 2),
+            'box': {'x': int(x[i]), 'y': int(y[i]), 'width': int(w[i]), 'height': int(h[i])},
+        })
     
-    # Range 5: Light/pale browns (high value, low-mid saturation)
-    lower_brown5 = np.array([15, 10, 100])
-    upper_brown5 = np.array([35, 100, 255])
-
-    # Combine all brown detection masks
-    mask1 = cv2.inRange(hsv, lower_brown1, upper_brown1)
-    mask2 = cv2.inRange(hsv, lower_brown2, upper_brown2)
-    mask3 = cv2.inRange(hsv, lower_brown3, upper_brown3)
-    mask4 = cv2.inRange(hsv, lower_brown4, upper_brown4)
-    mask5 = cv2.inRange(hsv, lower_brown5, upper_brown5)
+    logger.debug(f"🪵 Multi-log: {len(logs)} of {len(stats)} brown regions measured")
     
-    mask = cv2.bitwise_or(mask1, mask2)
-    mask = cv2.bitwise_or(mask, mask3)
-    mask = cv2.bitwise_or(mask, mask4)
-    mask = cv2.bitwise_or(mask, mask5)
+    measurements.update({
+        'logs': logs,
+        'logCount': len(logs),
+        'totalLumber': str(int(board_feet.sum())),
+        'totalVolumeCubicM': round(float(volume_cubic_m.sum()), 4),
+    })
+    return measurements
+
+def multi_log_requested():
+    """Multi-log mode for the current request: ?multiLog=1 / ?multiLog=0, else ML_MULTI_LOG"""
+    if has_request_context():
+        value = request.args.get('multiLog')
+        if value is not None:
+            return value.lower() not in ('', '0', 'false', 'no')
+    return MULTI_LOG
+
+def is_wood_like(image_pil, segmentation=None):
+    """
+    Heuristic for stacked lumber/planks:
+    - Detects ALL brown color variations (light, dark, medium, reddish, yellowish, orange, etc.)
+    - Strong straight-edge density
+    """
+    if segmentation is None:
+        segmentation = segment_image(image_pil)
 
-    brown_ratio = float(np.count_nonzero(mask)) / float(mask.size)
+    # Share of pixels inside any of the brown HSV ranges
+    brown_ratio = segmentation.brown_ratio
 
     # Edge density for plank-like structure
-    gray = cv2.cvtColor(img_cv, cv2.COLOR_BGR2GRAY)
-    edges = cv2.Canny(gray, 50, 150)
-    edge_ratio = float(np.count_nonzero(edges)) / float(edges.size)
+    edge_ratio = segmentation.edge_ratio
 
     return brown_ratio > 0.15 and edge_ratio > 0.05
 
+def interpret_brown_prediction(prediction):
+    """
+    Turn the custom model's sigmoid output into (is_brown, confidence)
+    """
+    # Brown if prediction > 0.5 (a plain bool: classify_image() checks `is True`)
+    is_brown = bool(prediction > 0.5)
+    confidence = prediction if is_brown else (1 - prediction)
+    
+    logger.debug(f"🤖 Custom model: Brown detected={is_brown}, Confidence={confidence:.2%}")
+    
+    return is_brown, float(confidence)
+
 def detect_brown_with_custom_model(image_pil):
     """
     Use trained custom brown detector model if available
     Returns: is_brown (bool), confidence (float 0-1)
     """
-    if custom_brown_detector is None:
+    prediction = run_brown_batch([image_pil.resize((224, 224))])[0]
+    if prediction is None:
         return None, None
+    return interpret_brown_prediction(prediction)
+
+# ==================== BATCHED INFERENCE ====================
+# Reusable float32 input batches: one per concurrent model call, at most INPUT_BUFFERS kept idle
+input_buffers = BufferPool(batch_size=BATCH_MAX_SIZE, max_idle=INPUT_BUFFERS)
+
+def run_model_batch(items):
+    """
+    Run the inference backend once over a stacked batch.
+    Each item is (pixels, image_pil, with_brown) from model_inputs(); the
+    pixels are scaled straight into pooled float32 batches.
+    Returns one (predictions, brown_prediction, backend) triple per item,
+    with predictions shaped (1, 1000) like a single call, brown_prediction
+    None without a model (or when a separate brown model was not asked for)
+    and backend the models that produced them: a later brown model pass for
+    the same images has to run on it too (run_brown_batch), and its
+    model_version labels the results.
+    """
+    # One backend for the whole batch, even if a reload swaps models meanwhile
+    backend = inference_backend
+    brown_indices = [i for i, item in enumerate(items) if item[2]]
+    needs_brown_batch = backend.needs_brown_input and brown_indices
     
-    try:
-        # Preprocess image for model
-        img_array = np.array(image_pil.resize((224, 224))) / 255.0
-        img_batch = np.expand_dims(img_array, axis=0)
-        
-        # Predict
-        prediction = custom_brown_detector.predict(img_batch, verbose=0)[0][0]
+    BATCH_SIZES.observe(len(items))
+    with input_buffers.batch(len(items)) as imagenet_batch, \
+            (input_buffers.batch(len(brown_indices)) if needs_brown_batch else nullcontext()) as brown_batch:
+        for out, item in zip(imagenet_batch, items):
+            write_mobilenet_input(item[0], out)
+        if brown_batch is not None:
+            for out, i in zip(brown_batch, brown_indices):
+                write_unit_input(items[i][0], out)
+        predictions, brown_output = backend.predict_batch(imagenet_batch, brown_batch)
+    
+    brown_predictions = [None] * len(items)
+    if brown_output is not None:
+        # A separate brown model only ran on the items that asked for it; a combined model on all
+        for output_index, i in enumerate(brown_indices if brown_batch is not None else range(len(items))):
+            brown_predictions[i] = brown_output[output_index]
+    
+    return [
+        (predictions[i:i + 1], brown_predictions[i], backend)
+        for i in range(len(items))
+    ]
+
+def model_inputs(image_array, image_pil, with_brown=True):
+    """
+    Per-image batch item for run_model_batch(): 224x224x3 uint8 pixels from
+    preprocess_image_bytes(). Both models' inputs are derived from them.
+    with_brown=False leaves out a separate brown model (the cascade runs it
+    later with run_brown_batch(), only if still needed)
+    """
+    return image_array, image_pil, with_brown
+
+def run_brown_batch(images, backend=None):
+    """
+    Custom brown detector alone over a batch of 224x224 PIL images: the
+    cascade's second model pass, for the images the ImageNet pass left open
+    backend: the backend of their ImageNet pass (default: the current one),
+    so a hot reload in between cannot mix two model versions in one result
+    Returns one brown prediction (or None) per image
+    """
+    backend = backend or inference_backend
+    if not backend.has_brown_model:
+        return [None] * len(images)
+    
+    # A combined model's brown head takes the ImageNet preprocessing
+    write_input = write_unit_input if backend.needs_brown_input else write_mobilenet_input
+    
+    BATCH_SIZES.observe(len(images))
+    with input_buffers.batch(len(images)) as brown_batch:
+        for out, image_pil in zip(brown_batch, images):
+            write_input(np.asarray(image_pil), out)
+        try:
+            brown_output = backend.predict_brown(brown_batch)
+        except Exception as e:
+            logger.warning(f"⚠️  Custom model error: {e}")
+            return [None] * len(images)
+    return [brown_output[i] for i in range(len(images))]
+
+def run_brown_items(items):
+    """brown_batcher batch of (image_pil, backend) items: one run_brown_batch() per backend"""
+    results = [None] * len(items)
+    for backend, indices in _group_by_backend([backend for _, backend in items]):
+        for i, brown_prediction in zip(indices, run_brown_batch([items[i][0] for i in indices], backend)):
+            results[i] = brown_prediction
+    return results
+
+def _group_by_backend(backends):
+    """[(backend, [indices])] in first-seen order"""
+    groups = {}
+    for i, backend in enumerate(backends):
+        groups.setdefault(id(backend), (backend, []))[1].append(i)
+    return list(groups.values())
+
+# ==================== PIPELINE ====================
+# Each image moves through three stages with their own workers:
+#   decode (decode_pool) -> model inference (inference_batcher)
+#                        -> OpenCV analysis (analysis_pool), in parallel with inference
+# so under load throughput is bounded by the slowest stage, not the sum of all of them.
+# With the detection cascade (ML_CASCADE, the default) /predict and camera frames
+# instead run the stages one after another and stop early (see DETECTION CASCADE).
+decode_pool = ThreadPoolExecutor(max_workers=DECODE_WORKERS, thread_name_prefix='decode')
+analysis_pool = ThreadPoolExecutor(max_workers=ANALYSIS_WORKERS, thread_name_prefix='analysis')
+
+inference_batcher = MicroBatcher(
+    run_model_batch,
+    max_batch_size=BATCH_MAX_SIZE,
+    max_wait_ms=BATCH_MAX_WAIT_MS,
+    max_queue_size=BATCH_QUEUE_SIZE,
+    name='inference-batcher'
+)
+# Second model pass of the detection cascade (separate brown model only)
+brown_batcher = MicroBatcher(
+    run_brown_items,
+    max_batch_size=BATCH_MAX_SIZE,
+    max_wait_ms=BATCH_MAX_WAIT_MS,
+    max_queue_size=BATCH_QUEUE_SIZE,
+    name='brown-batcher'
+)
+
+# ==================== METRICS ====================
+REQUESTS = REGISTRY.counter(
+    'ml_requests_total', 'Prediction requests by endpoint and HTTP status', ('endpoint', 'status')
+)
+REQUEST_SECONDS = REGISTRY.histogram(
+    'ml_request_duration_seconds', 'End-to-end prediction request latency', ('endpoint',)
+)
+DETECTIONS = REGISTRY.counter(
+    'ml_detections_total', 'Classified images by detectedClass and detectionMethod',
+    ('detected_class', 'detection_method', 'cached')
+)
+ERRORS = REGISTRY.counter(
+    'ml_errors_total', 'Failed requests or images by endpoint and reason', ('endpoint', 'reason')
+)
+BATCH_SIZES = REGISTRY.histogram(
+    'ml_inference_batch_size', 'Images per model call', buckets=(1, 2, 4, 8, 16, 32, 64)
+)
+REGISTRY.gauge('ml_inference_queue_depth', 'Requests waiting for the micro-batcher', lambda: inference_batcher.qsize())
+REGISTRY.gauge('ml_models_ready', '1 once the models are loaded and warmed up', lambda: int(models_ready()))
+REGISTRY.gauge('ml_result_cache_entries', 'Results held in the in-memory cache', lambda: result_cache.stats()['entries'])
+REGISTRY.gauge('ml_input_buffer_allocations', 'Model input batch buffers allocated (pool misses)', lambda: input_buffers.allocations)
+CASCADE_STAGE_RUNS = REGISTRY.counter(
+    'ml_cascade_stages_total', 'Detection cascade stages per classified image, ran or skipped', ('stage', 'outcome')
+)
+
+def record_detection(result, cached=False):
+    if 'detectedClass' in result:
+        DETECTIONS.inc(
+            detected_class=result['detectedClass'],
+            detection_method=result.get('detectionMethod', 'none'),
+            cached='true' if cached else 'false'
+        )
+        if not cached:
+            stages_run = result.get('stagesRun', ())
+            for stage in CASCADE_STAGES:
+                CASCADE_STAGE_RUNS.inc(stage=stage, outcome='ran' if stage in stages_run else 'skipped')
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request_metrics(response):
+    if request.endpoint in ('predict', 'predict_batch', 'stream_frame'):
+        REQUESTS.inc(endpoint=request.endpoint, status=response.status_code)
+        REQUEST_SECONDS.observe(time.perf_counter() - g.request_started, endpoint=request.endpoint)
+    return response
+
+# ==================== ADMISSION CONTROL ====================
+# Bounded work queue in front of the prediction endpoints. Clients (the Node
+# proxy) may send a deadline; requests whose deadline has passed are dropped
+# before admission and again before their model batch runs, so work the
+# client already abandoned is not computed.
+admission = AdmissionController(
+    max_concurrent=MAX_CONCURRENT,
+    max_queue=ADMISSION_QUEUE_SIZE,
+    queue_timeout_s=ADMISSION_QUEUE_TIMEOUT_S,
+    retry_after_s=OVERLOAD_RETRY_AFTER_S
+)
+if 0 < MAX_CONCURRENT < BATCH_MAX_SIZE:
+    print(f"⚠️  ML_MAX_CONCURRENT={MAX_CONCURRENT} is below ML_BATCH_MAX_SIZE={BATCH_MAX_SIZE}: "
+          f"micro-batches will hold at most {MAX_CONCURRENT} /predict requests")
+REGISTRY.gauge('ml_admission_in_flight', 'Prediction requests holding an admission slot', lambda: admission.in_flight())
+REGISTRY.gauge('ml_admission_queue_depth', 'Prediction requests waiting for an admission slot', lambda: admission.waiting())
+
+def request_deadline():
+    """Client deadline (time.monotonic()) of the current request, None outside requests or without one"""
+    return g.get('deadline') if has_request_context() else None
+
+def overloaded_response(endpoint, message, reason='overloaded'):
+    """503 + Retry-After when the service sheds load"""
+    ERRORS.inc(endpoint=endpoint, reason=reason)
+    logger.warning(f"⚠️  {message}")
+    response = jsonify({'error': message})
+    response.status_code = 503
+    response.headers['Retry-After'] = str(OVERLOAD_RETRY_AFTER_S)
+    return response
+
+def deadline_response(endpoint, message):
+    """504 for requests dropped because the client's deadline passed"""
+    ERRORS.inc(endpoint=endpoint, reason='deadline')
+    logger.info(f"⏱️  {message} ({endpoint})")
+    return jsonify({'error': message}), 504
+
+def admission_controlled(view):
+    """
+    Run a prediction view inside an admission slot, honouring the client's
+    X-Request-Deadline (Unix ms) / X-Request-Timeout-Ms (remaining ms) headers
+    """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        try:
+            g.deadline = parse_deadline(
+                request.headers.get('X-Request-Deadline'), request.headers.get('X-Request-Timeout-Ms')
+            )
+        except ValueError:
+            return jsonify({'error': 'Invalid X-Request-Deadline or X-Request-Timeout-Ms header'}), 400
         
-        # Brown if prediction > 0.5
-        is_brown = prediction > 0.5
-        confidence = prediction if is_brown else (1 - prediction)
+        try:
+            with admission.slot(g.deadline):
+                return view(*args, **kwargs)
+        except OverloadedError as e:
+            return overloaded_response(request.endpoint, str(e))
+        except DeadlineExceededError as e:
+            return deadline_response(request.endpoint, str(e))
+    return wrapper
+
+def _wait_for_batch(future):
+    timeout = BATCH_RESULT_TIMEOUT_S
+    deadline = request_deadline()
+    if deadline is not None:
+        timeout = max(0.0, min(timeout, remaining_s(deadline)))
+    try:
+        return future.result(timeout=timeout)
+    except FutureTimeoutError:
+        future.cancel()
+        if deadline is not None and remaining_s(deadline) <= 0:
+            raise DeadlineExceededError('Request deadline passed during inference')
+        raise
+
+def run_models(image_array, image_pil, with_brown=True):
+    """
+    Queue one preprocessed image on the micro-batcher and wait for its result
+    with_brown=False skips a separate brown model (a combined model always has its output)
+    Returns: ImageNet predictions (1, 1000), custom brown prediction or None, the backend that ran
+    """
+    return _wait_for_batch(
+        inference_batcher.submit(model_inputs(image_array, image_pil, with_brown), deadline=request_deadline())
+    )
+
+def run_brown_model(image_pil, backend):
+    """
+    Queue one 224x224 PIL image for the cascade's brown model pass on `backend`
+    (the one that ran its ImageNet pass); brown prediction or None
+    """
+    return _wait_for_batch(brown_batcher.submit((image_pil, backend), deadline=request_deadline()))
+
+def analyze_image(image_pil):
+    """
+    OpenCV stage: brown mask, edges and contours for one image, computed up
+    front so classify_image() only reads the cached results
+    """
+    segmentation = segment_image(image_pil)
+    with STAGE_SECONDS.time(stage='hsv_mask'):
+        segmentation.brown_ratio
+    with STAGE_SECONDS.time(stage='canny'):
+        segmentation.edge_ratio
+    with STAGE_SECONDS.time(stage='contours'):
+        segmentation.largest_object
+    return segmentation
+
+def decode_image(image_bytes):
+    """Decode stage: preprocessed (array, 224x224 PIL image) via decode_pool"""
+    return decode_pool.submit(preprocess_image_bytes, memoryview(image_bytes)).result()
+
+def run_pipeline(image_bytes):
+    """
+    Run one uploaded image through the decode, inference and analysis stages
+    Returns: response dict from classify_image()
+    """
+    return run_decoded_pipeline(*decode_image(image_bytes))
+
+def run_decoded_pipeline(image_array, image_pil):
+    """Inference and analysis stages for an already decoded image"""
+    if CASCADE:
+        return run_cascade(image_array, image_pil)
+    
+    # OpenCV analysis overlaps with the model passes
+    analysis = analysis_pool.submit(analyze_image, image_pil)
+    predictions, custom_brown_prediction, backend = run_models(image_array, image_pil)
+    
+    result = classify_image(image_pil, predictions, custom_brown_prediction,
+                            segmentation=analysis.result(), stages_run=ANALYSIS_STAGES)
+    result['modelVersion'] = backend.model_version
+    return result
+
+# ==================== DETECTION CASCADE ====================
+# Stages in the order they run, with their cost for one 224x224 image on one CPU core:
+#   brown_ratio      ~0.5 ms  share of brown pixels (HSV mask)
+#   imagenet         ~145 ms  MobileNetV2 ImageNet pass: human/wood checks and rawPredictions,
+#                             needed by every answer
+#   brown_model      ~140 ms  separate custom brown detector (free with a combined model)
+#   wood_heuristic   ~1.6 ms  is_wood_like() edge density (Canny), when ImageNet saw no wood
+#   measurement      ~0.4 ms  contours + estimate_tree_measurements(), cocolumber only
+# A stage only runs while the stages before it leave the answer open:
+#   - ImageNet says human (> HUMAN_CONFIDENCE): done, nothing after it runs
+#   - the custom model says brown (> BROWN_MODEL_CONFIDENCE): wood_heuristic is skipped
+# Any other image needs the custom model, which can decide cocolumber on its own.
+# ML_CASCADE_MIN_BROWN_RATIO > 0 also skips it for images with almost no brown pixels
+# where ImageNet saw no wood; that is an approximation which reports not_cocolumber
+# even when the custom model would have said brown.
+CASCADE_STAGES = ('brown_ratio', 'imagenet', 'brown_model', 'wood_heuristic', 'measurement')
+# Stages analyze_image() computes up front for the non-cascade paths
+ANALYSIS_STAGES = ('brown_ratio', 'wood_heuristic')
+
+def is_human(summary):
+    return summary['human_detected'] and summary['max_confidence'] > HUMAN_CONFIDENCE
+
+def needs_brown_model(summary, segmentation):
+    """
+    Whether the custom model can still change the answer after the ImageNet pass
+    segmentation: anything with a brown_ratio, or None when unknown
+    """
+    if not CASCADE or segmentation is None:
+        return True
+    if is_human(summary):
+        return False
+    if CASCADE_MIN_BROWN_RATIO <= 0 or summary['wood_detected']:
+        return True
+    return segmentation.brown_ratio > CASCADE_MIN_BROWN_RATIO
+
+def prefilter_image(image_pil):
+    """First cascade stage: the image's lazy segmentation, with only the brown ratio computed"""
+    segmentation = segment_image(image_pil)
+    with STAGE_SECONDS.time(stage='hsv_mask'):
+        segmentation.brown_ratio
+    return segmentation
+
+def run_cascade(image_array, image_pil):
+    """Detection cascade for one decoded image (see CASCADE_STAGES)"""
+    segmentation = prefilter_image(image_pil)
+    
+    # A combined model returns the brown output with this pass anyway
+    predictions, custom_brown_prediction, backend = run_models(image_array, image_pil, with_brown=False)
+    summary = get_category_index().summarize(predictions, top=10)[0]
+    
+    # The brown pass runs on the same models as the ImageNet pass, even across a hot reload
+    if custom_brown_prediction is None and backend.has_brown_model:
+        if needs_brown_model(summary, segmentation):
+            custom_brown_prediction = run_brown_model(image_pil, backend)
+    
+    result = classify_image(image_pil, predictions, custom_brown_prediction, summary, segmentation,
+                            stages_run=('brown_ratio',))
+    result['modelVersion'] = backend.model_version
+    return result
+
+def complete_brown_predictions(images, model_outputs, summaries, segmentations):
+    """
+    Cascade brown model pass for a batch: runs the custom model (in batches)
+    on the images whose ImageNet results leave the answer open
+    images: 224x224 PIL images; model_outputs: their run_model_batch() triples,
+    whose backends also run the brown pass
+    Returns: brown prediction (or None) per image
+    """
+    brown_predictions = [brown_prediction for _, brown_prediction, _ in model_outputs]
+    pending = [
+        i for i, (_, brown_prediction, backend) in enumerate(model_outputs)
+        if brown_prediction is None and backend.has_brown_model
+        and needs_brown_model(summaries[i], segmentations[i])
+    ]
+    for backend, indices in _group_by_backend([model_outputs[i][2] for i in pending]):
+        backend_pending = [pending[j] for j in indices]
+        for start in range(0, len(backend_pending), BATCH_MAX_SIZE):
+            chunk = backend_pending[start:start + BATCH_MAX_SIZE]
+            for i, brown_prediction in zip(chunk, run_brown_batch([images[i] for i in chunk], backend)):
+                brown_predictions[i] = brown_prediction
+    return brown_predictions
+
+def classify_image(image_pil, predictions, custom_brown_prediction, summary=None, segmentation=None,
+                   stages_run=()):
+    """
+    Apply the detection rules to one image's model outputs. The rules are
+    checked in cascade order and the OpenCV stages are only computed when a
+    rule needs them (segmentations are lazy).
+    summary: this image's CategoryIndex.summarize() entry, if already computed for a batch
+    segmentation: this image's analyze_image() / prefilter_image() result, if already computed
+    stages_run: CASCADE_STAGES that already ran outside this function (e.g. ANALYSIS_STAGES)
+    Returns: response dict (human / cocolumber with measurements / not_cocolumber) with 'stagesRun'
+    """
+    stages = {'imagenet', *stages_run}
+    
+    # Top-10 human/wood checks over the precomputed ImageNet category masks
+    if summary is None:
+        summary = get_category_index().summarize(predictions, top=10)[0]
+    
+    max_confidence = summary['max_confidence']
+    human_detected = summary['human_detected']
+    wood_detected = summary['wood_detected']
+    
+    # Log predictions for debugging
+    logger.debug(f"🔍 Top predictions: {[name.lower() for name in summary['top_classes']]}")
+    logger.debug(f"📊 Confidence scores: {summary['top_confidences']}")
+    logger.debug(f"👤 Human detected: {human_detected}")
+    logger.debug(f"🌳 Wood detected: {wood_detected}")
+    
+    # Try custom brown detector model FIRST if available
+    custom_brown_detected = None
+    custom_brown_confidence = 0
+    if custom_brown_prediction is not None:
+        stages.add('brown_model')
+        custom_brown_detected, custom_brown_confidence = interpret_brown_prediction(custom_brown_prediction)
+        logger.debug(f"🤖 Custom brown detector: {custom_brown_detected} (confidence: {custom_brown_confidence:.2%})")
+    
+    raw_predictions = [
+        {'class': name, 'confidence': confidence}
+        for name, confidence in zip(summary['top_classes'], summary['top_confidences'])
+    ]
+    
+    # One brown segmentation pass shared by the heuristic and the measurements (computed lazily)
+    if segmentation is None:
+        segmentation = segment_image(image_pil)
+    
+    # Determine final classification
+    if is_human(summary):
+        result = {
+            'detectedClass': 'human',
+            'confidence': int(max_confidence * 100),
+            'rawPredictions': raw_predictions
+        }
+    
+    # Check custom model FIRST, then fallback to other detection methods
+    elif custom_brown_detected is True and custom_brown_confidence > BROWN_MODEL_CONFIDENCE:
+        # Custom trained model detected brown with high confidence
+        measurements = _measure(image_pil, segmentation, stages)
+        logger.debug("✅ Using custom brown detector results")
         
-        print(f"🤖 Custom model: Brown detected={is_brown}, Confidence={confidence:.2%}")
+        result = {
+            'detectedClass': 'cocolumber',
+            'confidence': int(custom_brown_confidence * 100),
+            'height': measurements['height'],
+            'width': measurements['width'],
+            'diameter': measurements['diameter'],
+            'estimatedLumber': measurements['estimatedLumber'],
+            'quality': measurements['quality'],
+            'detectionMethod': 'custom_model',
+            'rawPredictions': raw_predictions
+        }
+        result.update((field, measurements[field]) for field in MULTI_LOG_FIELDS if field in measurements)
+    
+    # Heuristic for stacked lumber/planks (fallback), only needed when MobileNetV2 saw no wood
+    elif wood_detected or _check_wood_like(image_pil, segmentation, stages):
+        # If wood detected by MobileNetV2 or heuristic, treat as cocolumber and provide measurements
+        measurements = _measure(image_pil, segmentation, stages)
+        detection_method = 'mobilenet' if wood_detected else 'hsv_heuristic'
+        logger.debug(f"✅ Using {detection_method} detection results")
         
-        return is_brown, float(confidence)
-    except Exception as e:
-        print(f"⚠️  Custom model error: {e}")
-        return None, None
+        result = {
+            'detectedClass': 'cocolumber',
+            'confidence': int((max_confidence * 100) if wood_detected else 65),
+            'height': measurements['height'],
+            'width': measurements['width'],
+            'diameter': measurements['diameter'],
+            'estimatedLumber': measurements['estimatedLumber'],
+            'quality': measurements['quality'],
+            'detectionMethod': detection_method,
+            'rawPredictions': raw_predictions
+        }
+        result.update((field, measurements[field]) for field in MULTI_LOG_FIELDS if field in measurements)
+    
+    else:
+        # No cocolumber/wood detected - reject the image
+        result = {
+            'detectedClass': 'not_cocolumber',
+            'confidence': 0,
+            'error': 'No cocolumber detected. Only cocolumber/wood/logs/trees can be scanned.',
+            'rawPredictions': raw_predictions
+        }
+    
+    result['stagesRun'] = [stage for stage in CASCADE_STAGES if stage in stages]
+    return result
+
+def _measure(image_pil, segmentation, stages):
+    stages.add('measurement')
+    with STAGE_SECONDS.time(stage='measurement'):
+        if multi_log_requested():
+            return estimate_log_measurements(image_pil, segmentation)
+        return estimate_tree_measurements(image_pil, segmentation)
+
+def _check_wood_like(image_pil, segmentation, stages):
+    stages.update(('brown_ratio', 'wood_heuristic'))
+    # With the cascade the Canny edges are computed here, on demand
+    with STAGE_SECONDS.time(stage='wood_heuristic'):
+        wood_like = is_wood_like(image_pil, segmentation)
+    logger.debug(f"🪵 Wood-like heuristic: {wood_like}")
+    return wood_like
 
 @app.route('/health', methods=['GET'])
 def health_check():
-    """Health check endpoint"""
-    return jsonify({'status': 'healthy', 'service': 'ML Detection Service'})
+    """Health check endpoint: 200 only once the models are loaded"""
+    status = {'ready': 'healthy', 'failed': 'unhealthy'}.get(model_state['status'], 'starting')
+    return jsonify({
+        'status': status,
+        'service': 'ML Detection Service',
+        'models': model_state
+    }), 200 if models_ready() else 503
+
+@app.route('/health/live', methods=['GET'])
+def liveness():
+    """Liveness: the process is up and serving HTTP (models may still be loading)"""
+    return jsonify({'status': 'alive', 'modelStatus': model_state['status']})
+
+@app.route('/health/ready', methods=['GET'])
+def readiness():
+    """Readiness: models loaded and warmed up; 503 until then"""
+    if not models_ready():
+        response = jsonify(dict(model_state, ready=False))
+        response.status_code = 503
+        response.headers['Retry-After'] = '5'
+        return response
+    return jsonify(dict(model_state, ready=True))
+
+def cached_response(result, hit):
+    """JSON response with an X-Cache header telling whether the result was cached"""
+    response = jsonify(result)
+    response.headers['X-Cache'] = 'HIT' if hit else 'MISS'
+    return response
+
+def read_image_upload():
+    """
+    Raw image bytes from any supported upload style:
+    - multipart/form-data with an 'image' file field
+    - a binary body (Content-Type image/* or application/octet-stream)
+    - JSON {"image": "<base64 or data URL>"} (original format)
+    Returns None when the request carries no image.
+    """
+    if request.files:
+        upload = request.files.get('image') or next(iter(request.files.values()))
+        return upload.read()
+    
+    if request.mimetype.startswith('image/') or request.mimetype == 'application/octet-stream':
+        body = request.get_data(cache=False)
+        return body or None
+    
+    data = request.get_json(silent=True)
+    if not data or 'image' not in data:
+        return None
+    return decode_base64_image(data['image'])
+
+@app.route('/cache/stats', methods=['GET'])
+def cache_stats():
+    """Result cache hit/miss counters"""
+    return jsonify(dict(result_cache.stats(), modelVersion=MODEL_VERSION))
+
+@app.route('/models', methods=['GET'])
+def list_models():
+    """Registered model versions, the one being served and the last reload"""
+    versions = []
+    for version in model_registry.versions():
+        try:
+            metadata = model_registry.metadata(version)
+        except (OSError, ValueError):
+            metadata = {}
+        versions.append({
+            'version': version,
+            'created': metadata.get('created'),
+            'validation': metadata.get('validation'),
+            'files': sorted(metadata.get('files', {})),
+        })
+    return jsonify({
+        'modelVersion': MODEL_VERSION,
+        'registryCurrent': model_registry.current(),
+        'reload': reload_state,
+        'versions': versions,
+    })
+
+@app.route('/models/reload', methods=['POST'])
+def reload_models():
+    """
+    Hot-reload the models: {"version": "<registry version>"} or no body for
+    the registry's CURRENT version (or the ML_BROWN_MODEL files without a
+    registry). A given version is made CURRENT once it has loaded, so the
+    other workers switch too via the registry watch. Returns 202; progress is
+    in GET /models.
+    """
+    if ADMIN_TOKEN and not hmac.compare_digest(request.headers.get('X-Admin-Token', ''), ADMIN_TOKEN):
+        return jsonify({'error': 'Invalid admin token'}), 403
+    if model_state['status'] in ('not_started', 'loading'):
+        return not_ready_response()
+    error = registry_reload_error()
+    if error:
+        return jsonify({'error': error}), 409
+    
+    data = request.get_json(silent=True)
+    version = data.get('version') if isinstance(data, dict) else None
+    if version is not None:
+        version = str(version)
+        try:
+            model_registry.version_dir(version)
+        except UnknownVersionError:
+            return jsonify({'error': f'Unknown model version: {version}'}), 404
+    
+    if not start_model_reload(version, activate=version is not None):
+        return jsonify({'error': 'A model reload is already running', 'reload': reload_state}), 409
+    return jsonify({'status': 'reloading', 'version': version or model_registry.current(), 'modelVersion': MODEL_VERSION}), 202
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Prometheus scrape endpoint: per-stage latency histograms and request counters"""
+    return Response(REGISTRY.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
 
 @app.route('/predict', methods=['POST'])
+@admission_controlled
 def predict():
     """Main prediction endpoint"""
+    if not models_ready():
+        return not_ready_response()
+    
     try:
-        data = request.json
+        image_bytes = read_image_upload()
         
-        if not data or 'image' not in data:
+        if not image_bytes:
+            ERRORS.inc(endpoint='predict', reason='no_image')
             return jsonify({'error': 'No image data provided'}), 400
         
-        # Preprocess image
-        image_array, image_pil = preprocess_image(data['image'])
-        
-        # Get predictions from MobileNetV2
-        predictions = base_model.predict(image_array)
-        decoded_predictions = decode_predictions_imagenet(predictions, top=10)
-        
-        # Analyze predictions
-        detected_classes = [pred[1].lower() for pred in decoded_predictions]
-        confidences = [float(pred[2]) for pred in decoded_predictions]
-        max_confidence = max(confidences)
-        
-        # Log predictions for debugging
-        print(f"🔍 Top predictions: {detected_classes[:3]}")
-        print(f"📊 Confidence scores: {confidences[:3]}")
-        # Check for human detection
-        human_detected = any(
-            any(human_class in class_name for human_class in HUMAN_CLASSES)
-            for class_name in detected_classes
-        )
+        # Repeated scans of the same image are answered from the cache
+        model_version = MODEL_VERSION
+        cache_key = image_cache_key(image_bytes, result_cache_version(model_version, multi_log_requested()))
+        cached = result_cache.get(cache_key)
+        if cached is not None:
+            record_detection(cached, cached=True)
+            return cached_response(cached, True)
+        
+        # Decode, then MobileNetV2 (and the custom model) via the micro-batcher
+        # while the OpenCV analysis runs on its own pool
+        result = run_pipeline(image_bytes)
+        # Not cached under the old version's key if a model reload happened meanwhile
+        if result['modelVersion'] == model_version:
+            result_cache.set(cache_key, result)
+        record_detection(result)
+        return cached_response(result, False)
+        
+    except RequestEntityTooLarge:
+        ERRORS.inc(endpoint='predict', reason='too_large')
+        return jsonify({'error': f'Upload too large (max {MAX_UPLOAD_MB:g} MB)'}), 413
+    except QueueFullError as e:
+        return overloaded_response('predict', str(e), reason='queue_full')
+    except DeadlineExceededError as e:
+        return deadline_response('predict', str(e))
+    except FutureTimeoutError:
+        ERRORS.inc(endpoint='predict', reason='timeout')
+        logger.warning("⚠️  Timed out waiting for batched inference")
+        return jsonify({'error': 'Timed out waiting for model inference'}), 503
+    except Exception as e:
+        ERRORS.inc(endpoint='predict', reason='exception')
+        logger.error(f"Error in prediction: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+def _safe_preprocess(image_data, model_version=None, multi_log=False):
+    """
+    Decode one image for the batch endpoint
+    Returns: (cache key, cached result, preprocessed (array, PIL) or None, error message)
+    """
+    try:
+        if not isinstance(image_data, str) or not image_data:
+            return None, None, None, 'Image must be a non-empty base64 string'
+        image_bytes = decode_base64_image(image_data)
+        cache_key = image_cache_key(image_bytes, result_cache_version(model_version, multi_log))
+        cached = result_cache.get(cache_key)
+        if cached is not None:
+            return cache_key, cached, None, None
+        return cache_key, None, preprocess_image_bytes(memoryview(image_bytes)), None
+    except Exception as e:
+        return None, None, None, f'Could not decode image: {e}'
+
+def _safe_analyze(image_pil):
+    try:
+        # With the cascade only the brown ratio is computed up front; the rest on demand
+        return prefilter_image(image_pil) if CASCADE else analyze_image(image_pil)
+    except Exception as e:
+        logger.warning(f"⚠️  Image analysis error: {e}")
+        return None
+
+def _safe_classify(image_pil, predictions, custom_brown_prediction, summary, segmentation, stages_run=()):
+    try:
+        return classify_image(image_pil, predictions, custom_brown_prediction, summary, segmentation, stages_run)
+    except Exception as e:
+        return {'error': str(e)}
+
+@app.route('/predict/batch', methods=['POST'])
+@admission_controlled
+def predict_batch():
+    """
+    Batch prediction endpoint: {"images": [base64, ...]}
+    Returns one result per image, in request order. A bad image gets its own
+    {"index", "error"} entry instead of failing the whole request.
+    """
+    if not models_ready():
+        return not_ready_response()
+    
+    try:
+        data = request.get_json(silent=True)
+        images = data.get('images') if isinstance(data, dict) else None
         
-        # Check for wood/tree detection
-        wood_detected = any(
-            any(wood_class in class_name for wood_class in WOOD_CLASSES)
-            for class_name in detected_classes
+        if not isinstance(images, list) or not images:
+            return jsonify({'error': 'No images provided (expected "images": [...])'}), 400
+        if len(images) > BATCH_REQUEST_MAX_IMAGES:
+            return jsonify({
+                'error': f'Too many images: {len(images)} (max {BATCH_REQUEST_MAX_IMAGES} per request)'
+            }), 413
+        
+        # Decode all images in parallel
+        model_version = MODEL_VERSION
+        multi_log = multi_log_requested()  # the decode threads have no request context
+        decoded = list(decode_pool.map(lambda image_data: _safe_preprocess(image_data, model_version, multi_log), images))
+        
+        results = [None] * len(images)
+        ok_indices = []
+        for i, (_, cached, preprocessed, error) in enumerate(decoded):
+            if error is not None:
+                ERRORS.inc(endpoint='predict_batch', reason='decode')
+                results[i] = {'index': i, 'error': error}
+            elif cached is not None:
+                record_detection(cached, cached=True)
+                results[i] = dict(cached, index=i)
+            else:
+                ok_indices.append(i)
+        
+        # OpenCV analysis for every image runs while the model batches execute
+        images_pil = [decoded[i][2][1] for i in ok_indices]
+        analyses = [analysis_pool.submit(_safe_analyze, image_pil) for image_pil in images_pil]
+        
+        # Run the model stages as real batched tensors (the cascade adds a separate brown model later)
+        items = [model_inputs(*decoded[i][2], with_brown=not CASCADE) for i in ok_indices]
+        
+        model_outputs = []
+        for start in range(0, len(items), BATCH_MAX_SIZE):
+            check_deadline(g.deadline)
+            model_outputs.extend(run_model_batch(items[start:start + BATCH_MAX_SIZE]))
+        
+        # ImageNet category checks for the whole batch in one vectorized pass
+        summaries = []
+        if model_outputs:
+            summaries = get_category_index().summarize(
+                np.concatenate([predictions for predictions, _, _ in model_outputs]), top=10
+            )
+        
+        # Brown model pass for the images the ImageNet results leave open
+        segmentations = [analysis.result() for analysis in analyses]
+        brown_predictions = complete_brown_predictions(images_pil, model_outputs, summaries, segmentations)
+        
+        # Apply the per-image classification rules to the finished analyses
+        analysis_stages = ('brown_ratio',) if CASCADE else ANALYSIS_STAGES
+        classified = map(
+            _safe_classify,
+            images_pil,
+            [predictions for predictions, _, _ in model_outputs],
+            brown_predictions,
+            summaries,
+            segmentations,
+            [analysis_stages if segmentation is not None else () for segmentation in segmentations]
         )
+        for i, result, (_, _, backend) in zip(ok_indices, classified, model_outputs):
+            if 'detectedClass' in result:
+                result['modelVersion'] = backend.model_version
+                if backend.model_version == model_version:
+                    result_cache.set(decoded[i][0], result)
+                record_detection(result)
+            else:
+                ERRORS.inc(endpoint='predict_batch', reason='classify')
+            results[i] = dict(result, index=i)
         
-        # Try custom brown detector model FIRST if available
-        custom_brown_detected = None
-        custom_brown_confidence = 0
-        if custom_brown_detector is not None:
-            custom_brown_detected, custom_brown_confidence = detect_brown_with_custom_model(image_pil)
-            print(f"🤖 Custom brown detector: {custom_brown_detected} (confidence: {custom_brown_confidence:.2%})")
+        return jsonify({
+            'count': len(results),
+            'succeeded': sum(1 for result in results if 'detectedClass' in result),
+            'results': results
+        })
         
-        # Heuristic for stacked lumber/planks (fallback)
-        wood_like = is_wood_like(image_pil)
+    except RequestEntityTooLarge:
+        ERRORS.inc(endpoint='predict_batch', reason='too_large')
+        return jsonify({'error': f'Request too large (max {MAX_UPLOAD_MB:g} MB)'}), 413
+    except DeadlineExceededError as e:
+        return deadline_response('predict_batch', str(e))
+    except Exception as e:
+        ERRORS.inc(endpoint='predict_batch', reason='exception')
+        logger.error(f"Error in batch prediction: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+# ==================== CAMERA STREAMING ====================
+stream_sessions = StreamSessionStore(max_sessions=STREAM_MAX_SESSIONS, ttl_seconds=STREAM_SESSION_TTL_S)
+
+STREAM_FRAMES = REGISTRY.counter(
+    'ml_stream_frames_total', 'Camera stream frames by outcome (processed or reused)', ('outcome',)
+)
+REGISTRY.gauge('ml_stream_sessions', 'Open camera stream sessions', lambda: len(stream_sessions))
+
+def _valid_session_id(session_id):
+    return 0 < len(session_id) <= 64 and all(c.isalnum() or c in '-_' for c in session_id)
+
+def _stream_options(data):
+    """Session settings from a JSON body (camelCase), falling back to the ML_STREAM_* defaults"""
+    data = data if isinstance(data, dict) else {}
+    return {
+        'change_threshold': float(data.get('changeThreshold', STREAM_CHANGE_THRESHOLD)),
+        'max_reuse_s': float(data.get('maxReuseSeconds', STREAM_MAX_REUSE_S)),
+        'smoothing': min(1.0, max(0.0, float(data.get('smoothing', STREAM_SMOOTHING)))),
+    }
+
+@app.route('/stream/session', methods=['POST'])
+def create_stream_session():
+    """
+    Start a camera stream: {"changeThreshold", "maxReuseSeconds", "smoothing"} (all optional)
+    Frames are then posted to /stream/<sessionId>/frame
+    """
+    try:
+        options = _stream_options(request.get_json(silent=True))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'Invalid stream options'}), 400
+    
+    session = stream_sessions.create(**options)
+    return jsonify({
+        'sessionId': session.id,
+        'changeThreshold': session.change_threshold,
+        'maxReuseSeconds': session.max_reuse_s,
+        'smoothing': session.smoothing,
+    }), 201
+
+@app.route('/stream/<session_id>/frame', methods=['POST'])
+@admission_controlled
+def stream_frame(session_id):
+    """
+    One camera frame (same upload formats as /predict). The models and
+    measurements only re-run when the scene changed since the last processed
+    frame; otherwise the previous result is returned. The response carries a
+    "stream" object with frameChanged / changeScore / reused.
+    """
+    if not models_ready():
+        return not_ready_response()
+    if not _valid_session_id(session_id):
+        return jsonify({'error': 'Invalid session id'}), 400
+    
+    try:
+        image_bytes = read_image_upload()
+        if not image_bytes:
+            ERRORS.inc(endpoint='stream_frame', reason='no_image')
+            return jsonify({'error': 'No image data provided'}), 400
         
-        print(f"👤 Human detected: {human_detected}")
-        print(f"🌳 Wood detected: {wood_detected}")
-        print(f"🪵 Wood-like heuristic: {wood_like}")
+        image_array, image_pil = decode_image(image_bytes)
+        signature = FrameSignature(image_pil)
         
-        # Determine final classification
-        if human_detected and max_confidence > 0.3:
-            return jsonify({
-                'detectedClass': 'human',
-                'confidence': int(max_confidence * 100),
-                'rawPredictions': [
-                    {'class': pred[1], 'confidence': float(pred[2])}
-                    for pred in decoded_predictions[:3]
-                ]
-            })
-        
-        # Check custom model FIRST, then fallback to other detection methods
-        elif custom_brown_detected is True and custom_brown_confidence > 0.6:
-            # Custom trained model detected brown with high confidence
-            measurements = estimate_tree_measurements(image_pil)
-            print(f"✅ Using custom brown detector results")
+        # Unknown ids (expired, or created by another worker) restart with default settings
+        session = stream_sessions.get_or_create(session_id, **_stream_options(None))
+        with session.lock:
+            session.frames += 1
+            changed, change_score = session.needs_processing(signature)
+            if changed:
+                result = session.record(signature, run_decoded_pipeline(image_array, image_pil))
+                record_detection(result)
+            else:
+                result = session.last_result
+            STREAM_FRAMES.inc(outcome='processed' if changed else 'reused')
             
-            return jsonify({
-                'detectedClass': 'cocolumber',
-                'confidence': int(custom_brown_confidence * 100),
-                'height': measurements['height'],
-                'width': measurements['width'],
-                'diameter': measurements['diameter'],
-                'estimatedLumber': measurements['estimatedLumber'],
-                'quality': measurements['quality'],
-                'detectionMethod': 'custom_model',
-                'rawPredictions': [
-                    {'class': pred[1], 'confidence': float(pred[2])}
-                    for pred in decoded_predictions[:3]
-                ]
-            })
-        
-        elif wood_detected or wood_like:
-            # If wood detected by MobileNetV2 or heuristic, treat as cocolumber and provide measurements
-            measurements = estimate_tree_measurements(image_pil)
-            detection_method = 'mobilenet' if wood_detected else 'hsv_heuristic'
-            print(f"✅ Using {detection_method} detection results")
-            
-            return jsonify({
-                'detectedClass': 'cocolumber',
-                'confidence': int((max_confidence * 100) if wood_detected else 65),
-                'height': measurements['height'],
-                'width': measurements['width'],
-                'diameter': measurements['diameter'],
-                'estimatedLumber': measurements['estimatedLumber'],
-                'quality': measurements['quality'],
-                'detectionMethod': detection_method,
-                'rawPredictions': [
-                    {'class': pred[1], 'confidence': float(pred[2])}
-                    for pred in decoded_predictions[:3]
-                ]
-            })
-        
-        else:
-            # No cocolumber/wood detected - reject the image
-            return jsonify({
-                'detectedClass': 'not_cocolumber',
-                'confidence': 0,
-                'error': 'No cocolumber detected. Only cocolumber/wood/logs/trees can be scanned.',
-                'rawPredictions': [
-                    {'class': pred[1], 'confidence': float(pred[2])}
-                    for pred in decoded_predictions[:3]
-                ]
-            })
+            return jsonify(dict(result, stream={
+                'sessionId': session.id,
+                'frame': session.frames,
+                'processedFrames': session.processed,
+                'frameChanged': change_score > session.change_threshold,
+                'changeScore': round(change_score, 4),
+                'reused': not changed,
+                'smoothed': bool(session.smoothing) and result.get('detectedClass') == 'cocolumber',
+            }))
         
+    except RequestEntityTooLarge:
+        ERRORS.inc(endpoint='stream_frame', reason='too_large')
+        return jsonify({'error': f'Upload too large (max {MAX_UPLOAD_MB:g} MB)'}), 413
+    except QueueFullError as e:
+        return overloaded_response('stream_frame', str(e), reason='queue_full')
+    except DeadlineExceededError as e:
+        return deadline_response('stream_frame', str(e))
+    except FutureTimeoutError:
+        ERRORS.inc(endpoint='stream_frame', reason='timeout')
+        logger.warning("⚠️  Timed out waiting for batched inference")
+        return jsonify({'error': 'Timed out waiting for model inference'}), 503
     except Exception as e:
-        print(f"Error in prediction: {str(e)}")
+        ERRORS.inc(endpoint='stream_frame', reason='exception')
+        logger.error(f"Error in stream frame: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/stream/<session_id>', methods=['DELETE'])
+def close_stream_session(session_id):
+    """End a camera stream and free its state"""
+    return jsonify({'sessionId': session_id, 'closed': stream_sessions.close(session_id)})
+
 if __name__ == '__main__':
+    # Development server. For production use: python serve.py
+    debug = os.environ.get('ML_DEBUG', '1') != '0'
+    port = int(os.environ.get('ML_PORT', 5000))
     print("🌴 Cocolumber ML Detection Service Starting...")
-    print("📡 Server running on http://localhost:5000")
-    print("✅ Ready to detect coconut lumber!")
-    app.run(host='0.0.0.0', port=5000, debug=True)
+    print(f"📡 Server running on http://localhost:{port}")
+    # The debug reloader's watcher process never serves requests; only load models in the worker
+    if not debug or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        start_model_loading()
+        print("⏳ Loading models in the background (see /health/ready)...")
+    app.run(host='0.0.0.0', port=port, debug=debug, threaded=True)
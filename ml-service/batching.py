@@ -0,0 +1,119 @@
+"""
+Micro-batching scheduler for the ML service
+Collects concurrent inference requests into one stacked model call
+"""
+
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from admission import DeadlineExceededError
+
+
+class QueueFullError(Exception):
+    """Raised when the batching queue has no room for another request"""
+
+
+class MicroBatcher:
+    """
+    Groups items submitted from many request threads into batches.
+
+    A single worker thread waits for the first item, then keeps collecting
+    until either `max_batch_size` items are queued or `max_wait_ms` has
+    passed since that first item arrived. The whole batch is handed to
+    `run_batch(items)`, which must return one result per item in order.
+    Each caller gets a Future resolved with its own result (or exception).
+    Items submitted with a deadline (time.monotonic()) that has passed by the
+    time their batch runs are dropped with DeadlineExceededError.
+    """
+
+    def __init__(self, run_batch, max_batch_size=8, max_wait_ms=5, max_queue_size=64, name='micro-batcher'):
+        self.run_batch = run_batch
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms) / 1000.0)
+        self.max_queue_size = max(1, int(max_queue_size))
+        self.name = name
+
+        self._queue = queue.Queue(maxsize=self.max_queue_size)
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+    def _ensure_started(self):
+        # Threads do not survive fork(), so restart the worker in a child process
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            self._queue = queue.Queue(maxsize=self.max_queue_size)
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._worker, name=self.name, daemon=True)
+            self._thread.start()
+
+    def submit(self, item, deadline=None):
+        """Queue an item for batched execution and return its Future"""
+        self._ensure_started()
+        future = Future()
+        try:
+            self._queue.put_nowait((item, future, deadline))
+        except queue.Full:
+            raise QueueFullError(f'Inference queue is full ({self.max_queue_size} pending requests)')
+        return future
+
+    def qsize(self):
+        return self._queue.qsize()
+
+    def _collect_batch(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+
+        # Anything that is already waiting rides along without extra delay
+        while len(batch) < self.max_batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+
+        return batch
+
+    def _worker(self):
+        while True:
+            batch = self._collect_batch()
+            # Skip requests whose caller already gave up or whose deadline passed
+            now = time.monotonic()
+            live = []
+            for item, future, deadline in batch:
+                if not future.set_running_or_notify_cancel():
+                    continue
+                if deadline is not None and now >= deadline:
+                    future.set_exception(DeadlineExceededError('Request deadline passed before inference'))
+                    continue
+                live.append((item, future))
+            batch = live
+            if not batch:
+                continue
+
+            items = [item for item, _ in batch]
+            try:
+                results = self.run_batch(items)
+                if len(results) != len(items):
+                    raise RuntimeError(f'Batch returned {len(results)} results for {len(items)} items')
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+
+            for (_, future), result in zip(batch, results):
+                future.set_result(result)
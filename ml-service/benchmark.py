@@ -0,0 +1,564 @@
+# ⏱️ ML Service Benchmarks
+# Reproducible measurements for app.py, so a change can be compared against
+# a previous run:
+#
+#   python benchmark.py micro                  # preprocessing + OpenCV stages
+#   python benchmark.py models                 # model forward pass by batch size
+#   python benchmark.py pipeline               # in-process load: latency, peak RSS, GC
+#   python benchmark.py http --concurrency 8   # load test a running service
+#   python benchmark.py compare old.json new.json
+#
+# Every run writes a JSON file to benchmark_results/ (see --output).
+
+import argparse
+import base64
+import gc
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+# ==================== CONFIGURATION ====================
+RESOLUTIONS = [(320, 240), (640, 480), (1280, 960), (4032, 3024)]
+BROWN_DENSITIES = [0.0, 0.25, 0.5, 0.8]
+BATCH_SIZES = [1, 2, 4, 8, 16, 32]
+RESULTS_DIR = 'benchmark_results'
+SEED = 1234
+
+# ==================== SYNTHETIC CORPUS ====================
+def synthetic_image(width, height, brown_density, seed=SEED):
+    """
+    Deterministic test photo: a noisy green/gray background with a block of
+    wood-brown planks covering `brown_density` of the frame. The plank seams
+    give Canny and the contour stage real edges to work on.
+    """
+    rng = np.random.default_rng(seed + width * 7 + height * 13 + int(brown_density * 100))
+    image = np.empty((height, width, 3), dtype=np.uint8)
+    image[..., 0] = rng.integers(40, 90, (height, width))
+    image[..., 1] = rng.integers(90, 160, (height, width))
+    image[..., 2] = rng.integers(40, 100, (height, width))
+
+    if brown_density > 0:
+        block_h = int(height * np.sqrt(brown_density))
+        block_w = int(width * np.sqrt(brown_density))
+        top = (height - block_h) // 2
+        left = (width - block_w) // 2
+        block = np.empty((block_h, block_w, 3), dtype=np.int16)
+        block[..., 0] = 140
+        block[..., 1] = 95
+        block[..., 2] = 50
+        block += rng.integers(-20, 20, (block_h, block_w, 1), dtype=np.int16)
+        # Dark seams between planks
+        plank = max(4, block_h // 8)
+        block[::plank] = (60, 40, 20)
+        image[top:top + block_h, left:left + block_w] = np.clip(block, 0, 255)
+
+    return Image.fromarray(image)
+
+
+def encode_jpeg(image, quality=90):
+    buffer = io.BytesIO()
+    image.save(buffer, 'JPEG', quality=quality)
+    return buffer.getvalue()
+
+
+def build_corpus(resolutions=RESOLUTIONS, densities=BROWN_DENSITIES):
+    """[(label, jpeg_bytes)] for every resolution x brown density"""
+    corpus = []
+    for width, height in resolutions:
+        for density in densities:
+            label = f'{width}x{height},brown={density:g}'
+            corpus.append((label, encode_jpeg(synthetic_image(width, height, density))))
+    return corpus
+
+
+def parse_resolutions(text):
+    return [tuple(int(v) for v in item.lower().split('x')) for item in text.split(',')]
+
+
+# ==================== TIMING ====================
+def summarize_times(times):
+    """Latency statistics in milliseconds"""
+    times_ms = np.asarray(times, dtype=np.float64) * 1000
+    return {
+        'n': int(times_ms.size),
+        'mean_ms': round(float(times_ms.mean()), 4),
+        'stdev_ms': round(float(times_ms.std()), 4),
+        'min_ms': round(float(times_ms.min()), 4),
+        'p50_ms': round(float(np.percentile(times_ms, 50)), 4),
+        'p95_ms': round(float(np.percentile(times_ms, 95)), 4),
+        'p99_ms': round(float(np.percentile(times_ms, 99)), 4),
+        'max_ms': round(float(times_ms.max()), 4),
+    }
+
+
+def time_call(fn, repeat, warmup):
+    for _ in range(warmup):
+        fn()
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - started)
+    return summarize_times(times)
+
+
+def print_result(name, stats):
+    print(f"   {name:<58} p50 {stats['p50_ms']:>9.3f} ms   p95 {stats['p95_ms']:>9.3f} ms")
+
+
+def environment_info():
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, timeout=5
+        ).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    env = {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+        'cpu_count': os.cpu_count(),
+        'numpy': np.__version__,
+        'git_commit': commit,
+    }
+    try:
+        import cv2
+        env['opencv'] = cv2.__version__
+    except ImportError:
+        pass
+    # Service settings that change the measured code paths
+    env['settings'] = {key: value for key, value in sorted(os.environ.items()) if key.startswith('ML_')}
+    return env
+
+
+def write_results(suite, config, results, output=None):
+    report = {
+        'suite': suite,
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'environment': environment_info(),
+        'config': config,
+        'results': results,
+    }
+    if output is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        output = os.path.join(RESULTS_DIR, f"{suite}-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"\n💾 Results saved to {output}")
+    return output
+
+
+# ==================== MICROBENCHMARKS ====================
+def run_micro(args):
+    """Per-function timings over the synthetic corpus"""
+    import app as ml_app
+
+    corpus = build_corpus(parse_resolutions(args.resolutions))
+    results = []
+
+    with_models = False
+    if args.with_models:
+        print("📦 Loading models for detect_brown_with_custom_model...")
+        ml_app.load_models(warmup=True)
+        with_models = ml_app.models_ready() and ml_app.inference_backend.has_brown_model
+        if not with_models:
+            print("⚠️  No brown model available - skipping detect_brown_with_custom_model")
+
+    print(f"\n⏱️  Microbenchmarks ({args.repeat} runs, {args.warmup} warmup)")
+    for label, jpeg in corpus:
+        encoded = base64.b64encode(jpeg).decode()
+        _, image_pil = ml_app.preprocess_image(encoded)
+        # Separate cases on the full-resolution photo (including the resolution-pyramid
+        # path on large images); /predict itself runs the OpenCV stages on image_pil
+        full_image = Image.open(io.BytesIO(jpeg)).convert('RGB')
+
+        benchmarks = [
+            ('preprocess_image', lambda: ml_app.preprocess_image(encoded)),
+            # A fresh segmentation per call, so nothing is served from cached stages
+            ('is_wood_like', lambda: ml_app.is_wood_like(image_pil)),
+            ('estimate_tree_measurements', lambda: ml_app.estimate_tree_measurements(image_pil)),
+            ('is_wood_like_full_res', lambda: ml_app.is_wood_like(full_image)),
+            ('estimate_tree_measurements_full_res', lambda: ml_app.estimate_tree_measurements(full_image)),
+        ]
+        if with_models:
+            benchmarks.append(
+                ('detect_brown_with_custom_model', lambda: ml_app.detect_brown_with_custom_model(image_pil))
+            )
+
+        for function_name, fn in benchmarks:
+            name = f'{function_name}[{label}]'
+            stats = time_call(fn, args.repeat, args.warmup)
+            print_result(name, stats)
+            results.append({'name': name, 'function': function_name, 'input': label, 'stats': stats})
+
+    config = {'repeat': args.repeat, 'warmup': args.warmup, 'resolutions': args.resolutions,
+              'brown_densities': BROWN_DENSITIES, 'with_models': with_models, 'cv_input': '224x224'}
+    return write_results('micro', config, results, args.output)
+
+
+# ==================== MODEL FORWARD PASS ====================
+def run_models(args):
+    """Inference backend throughput by batch size"""
+    import app as ml_app
+
+    print("📦 Loading models...")
+    ml_app.load_models(warmup=True)
+    if not ml_app.models_ready():
+        print(f"❌ Models failed to load: {ml_app.model_state['error']}")
+        sys.exit(1)
+    backend = ml_app.inference_backend
+
+    rng = np.random.default_rng(SEED)
+    results = []
+    print(f"\n⏱️  {backend.name} forward pass ({args.repeat} runs, {args.warmup} warmup)")
+    for batch_size in [int(v) for v in args.batch_sizes.split(',')]:
+        imagenet_batch = rng.uniform(-1, 1, (batch_size, 224, 224, 3)).astype(np.float32)
+        brown_batch = None
+        if backend.needs_brown_input:
+            brown_batch = rng.uniform(0, 1, (batch_size, 224, 224, 3)).astype(np.float32)
+
+        stats = time_call(lambda: backend.predict_batch(imagenet_batch, brown_batch), args.repeat, args.warmup)
+        stats['per_image_ms'] = round(stats['p50_ms'] / batch_size, 4)
+        stats['images_per_s'] = round(batch_size * 1000 / stats['p50_ms'], 2)
+        name = f'{backend.name}[batch={batch_size}]'
+        print_result(name, stats)
+        print(f"      {stats['per_image_ms']:.3f} ms/image, {stats['images_per_s']:.1f} images/s")
+        results.append({'name': name, 'batch_size': batch_size, 'stats': stats})
+
+    config = {'repeat': args.repeat, 'warmup': args.warmup, 'backend': backend.name,
+              'model_version': ml_app.MODEL_VERSION}
+    return write_results('models', config, results, args.output)
+
+
+# ==================== IN-PROCESS PIPELINE LOAD ====================
+def current_rss_bytes():
+    """Resident set size of this process (Linux /proc), or None where unavailable"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def minor_page_faults():
+    """Minor page faults so far: each one is a freshly touched page, i.e. new memory being allocated"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_minflt
+
+
+class ResourceMonitor:
+    """
+    While active, samples RSS in a background thread and times every
+    garbage-collector run, so a load test can report memory and GC cost
+    next to latency
+    """
+
+    def __init__(self, interval_s=0.002):
+        self.interval_s = interval_s
+        self._stop = threading.Event()
+        self._thread = None
+        self._gc_started = None
+        self.gc_runs = 0
+        self.gc_pause_s = 0.0
+        self.rss_start = self.rss_peak = None
+        self.faults_start = self.faults_end = None
+
+    def _on_gc(self, phase, info):
+        if phase == 'start':
+            self._gc_started = time.perf_counter()
+        elif self._gc_started is not None:
+            self.gc_runs += 1
+            self.gc_pause_s += time.perf_counter() - self._gc_started
+            self._gc_started = None
+
+    def _sample(self):
+        while not self._stop.wait(self.interval_s):
+            rss = current_rss_bytes()
+            if rss is not None:
+                self.rss_peak = max(self.rss_peak or 0, rss)
+
+    def __enter__(self):
+        gc.collect()
+        self.rss_start = self.rss_peak = current_rss_bytes()
+        self.faults_start = minor_page_faults()
+        gc.callbacks.append(self._on_gc)
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        gc.callbacks.remove(self._on_gc)
+        self.faults_end = minor_page_faults()
+        return False
+
+    def report(self):
+        mb = lambda value: round(value / 2 ** 20, 2) if value is not None else None
+        return {
+            'rss_start_mb': mb(self.rss_start),
+            'rss_peak_mb': mb(self.rss_peak),
+            'rss_growth_mb': mb(self.rss_peak - self.rss_start) if self.rss_start is not None else None,
+            'minor_page_faults': (self.faults_end - self.faults_start) if self.faults_start is not None else None,
+            'gc_runs': self.gc_runs,
+            'gc_pause_ms': round(self.gc_pause_s * 1000, 3),
+        }
+
+
+def run_pipeline_load(args):
+    """
+    Closed-loop load without HTTP: `concurrency` threads push the synthetic
+    corpus through app.run_pipeline() (decode, batched inference, OpenCV
+    analysis, measurement) and the run reports peak RSS, minor page faults
+    (fresh memory) and GC pauses next to latency
+    """
+    import app as ml_app
+
+    print("📦 Loading models...")
+    ml_app.load_models(warmup=True)
+    if not ml_app.models_ready():
+        print(f"❌ Models failed to load: {ml_app.model_state['error']}")
+        sys.exit(1)
+
+    width, height = parse_resolutions(args.resolution)[0]
+    jpegs = [encode_jpeg(synthetic_image(width, height, density)) for density in BROWN_DENSITIES]
+    for jpeg in jpegs:
+        ml_app.run_pipeline(jpeg)
+
+    total = args.requests
+    counter = iter(range(total))
+    counter_lock = threading.Lock()
+    latencies = []
+
+    def client():
+        while True:
+            with counter_lock:
+                i = next(counter, None)
+            if i is None:
+                return
+            started = time.perf_counter()
+            ml_app.run_pipeline(jpegs[i % len(jpegs)])
+            elapsed = time.perf_counter() - started
+            with counter_lock:
+                latencies.append(elapsed)
+
+    print(f"🚀 {total} images through run_pipeline ({width}x{height}) at concurrency {args.concurrency}")
+    with ResourceMonitor() as monitor:
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            for _ in range(args.concurrency):
+                pool.submit(client)
+        wall_s = time.perf_counter() - started
+
+    resources = monitor.report()
+    result = {
+        'name': f'pipeline[{width}x{height},c={args.concurrency}]',
+        'requests': total,
+        'wall_s': round(wall_s, 3),
+        'throughput_rps': round(total / wall_s, 2) if wall_s else 0.0,
+        'stats': summarize_times(latencies),
+        'resources': resources,
+    }
+
+    stats = result['stats']
+    print(f"\n📊 {total} images in {wall_s:.2f}s -> {result['throughput_rps']} images/s")
+    print(f"   Latency p50 {stats['p50_ms']:.1f} ms, p95 {stats['p95_ms']:.1f} ms, p99 {stats['p99_ms']:.1f} ms")
+    print(f"   RSS {resources['rss_start_mb']} MB -> peak {resources['rss_peak_mb']} MB "
+          f"(+{resources['rss_growth_mb']} MB), {resources['minor_page_faults']} minor page faults")
+    print(f"   GC: {resources['gc_runs']} collections, {resources['gc_pause_ms']:.1f} ms paused")
+
+    config = {'concurrency': args.concurrency, 'requests': total, 'resolution': args.resolution,
+              'brown_densities': BROWN_DENSITIES, 'backend': ml_app.inference_backend.name,
+              'model_version': ml_app.MODEL_VERSION}
+    return write_results('pipeline', config, [result], args.output)
+
+
+# ==================== HTTP LOAD GENERATOR ====================
+def make_request(url, jpeg, mode, timeout):
+    if mode == 'binary':
+        body, content_type = jpeg, 'image/jpeg'
+    else:
+        image = 'data:image/jpeg;base64,' + base64.b64encode(jpeg).decode()
+        body, content_type = json.dumps({'image': image}).encode(), 'application/json'
+
+    request = urllib.request.Request(url, data=body, method='POST', headers={'Content-Type': content_type})
+    started = time.perf_counter()
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            response.read()
+            status = response.status
+    except urllib.error.HTTPError as e:
+        status = e.code
+    except (urllib.error.URLError, OSError):
+        status = 'connection_error'
+    return status, time.perf_counter() - started
+
+
+def run_http(args):
+    """Closed-loop load test: `concurrency` clients sending back-to-back requests"""
+    url = args.url.rstrip('/') + '/predict'
+    width, height = parse_resolutions(args.resolution)[0]
+    jpeg = encode_jpeg(synthetic_image(width, height, args.brown_density))
+
+    total = args.requests
+    counter = iter(range(total))
+    counter_lock = threading.Lock()
+    latencies = []
+    statuses = {}
+    stats_lock = threading.Lock()
+
+    def client():
+        while True:
+            with counter_lock:
+                i = next(counter, None)
+            if i is None:
+                return
+            payload = jpeg
+            if not args.allow_cache:
+                # Bytes after the JPEG end marker are ignored by decoders but change the cache key
+                payload = jpeg + f'bench-{i}-{time.time_ns()}'.encode()
+            status, elapsed = make_request(url, payload, args.mode, args.timeout)
+            with stats_lock:
+                statuses[str(status)] = statuses.get(str(status), 0) + 1
+                if status == 200:
+                    latencies.append(elapsed)
+
+    print(f"🚀 {total} requests to {url} ({args.mode}, {width}x{height}) at concurrency {args.concurrency}")
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        for _ in range(args.concurrency):
+            pool.submit(client)
+    wall_s = time.perf_counter() - started
+
+    succeeded = len(latencies)
+    result = {
+        'name': f'predict[{args.mode},{width}x{height},c={args.concurrency}]',
+        'requests': total,
+        'succeeded': succeeded,
+        'statuses': statuses,
+        'wall_s': round(wall_s, 3),
+        'throughput_rps': round(succeeded / wall_s, 2) if wall_s else 0.0,
+        'stats': summarize_times(latencies) if latencies else None,
+    }
+
+    print(f"\n📊 {succeeded}/{total} succeeded in {wall_s:.2f}s -> {result['throughput_rps']} req/s")
+    print(f"   Status codes: {statuses}")
+    if latencies:
+        stats = result['stats']
+        print(f"   Latency p50 {stats['p50_ms']:.1f} ms, p95 {stats['p95_ms']:.1f} ms, p99 {stats['p99_ms']:.1f} ms")
+
+    config = {'url': url, 'mode': args.mode, 'concurrency': args.concurrency, 'requests': total,
+              'resolution': args.resolution, 'brown_density': args.brown_density,
+              'allow_cache': args.allow_cache}
+    return write_results('http', config, [result], args.output)
+
+
+# ==================== COMPARE ====================
+def run_compare(args):
+    """p50 of every benchmark present in both runs; exits 1 on a regression above --threshold"""
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.candidate) as f:
+        candidate = json.load(f)
+
+    old = {entry['name']: entry for entry in baseline['results'] if entry.get('stats')}
+    new = {entry['name']: entry for entry in candidate['results'] if entry.get('stats')}
+    common = [name for name in new if name in old]
+    if not common:
+        print("⚠️  No benchmarks in common between the two runs")
+        return
+
+    print(f"📊 {args.baseline} -> {args.candidate}\n")
+    print(f"   {'benchmark':<58} {'before':>10} {'after':>10} {'change':>8}")
+    regressions = []
+    for name in common:
+        before = old[name]['stats']['p50_ms']
+        after = new[name]['stats']['p50_ms']
+        change = (after - before) / before if before else 0.0
+        flag = ''
+        if change > args.threshold:
+            flag = ' ⚠️'
+            regressions.append(name)
+        elif change < -args.threshold:
+            flag = ' ✅'
+        print(f"   {name:<58} {before:>8.3f}ms {after:>8.3f}ms {change:>+7.1%}{flag}")
+
+    for name in old:
+        if name not in new:
+            print(f"   {name:<58} (only in baseline)")
+
+    if regressions:
+        print(f"\n❌ {len(regressions)} benchmark(s) slower by more than {args.threshold:.0%}")
+        sys.exit(1)
+    print(f"\n✅ No regressions above {args.threshold:.0%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the ML detection service')
+    subparsers = parser.add_subparsers(dest='suite', required=True)
+
+    micro = subparsers.add_parser('micro', help='Preprocessing and OpenCV stage timings')
+    micro.add_argument('--repeat', type=int, default=30, help='Timed runs per benchmark')
+    micro.add_argument('--warmup', type=int, default=3, help='Untimed runs per benchmark')
+    micro.add_argument('--resolutions', default=','.join(f'{w}x{h}' for w, h in RESOLUTIONS),
+                       help='Comma-separated WIDTHxHEIGHT list')
+    micro.add_argument('--with-models', action='store_true',
+                       help='Also load the models and time detect_brown_with_custom_model')
+    micro.add_argument('--output', help='Result file (default: benchmark_results/micro-<time>.json)')
+    micro.set_defaults(run=run_micro)
+
+    models = subparsers.add_parser('models', help='Model forward pass by batch size')
+    models.add_argument('--batch-sizes', default=','.join(str(b) for b in BATCH_SIZES))
+    models.add_argument('--repeat', type=int, default=20, help='Timed runs per batch size')
+    models.add_argument('--warmup', type=int, default=3, help='Untimed runs per batch size')
+    models.add_argument('--output', help='Result file (default: benchmark_results/models-<time>.json)')
+    models.set_defaults(run=run_models)
+
+    pipeline = subparsers.add_parser('pipeline', help='In-process load test: latency, peak RSS, page faults, GC')
+    pipeline.add_argument('--concurrency', type=int, default=8, help='Concurrent callers')
+    pipeline.add_argument('--requests', type=int, default=400, help='Total images')
+    pipeline.add_argument('--resolution', default='1280x960', help='Test image size WIDTHxHEIGHT')
+    pipeline.add_argument('--output', help='Result file (default: benchmark_results/pipeline-<time>.json)')
+    pipeline.set_defaults(run=run_pipeline_load)
+
+    http = subparsers.add_parser('http', help='Load test POST /predict on a running service')
+    http.add_argument('--url', default='http://localhost:5000', help='Service base URL')
+    http.add_argument('--concurrency', type=int, default=4, help='Concurrent clients')
+    http.add_argument('--requests', type=int, default=200, help='Total requests')
+    http.add_argument('--mode', choices=['json', 'binary'], default='json',
+                      help='Upload as base64 JSON (camera page) or a binary body')
+    http.add_argument('--resolution', default='1280x960', help='Test image size WIDTHxHEIGHT')
+    http.add_argument('--brown-density', type=float, default=0.5, help='Share of the frame covered by wood')
+    http.add_argument('--allow-cache', action='store_true',
+                      help='Send identical bytes every time (measures result cache hits)')
+    http.add_argument('--timeout', type=float, default=60, help='Per-request timeout in seconds')
+    http.add_argument('--output', help='Result file (default: benchmark_results/http-<time>.json)')
+    http.set_defaults(run=run_http)
+
+    compare = subparsers.add_parser('compare', help='Compare two result files')
+    compare.add_argument('baseline')
+    compare.add_argument('candidate')
+    compare.add_argument('--threshold', type=float, default=0.10,
+                         help='Relative p50 slowdown reported as a regression (default 0.10)')
+    compare.set_defaults(run=run_compare)
+
+    args = parser.parse_args()
+    args.run(args)
+
+
+if __name__ == '__main__':
+    main()
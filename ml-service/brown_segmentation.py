@@ -0,0 +1,267 @@
+"""
+Shared brown segmentation stage
+Computes the HSV brown mask, Canny edges and contours once per image so that
+is_wood_like() and estimate_tree_measurements() can share the work
+"""
+
+import math
+import threading
+from functools import cached_property
+
+import cv2
+import numpy as np
+
+# Comprehensive brown color ranges (inclusive, OpenCV HSV: H=0-179, S/V=0-255)
+# Brown exists primarily in H=0-40 range (includes reds, oranges, yellows, browns)
+BROWN_HSV_RANGES = [
+    # Range 1: Reddish-brown (red spectrum: H=0-10)
+    ((0, 20, 20), (10, 255, 255)),
+    # Range 2: Orange-brown (H=10-25)
+    ((10, 20, 20), (25, 255, 255)),
+    # Range 3: Yellow-brown (H=25-40, the brown/tan range)
+    ((25, 15, 15), (40, 255, 255)),
+    # Range 4: Dark browns with LOW saturation (grayish/muted browns)
+    ((0, 5, 10), (40, 80, 255)),
+    # Range 5: Very light/pale browns (high V, low-mid S)
+    ((15, 10, 100), (35, 100, 255)),
+]
+
+MORPH_KERNEL = cv2.getStructuringElement(cv2.MORPH_RECT, (5, 5))
+
+# Resolution pyramid: images whose longest side exceeds PYRAMID_MIN_SIDE are
+# segmented at PYRAMID_WORKING_SIDE and refined at full resolution in an ROI
+PYRAMID_MIN_SIDE = 1600
+PYRAMID_WORKING_SIDE = 512
+
+
+def build_brown_lut(ranges=BROWN_HSV_RANGES):
+    """
+    Precompute a per-channel HSV -> brown lookup table.
+
+    Each range is a box in HSV space, so a pixel is brown when, for at least
+    one range k, H, S and V all fall inside range k. Bit k of lut[value, channel]
+    is set when `value` lies inside range k on that channel; AND-ing the three
+    channel lookups leaves a non-zero byte exactly where cv2.inRange() on the
+    same ranges would have produced 255. Returns a (1, 256, 3) uint8 table for
+    cv2.LUT().
+    """
+    if len(ranges) > 8:
+        raise ValueError('At most 8 brown ranges fit in a uint8 lookup table')
+
+    values = np.arange(256)
+    lut = np.zeros((256, 3), dtype=np.uint8)
+    for bit, (lower, upper) in enumerate(ranges):
+        for channel in range(3):
+            inside = (values >= lower[channel]) & (values <= upper[channel])
+            lut[inside, channel] |= np.uint8(1 << bit)
+    return lut.reshape(1, 256, 3)
+
+
+BROWN_LUT = build_brown_lut()
+
+_scratch = threading.local()
+
+
+def scratch(name, shape, dtype=np.uint8):
+    """
+    Per-thread reusable array for intermediate results (contents undefined).
+    Grows to the largest shape requested so far and is then reused, so the
+    HSV/gray/edge temporaries of every image share the same memory.
+    """
+    size = math.prod(shape)
+    buffer = getattr(_scratch, name, None)
+    if buffer is None or buffer.size < size or buffer.dtype != dtype:
+        buffer = np.empty(size, dtype=dtype)
+        setattr(_scratch, name, buffer)
+    return buffer[:size].reshape(shape)
+
+
+def brown_mask_from_hsv(hsv):
+    """Brown mask (0/255 uint8) for an HSV image, identical to OR-ing cv2.inRange() masks"""
+    height, width = hsv.shape[:2]
+    bits = cv2.LUT(hsv, BROWN_LUT, dst=scratch('bits', hsv.shape))
+    combined = cv2.extractChannel(bits, 0, dst=scratch('channel_0', (height, width)))
+    channel = scratch('channel_1', (height, width))
+    for index in (1, 2):
+        cv2.bitwise_and(combined, cv2.extractChannel(bits, index, dst=channel), dst=combined)
+    return cv2.compare(combined, 0, cv2.CMP_GT)
+
+
+class BrownSegmentation:
+    """
+    Lazily computed segmentation results for one RGB image.
+
+    Every stage is computed at most once, on first access:
+    - mask:         raw brown mask (what is_wood_like() measures)
+    - edge_ratio:   share of Canny edge pixels on the grayscale image
+    - clean_mask:   mask after morphological close + open
+    - contours:     external contours of clean_mask (used for measurements)
+    - component_stats: box and area of every brown region (multi-log measurements)
+    Intermediates that no later stage reads (HSV, gray, edges, the mask
+    between close and open) go to per-thread scratch arrays.
+    """
+
+    def __init__(self, rgb):
+        self.rgb = np.ascontiguousarray(rgb)
+
+    @property
+    def shape(self):
+        return self.rgb.shape[:2]
+
+    @cached_property
+    def mask(self):
+        hsv = cv2.cvtColor(self.rgb, cv2.COLOR_RGB2HSV, dst=scratch('hsv', self.rgb.shape))
+        return brown_mask_from_hsv(hsv)
+
+    @cached_property
+    def brown_ratio(self):
+        return float(cv2.countNonZero(self.mask)) / float(self.mask.size)
+
+    @cached_property
+    def edge_ratio(self):
+        gray = cv2.cvtColor(self.rgb, cv2.COLOR_RGB2GRAY, dst=scratch('gray', self.shape))
+        edges = cv2.Canny(gray, 50, 150, edges=scratch('edges', self.shape))
+        return float(cv2.countNonZero(edges)) / float(edges.size)
+
+    @cached_property
+    def clean_mask(self):
+        cleaned = cv2.morphologyEx(self.mask, cv2.MORPH_CLOSE, MORPH_KERNEL, dst=scratch('morph', self.shape))
+        return cv2.morphologyEx(cleaned, cv2.MORPH_OPEN, MORPH_KERNEL)
+
+    @cached_property
+    def contours(self):
+        contours, _ = cv2.findContours(self.clean_mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        return contours
+
+    @cached_property
+    def component_stats(self):
+        """
+        (N, 5) int array of x, y, w, h, pixel area for every 8-connected
+        region of clean_mask (background excluded), from one labeling pass
+        """
+        count, _, stats, _ = cv2.connectedComponentsWithStats(
+            self.clean_mask, labels=scratch('labels', self.shape, np.int32), connectivity=8, ltype=cv2.CV_32S
+        )
+        return stats[1:count]
+
+    @cached_property
+    def brown_pixel_count(self):
+        return int(cv2.countNonZero(self.clean_mask))
+
+    @cached_property
+    def largest_object(self):
+        """Bounding box (x, y, w, h) and area of the largest contour, or None"""
+        if not self.contours:
+            return None
+        largest_contour = max(self.contours, key=cv2.contourArea)
+        return cv2.boundingRect(largest_contour), cv2.contourArea(largest_contour)
+
+
+class PyramidSegmentation:
+    """
+    Two-level segmentation for large images.
+
+    The brown mask, edges and contour search run on a copy downscaled to
+    `working_side` (longest side). The largest object found there is then
+    re-segmented at full resolution inside its bounding box plus a margin, so
+    the final box and contour area come from full-resolution pixels while
+    the full-resolution work stays proportional to the object, not the photo.
+    If the refined object reaches the ROI border (thin parts lost when
+    downscaling), the ROI is grown and the refinement repeated.
+
+    Ratios (brown_ratio, edge_ratio), brown_pixel_count and component_stats
+    come from the downscaled level; counts, boxes and areas are scaled back
+    to full resolution (components are not refined like largest_object).
+    """
+
+    MAX_REFINEMENTS = 3
+
+    def __init__(self, rgb, working_side=PYRAMID_WORKING_SIDE):
+        self.rgb = np.ascontiguousarray(rgb)
+        height, width = self.rgb.shape[:2]
+        factor = max(height, width) / float(working_side)
+        small_size = (max(1, round(width / factor)), max(1, round(height / factor)))
+        self.coarse = BrownSegmentation(cv2.resize(self.rgb, small_size, interpolation=cv2.INTER_AREA))
+        self.scale_x = width / small_size[0]
+        self.scale_y = height / small_size[1]
+
+    @property
+    def shape(self):
+        return self.rgb.shape[:2]
+
+    @property
+    def brown_ratio(self):
+        return self.coarse.brown_ratio
+
+    @property
+    def edge_ratio(self):
+        return self.coarse.edge_ratio
+
+    @cached_property
+    def brown_pixel_count(self):
+        return int(round(self.coarse.brown_pixel_count * self.scale_x * self.scale_y))
+
+    @cached_property
+    def component_stats(self):
+        stats = self.coarse.component_stats.astype(np.float64)
+        stats[:, [0, 2]] *= self.scale_x
+        stats[:, [1, 3]] *= self.scale_y
+        stats[:, 4] *= self.scale_x * self.scale_y
+        return np.rint(stats).astype(np.int64)
+
+    def _roi(self, x, y, w, h, margin_x, margin_y):
+        height, width = self.shape
+        x0 = max(0, int(math.floor(x - margin_x)))
+        y0 = max(0, int(math.floor(y - margin_y)))
+        x1 = min(width, int(math.ceil(x + w + margin_x)))
+        y1 = min(height, int(math.ceil(y + h + margin_y)))
+        return x0, y0, x1, y1
+
+    @cached_property
+    def largest_object(self):
+        coarse = self.coarse.largest_object
+        if coarse is None:
+            return None
+        (cx, cy, cw, ch), coarse_area = coarse
+
+        # Coarse box in full-resolution pixels, padded by a few coarse pixels
+        # plus the morphology kernel so the object and its closing fit inside
+        x, y = cx * self.scale_x, cy * self.scale_y
+        w, h = cw * self.scale_x, ch * self.scale_y
+        margin_x = 2 * self.scale_x + MORPH_KERNEL.shape[1]
+        margin_y = 2 * self.scale_y + MORPH_KERNEL.shape[0]
+        height, width = self.shape
+
+        for _ in range(self.MAX_REFINEMENTS):
+            x0, y0, x1, y1 = self._roi(x, y, w, h, margin_x, margin_y)
+            refined = BrownSegmentation(self.rgb[y0:y1, x0:x1]).largest_object
+            if refined is None:
+                break
+            (rx, ry, rw, rh), area = refined
+            touches_border = (
+                (rx == 0 and x0 > 0) or (ry == 0 and y0 > 0) or
+                (rx + rw >= x1 - x0 and x1 < width) or (ry + rh >= y1 - y0 and y1 < height)
+            )
+            if not touches_border:
+                return (x0 + rx, y0 + ry, rw, rh), area
+            # Grow the ROI around the refined box and try again
+            x, y, w, h = x0 + rx, y0 + ry, rw, rh
+            margin_x, margin_y = max(margin_x, w / 2), max(margin_y, h / 2)
+
+        # Fall back to the coarse result scaled to full resolution
+        box = (int(round(x)), int(round(y)), int(round(w)), int(round(h)))
+        return box, coarse_area * self.scale_x * self.scale_y
+
+
+def segment_brown(image_pil, pyramid_min_side=PYRAMID_MIN_SIDE, working_side=PYRAMID_WORKING_SIDE):
+    """
+    Create the shared segmentation stage for a PIL image
+    Images whose longest side exceeds pyramid_min_side (0 disables) use the
+    two-level PyramidSegmentation.
+    """
+    if image_pil.mode != 'RGB':
+        image_pil = image_pil.convert('RGB')
+    rgb = np.asarray(image_pil)
+    if pyramid_min_side and max(rgb.shape[:2]) > pyramid_min_side:
+        return PyramidSegmentation(rgb, working_side)
+    return BrownSegmentation(rgb)
@@ -0,0 +1,85 @@
+"""
+Pooled model input buffers for the ML service
+Preprocessed pixels are written straight into reusable float32 batches instead
+of allocating (and then stacking) fresh float arrays for every image
+"""
+
+import threading
+from contextlib import contextmanager
+
+import numpy as np
+
+MODEL_INPUT_SHAPE = (224, 224, 3)
+
+
+def write_mobilenet_input(pixels, out):
+    """
+    uint8 RGB pixels -> [-1, 1] float32 in `out`: NumPy version of
+    mobilenet_v2.preprocess_input (same float32 operations, same result), so
+    preprocessing never needs TensorFlow
+    """
+    np.divide(pixels, np.float32(127.5), out=out, dtype=np.float32)
+    np.subtract(out, np.float32(1.), out=out)
+    return out
+
+
+def write_unit_input(pixels, out):
+    """uint8 RGB pixels -> [0, 1] float32 in `out` (the custom brown detector's /255 scaling)"""
+    np.divide(pixels, np.float32(255.), out=out, dtype=np.float32)
+    return out
+
+
+class BufferPool:
+    """
+    Free list of float32 (capacity, 224, 224, 3) batch buffers.
+
+    batch(n) lends a buffer with room for n images (as an (n, 224, 224, 3)
+    view) for the duration of a with-block. Buffers come back to the pool
+    afterwards, so steady-state inference allocates no input arrays at all.
+    Each concurrent caller (micro-batcher worker, /predict/batch request,
+    scoring loop) gets its own buffer; at most `max_idle` are kept between
+    uses, the rest are freed. max_idle=0 disables pooling.
+    """
+
+    def __init__(self, batch_size=8, max_idle=4, shape=MODEL_INPUT_SHAPE):
+        self.batch_size = max(1, int(batch_size))
+        self.max_idle = max(0, int(max_idle))
+        self.shape = tuple(shape)
+
+        self._lock = threading.Lock()
+        self._idle = []
+        self.allocations = 0
+        self.reuses = 0
+
+    def _take(self, n):
+        with self._lock:
+            for i, buffer in enumerate(self._idle):
+                if len(buffer) >= n:
+                    self.reuses += 1
+                    return self._idle.pop(i)
+            self.allocations += 1
+        return np.empty((max(n, self.batch_size),) + self.shape, dtype=np.float32)
+
+    def _give_back(self, buffer):
+        with self._lock:
+            if len(self._idle) < self.max_idle:
+                self._idle.append(buffer)
+
+    @contextmanager
+    def batch(self, n):
+        """Borrow an (n, 224, 224, 3) float32 batch; its contents are undefined until written"""
+        buffer = self._take(n)
+        try:
+            yield buffer[:n]
+        finally:
+            self._give_back(buffer)
+
+    def stats(self):
+        with self._lock:
+            idle_bytes = sum(buffer.nbytes for buffer in self._idle)
+            return {
+                'idle': len(self._idle),
+                'idleBytes': idle_bytes,
+                'allocations': self.allocations,
+                'reuses': self.reuses,
+            }
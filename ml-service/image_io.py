@@ -0,0 +1,76 @@
+"""
+Image decoding helpers for the ML service
+Decodes uploads straight from an in-memory buffer and, for JPEGs, at reduced
+resolution so full-size phone photos never get fully materialized
+"""
+
+import io
+
+from PIL import Image
+
+
+class MemoryViewReader(io.RawIOBase):
+    """
+    Read-only, seekable file object over a memoryview.
+
+    io.BytesIO(memoryview) copies the whole buffer up front; this reader hands
+    PIL slices of the original upload instead.
+    """
+
+    def __init__(self, buffer):
+        super().__init__()
+        self._view = memoryview(buffer).cast('B')
+        self._pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            position = offset
+        elif whence == io.SEEK_CUR:
+            position = self._pos + offset
+        elif whence == io.SEEK_END:
+            position = len(self._view) + offset
+        else:
+            raise ValueError(f'Invalid whence: {whence}')
+        if position < 0:
+            raise ValueError('Negative seek position')
+        self._pos = position
+        return self._pos
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            end = len(self._view)
+        else:
+            end = min(len(self._view), self._pos + size)
+        chunk = self._view[self._pos:end].tobytes()
+        self._pos = max(self._pos, end)
+        return chunk
+
+    def readinto(self, buffer):
+        chunk = self._view[self._pos:self._pos + len(buffer)]
+        buffer[:len(chunk)] = chunk
+        self._pos += len(chunk)
+        return len(chunk)
+
+
+def open_image(buffer, target_size=None):
+    """
+    Open an image from bytes / bytearray / memoryview without copying the buffer.
+
+    When target_size is given and the image is a JPEG, draft mode asks the
+    decoder for the smallest DCT scale (1/2, 1/4 or 1/8) that still covers
+    target_size, so a 12MP photo headed for 224x224 decodes at roughly 1/8 of
+    its pixels.
+    """
+    image = Image.open(MemoryViewReader(buffer))
+    if target_size is not None and image.format == 'JPEG':
+        image.draft('RGB', target_size)
+    return image
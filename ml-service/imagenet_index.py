@@ -0,0 +1,101 @@
+"""
+Precomputed ImageNet class-category index
+Maps each of the 1000 ImageNet classes to the service's categories (human,
+wood, ...) once, so classification is a few vectorized NumPy operations on
+the raw model output instead of per-request label decoding and substring scans
+"""
+
+import hashlib
+
+import numpy as np
+
+
+def load_imagenet_labels(tf):
+    """
+    (wnid, class name) for all 1000 ImageNet indices, using the same class
+    index file as keras' decode_predictions (downloaded/cached by Keras)
+    """
+    identity = np.eye(1000, dtype=np.float32)
+    decoded = tf.keras.applications.mobilenet_v2.decode_predictions(identity, top=1)
+    return [(row[0][0], row[0][1]) for row in decoded]
+
+
+class CategoryIndex:
+    """
+    Boolean masks over the 1000 ImageNet indices, one per category.
+
+    A class belongs to a category when its lower-cased name contains any of
+    the category's keywords, the same substring rule predict() has always
+    applied to the decoded top-10 labels.
+    """
+
+    def __init__(self, labels, categories):
+        self.wnids = [wnid for wnid, _ in labels]
+        self.class_names = [name for _, name in labels]
+        self.categories = {name: tuple(keywords) for name, keywords in categories.items()}
+
+        lower_names = [name.lower() for name in self.class_names]
+        self.masks = {
+            category: np.array([
+                any(keyword in class_name for keyword in keywords)
+                for class_name in lower_names
+            ])
+            for category, keywords in self.categories.items()
+        }
+        self.fingerprint = category_fingerprint(self.categories)
+
+    def top_k(self, probabilities, k=10):
+        """(N, k) class indices, highest probability first"""
+        probabilities = np.atleast_2d(probabilities)
+        k = min(k, probabilities.shape[1])
+        candidates = np.argpartition(-probabilities, k - 1, axis=1)[:, :k]
+        candidate_probs = np.take_along_axis(probabilities, candidates, axis=1)
+        order = np.argsort(-candidate_probs, axis=1, kind='stable')
+        return np.take_along_axis(candidates, order, axis=1)
+
+    def summarize(self, probabilities, top=10, raw=3):
+        """
+        Classify a batch of (N, 1000) probabilities in one pass.
+        Returns one dict per row with:
+          top_classes / top_confidences: the top `raw` labels (for logs and rawPredictions)
+          max_confidence: highest probability among the top `top`
+          <category>_detected: any top-`top` class in the category
+          <category>_score: summed probability of those classes
+        """
+        probabilities = np.atleast_2d(probabilities)
+        top_indices = self.top_k(probabilities, top)
+        top_probs = np.take_along_axis(probabilities, top_indices, axis=1)
+
+        flags = {}
+        scores = {}
+        for category, mask in self.masks.items():
+            in_category = mask[top_indices]
+            flags[category] = in_category.any(axis=1)
+            scores[category] = np.where(in_category, top_probs, 0).sum(axis=1)
+
+        summaries = []
+        for row in range(len(probabilities)):
+            summary = {
+                'top_classes': [self.class_names[i] for i in top_indices[row, :raw]],
+                'top_confidences': [float(p) for p in top_probs[row, :raw]],
+                'max_confidence': float(top_probs[row, 0]),
+            }
+            for category in self.masks:
+                summary[f'{category}_detected'] = bool(flags[category][row])
+                summary[f'{category}_score'] = float(scores[category][row])
+            summaries.append(summary)
+        return summaries
+
+    def decode(self, probabilities, top=5):
+        """decode_predictions()-style [(wnid, name, score), ...] for each row"""
+        probabilities = np.atleast_2d(probabilities)
+        return [
+            [(self.wnids[i], self.class_names[i], probabilities[row, i]) for i in indices]
+            for row, indices in enumerate(self.top_k(probabilities, top))
+        ]
+
+
+def category_fingerprint(categories):
+    """Short hash of the category keyword lists (part of result cache keys)"""
+    text = '|'.join(f'{name}:{",".join(keywords)}' for name, keywords in sorted(categories.items()))
+    return hashlib.sha1(text.encode()).hexdigest()[:8]
@@ -0,0 +1,230 @@
+"""
+Inference backends for the ML service
+Each backend takes a batch of MobileNetV2-preprocessed images and returns the
+ImageNet class probabilities plus the custom brown detector output
+"""
+
+import os
+import threading
+
+import numpy as np
+
+from metrics import STAGE_SECONDS
+
+
+class KerasBackend:
+    """
+    Two separate Keras models: the ImageNet MobileNetV2 classifier and the
+    optional custom brown detector (its own MobileNetV2 backbone, fed /255 input)
+    """
+
+    name = 'keras'
+
+    def __init__(self, base_model, brown_model=None):
+        self.base_model = base_model
+        self.brown_model = brown_model
+
+    @property
+    def has_brown_model(self):
+        return self.brown_model is not None
+
+    @property
+    def needs_brown_input(self):
+        # The separate brown detector was trained on /255 inputs, not preprocess_input
+        return self.brown_model is not None
+
+    def predict_brown(self, brown_batch):
+        """Run only the brown detector: (N,) outputs"""
+        with STAGE_SECONDS.time(stage='brown_forward'):
+            return self.brown_model.predict(brown_batch, verbose=0)[:, 0]
+
+    def predict_batch(self, imagenet_batch, brown_batch=None):
+        """
+        Returns: (N, 1000) ImageNet probabilities, (N,) brown outputs or None
+        """
+        with STAGE_SECONDS.time(stage='imagenet_forward'):
+            predictions = self.base_model.predict(imagenet_batch, verbose=0)
+
+        brown_predictions = None
+        if self.brown_model is not None and brown_batch is not None:
+            try:
+                with STAGE_SECONDS.time(stage='brown_forward'):
+                    brown_predictions = self.brown_model.predict(brown_batch, verbose=0)[:, 0]
+            except Exception as e:
+                print(f"⚠️  Custom model error: {e}")
+
+        return predictions, brown_predictions
+
+
+class CombinedKerasBackend:
+    """
+    One multi-output Keras model exported by train_brown_detector.py --combined:
+    a single MobileNetV2 backbone pass feeds both the 1000-class ImageNet head
+    and the brown head, so each image costs one forward pass
+    """
+
+    name = 'keras_combined'
+    has_brown_model = True
+    needs_brown_input = False
+
+    def __init__(self, combined_model):
+        self.model = combined_model
+
+    def predict_brown(self, imagenet_batch):
+        """Brown outputs for ImageNet-preprocessed input (still one full pass)"""
+        return self.predict_batch(imagenet_batch)[1]
+
+    def predict_batch(self, imagenet_batch, brown_batch=None):
+        with STAGE_SECONDS.time(stage='combined_forward'):
+            predictions, brown_output = self.model.predict(imagenet_batch, verbose=0)
+        return predictions, np.asarray(brown_output)[:, 0]
+
+
+# ==================== TFLITE ====================
+def _load_tflite_interpreter_class():
+    """Prefer the small tflite-runtime package, fall back to TensorFlow's interpreter"""
+    try:
+        from tflite_runtime.interpreter import Interpreter
+    except ImportError:
+        import tensorflow as tf
+        Interpreter = tf.lite.Interpreter
+    return Interpreter
+
+
+class TFLiteModel:
+    """
+    Thread-safe wrapper around one TFLite interpreter.
+
+    The interpreter is resized to the incoming batch size on demand, and
+    quantized (int8/uint8) inputs and outputs are converted with the tensor's
+    scale/zero-point so callers always pass and receive float32 arrays.
+    """
+
+    def __init__(self, model_path, num_threads=None, model_content=None):
+        Interpreter = _load_tflite_interpreter_class()
+        self.model_path = model_path
+        if model_content is not None:
+            # Flatbuffer already in memory (e.g. read by a pre-fork parent); used without copying
+            self.interpreter = Interpreter(model_content=model_content, num_threads=num_threads)
+        else:
+            self.interpreter = Interpreter(model_path=model_path, num_threads=num_threads)
+        self.interpreter.allocate_tensors()
+        self._input = self.interpreter.get_input_details()[0]
+        self._batch_size = int(self._input['shape'][0])
+        self._lock = threading.Lock()
+
+    def _resize(self, batch_size):
+        if batch_size != self._batch_size:
+            shape = [batch_size] + [int(dim) for dim in self._input['shape'][1:]]
+            self.interpreter.resize_tensor_input(self._input['index'], shape)
+            self.interpreter.allocate_tensors()
+            self._input = self.interpreter.get_input_details()[0]
+            self._batch_size = batch_size
+
+    @staticmethod
+    def _quantize(values, details):
+        dtype = details['dtype']
+        if dtype == np.float32:
+            return values.astype(np.float32, copy=False)
+        scale, zero_point = details['quantization']
+        info = np.iinfo(dtype)
+        return np.clip(np.round(values / scale + zero_point), info.min, info.max).astype(dtype)
+
+    @staticmethod
+    def _dequantize(values, details):
+        if details['dtype'] == np.float32:
+            return values
+        scale, zero_point = details['quantization']
+        return (values.astype(np.float32) - zero_point) * scale
+
+    def predict(self, batch):
+        """Returns every output tensor as float32, in interpreter output order"""
+        with self._lock:
+            self._resize(len(batch))
+            self.interpreter.set_tensor(self._input['index'], self._quantize(batch, self._input))
+            self.interpreter.invoke()
+            return [
+                self._dequantize(self.interpreter.get_tensor(details['index']), details)
+                for details in self.interpreter.get_output_details()
+            ]
+
+
+def _split_combined_outputs(outputs):
+    """Pick the (N, 1000) ImageNet and (N, 1) brown tensors; TFLite may reorder outputs"""
+    imagenet = next(output for output in outputs if output.shape[-1] == 1000)
+    brown = next(output for output in outputs if output.shape[-1] == 1)
+    return imagenet, brown
+
+
+class TFLiteBackend:
+    """
+    Post-training-quantized (float16 / int8) TFLite models exported by
+    train_brown_detector.py --export-tflite. Uses the combined shared-backbone
+    model when one was exported, otherwise the ImageNet classifier plus the
+    optional separate brown detector.
+    """
+
+    name = 'tflite'
+
+    def __init__(self, imagenet_path=None, brown_path=None, combined_path=None, num_threads=None,
+                 precision=None, model_contents=None):
+        self.precision = precision
+        model_contents = model_contents or {}
+
+        def load(path):
+            return TFLiteModel(path, num_threads, model_contents.get(path)) if path else None
+
+        self.combined = load(combined_path)
+        self.imagenet = None
+        self.brown = None
+        if self.combined is None:
+            self.imagenet = load(imagenet_path)
+            self.brown = load(brown_path)
+
+    @property
+    def has_brown_model(self):
+        return self.combined is not None or self.brown is not None
+
+    @property
+    def needs_brown_input(self):
+        return self.combined is None and self.brown is not None
+
+    def predict_brown(self, batch):
+        if self.combined is not None:
+            return self.predict_batch(batch)[1]
+        with STAGE_SECONDS.time(stage='brown_forward'):
+            return self.brown.predict(batch)[0][:, 0]
+
+    def predict_batch(self, imagenet_batch, brown_batch=None):
+        if self.combined is not None:
+            with STAGE_SECONDS.time(stage='combined_forward'):
+                outputs = self.combined.predict(imagenet_batch)
+            predictions, brown_output = _split_combined_outputs(outputs)
+            return predictions, brown_output[:, 0]
+
+        with STAGE_SECONDS.time(stage='imagenet_forward'):
+            predictions = self.imagenet.predict(imagenet_batch)[0]
+        brown_predictions = None
+        if self.brown is not None and brown_batch is not None:
+            try:
+                with STAGE_SECONDS.time(stage='brown_forward'):
+                    brown_predictions = self.brown.predict(brown_batch)[0][:, 0]
+            except Exception as e:
+                print(f"⚠️  Custom model error: {e}")
+        return predictions, brown_predictions
+
+
+def tflite_model_paths(tflite_dir, precision):
+    """
+    Locate the TFLite files written by train_brown_detector.py --export-tflite
+    Returns: dict of imagenet / brown / combined paths (None when missing)
+    """
+    def existing(filename):
+        path = os.path.join(tflite_dir, filename)
+        return path if os.path.exists(path) else None
+
+    return {
+        'imagenet': existing(f'imagenet_classifier_{precision}.tflite'),
+        'brown': existing(f'brown_detector_{precision}.tflite'),
+        'combined': existing(f'brown_detector_combined_{precision}.tflite'),
+    }
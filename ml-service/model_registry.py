@@ -0,0 +1,169 @@
+"""
+Versioned model registry
+train_brown_detector.py registers every trained model as a new version;
+app.py serves the version CURRENT points at and switches versions at runtime
+(POST /models/reload, or automatically when CURRENT changes).
+
+model_registry/
+├── CURRENT                          # id of the active version
+└── versions/
+    └── 20261018-064500-3f2a9c/
+        ├── metadata.json            # created, metrics, training settings, files
+        ├── brown_detector_model.h5
+        └── brown_detector_combined.h5   (trained with --combined)
+
+Usage:
+  python model_registry.py list
+  python model_registry.py activate 20261018-064500-3f2a9c
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+
+# Artifact roles -> file name inside a version directory
+MODEL_FILES = {
+    'brown': 'brown_detector_model.h5',
+    'combined': 'brown_detector_combined.h5',
+}
+
+
+class UnknownVersionError(KeyError):
+    pass
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _write_atomic(path, text):
+    """Write via a temp file + rename, so readers never see a partial file"""
+    directory = os.path.dirname(path) or '.'
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(text)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+class ModelRegistry:
+    def __init__(self, root='model_registry'):
+        self.root = root
+        self.versions_dir = os.path.join(root, 'versions')
+        self.current_path = os.path.join(root, 'CURRENT')
+
+    def versions(self):
+        """Registered version ids, oldest first"""
+        if not os.path.isdir(self.versions_dir):
+            return []
+        return sorted(
+            name for name in os.listdir(self.versions_dir)
+            if not name.startswith('.') and os.path.isfile(os.path.join(self.versions_dir, name, 'metadata.json'))
+        )
+
+    def version_dir(self, version):
+        path = os.path.join(self.versions_dir, version)
+        if os.sep in version or version.startswith('.') or not os.path.isdir(path):
+            raise UnknownVersionError(version)
+        return path
+
+    def metadata(self, version):
+        with open(os.path.join(self.version_dir(version), 'metadata.json')) as f:
+            return json.load(f)
+
+    def model_path(self, version, role):
+        """Path of one artifact ('brown' / 'combined') of a version, or None if it has none"""
+        path = os.path.join(self.version_dir(version), MODEL_FILES[role])
+        return path if os.path.exists(path) else None
+
+    def current(self):
+        """Active version id, or None when nothing was registered/activated"""
+        try:
+            with open(self.current_path) as f:
+                version = f.read().strip()
+        except FileNotFoundError:
+            return None
+        return version or None
+
+    def activate(self, version):
+        self.version_dir(version)
+        _write_atomic(self.current_path, version + '\n')
+
+    def register(self, files, metadata, activate=True):
+        """
+        Copy model files into a new version directory and write its metadata
+        files: {role: path} with roles from MODEL_FILES
+        Returns: the new version id
+        """
+        unknown = set(files) - set(MODEL_FILES)
+        if unknown:
+            raise ValueError(f'Unknown model roles: {sorted(unknown)}')
+
+        hashes = {role: file_sha256(path) for role, path in files.items()}
+        content_id = hashlib.sha256(''.join(hashes[role] for role in sorted(hashes)).encode()).hexdigest()
+        version = f"{time.strftime('%Y%m%d-%H%M%S')}-{content_id[:6]}"
+
+        # Assemble in a hidden directory, then rename: the version appears complete or not at all
+        os.makedirs(self.versions_dir, exist_ok=True)
+        staging = tempfile.mkdtemp(dir=self.versions_dir, prefix='.tmp-')
+        try:
+            for role, path in files.items():
+                shutil.copy2(path, os.path.join(staging, MODEL_FILES[role]))
+            metadata = dict(metadata, version=version, created=time.strftime('%Y-%m-%dT%H:%M:%S'), files={
+                role: {'file': MODEL_FILES[role], 'sha256': hashes[role], 'bytes': os.path.getsize(path)}
+                for role, path in files.items()
+            })
+            with open(os.path.join(staging, 'metadata.json'), 'w') as f:
+                json.dump(metadata, f, indent=2)
+            os.rename(staging, os.path.join(self.versions_dir, version))
+        except BaseException:
+            shutil.rmtree(staging, ignore_errors=True)
+            raise
+
+        if activate:
+            self.activate(version)
+        return version
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Inspect or switch registered models')
+    parser.add_argument('--registry', default=os.environ.get('ML_MODEL_REGISTRY', 'model_registry'))
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('list', help='List registered versions')
+    activate = commands.add_parser('activate', help='Make a version current (running services pick it up)')
+    activate.add_argument('version')
+    args = parser.parse_args()
+
+    registry = ModelRegistry(args.registry)
+    if args.command == 'list':
+        current = registry.current()
+        for version in registry.versions():
+            metadata = registry.metadata(version)
+            validation = metadata.get('validation', {})
+            marker = '*' if version == current else ' '
+            print(f"{marker} {version}  accuracy={validation.get('accuracy', '?')}  "
+                  f"auc={validation.get('auc', '?')}  files={','.join(metadata.get('files', {}))}")
+        if current is None:
+            print("(no active version)")
+    else:
+        try:
+            registry.activate(args.version)
+        except UnknownVersionError:
+            parser.error(f'unknown version: {args.version}')
+        print(f"✅ Active model version: {args.version}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,137 @@
+"""
+Content-addressed cache for /predict results
+Repeated scans of the same photo (retries, double taps, proxy timeouts)
+are answered from here instead of re-running the models
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+
+def image_cache_key(image_bytes, model_version):
+    """SHA-256 of the decoded image bytes, namespaced by the model version"""
+    digest = hashlib.sha256(image_bytes).hexdigest()
+    return f'{model_version}:{digest}'
+
+
+class ResultCache:
+    """
+    Bounded in-process LRU cache with a TTL, plus an optional on-disk tier.
+
+    Memory entries are evicted least-recently-used once `max_entries` is
+    reached. When `disk_dir` is set, results are also written there as JSON
+    files (one per key) so they survive restarts and are shared by workers
+    on the same host; disk entries older than the TTL are ignored and removed.
+    """
+
+    def __init__(self, max_entries=512, ttl_seconds=600, disk_dir=None):
+        self.max_entries = int(max_entries)
+        self.ttl = float(ttl_seconds)
+        self.disk_dir = disk_dir
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        if self.disk_dir:
+            os.makedirs(self.disk_dir, exist_ok=True)
+
+    @property
+    def enabled(self):
+        return self.max_entries > 0
+
+    def _disk_path(self, key):
+        # Keys contain the model version; hash again for a filesystem-safe name
+        return os.path.join(self.disk_dir, hashlib.sha256(key.encode()).hexdigest() + '.json')
+
+    def get(self, key):
+        """Cached result for key, or None"""
+        if not self.enabled:
+            return None
+
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, result = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return result
+                del self._entries[key]
+
+        result = self._disk_get(key)
+        with self._lock:
+            if result is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+            self._store(key, result, now)
+        return result
+
+    def set(self, key, result):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._store(key, result, time.monotonic())
+        self._disk_set(key, result)
+
+    def _store(self, key, result, now):
+        self._entries[key] = (now + self.ttl, result)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def _disk_get(self, key):
+        if not self.disk_dir:
+            return None
+        path = self._disk_path(key)
+        try:
+            if time.time() - os.path.getmtime(path) > self.ttl:
+                os.remove(path)
+                return None
+            with open(path) as f:
+                entry = json.load(f)
+            return entry['result'] if entry.get('key') == key else None
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def _disk_set(self, key, result):
+        if not self.disk_dir:
+            return
+        try:
+            # Write to a temp file and rename so readers never see partial JSON
+            fd, tmp_path = tempfile.mkstemp(dir=self.disk_dir, suffix='.tmp')
+            with os.fdopen(fd, 'w') as f:
+                json.dump({'key': key, 'result': result}, f)
+            os.replace(tmp_path, self._disk_path(key))
+        except (OSError, TypeError, ValueError) as e:
+            print(f"⚠️  Could not write result cache entry: {e}")
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                'enabled': self.enabled,
+                'entries': len(self._entries),
+                'maxEntries': self.max_entries,
+                'ttlSeconds': self.ttl,
+                'diskDir': self.disk_dir,
+                'hits': self.hits,
+                'diskHits': self.disk_hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hitRate': round((self.hits + self.disk_hits) / lookups, 4) if lookups else 0.0,
+            }
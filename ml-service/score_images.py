@@ -0,0 +1,310 @@
+"""
+Offline batch scoring for image directories
+Re-scores archived scans (e.g. after retraining) with the same models and
+rules as POST /predict, without going through HTTP:
+
+- worker processes read, decode and run the OpenCV analysis of each image
+- the main process stacks the decoded images into model batches and applies
+  classify_image(), so every record has the fields predict() returns
+- results are appended to a JSONL or CSV file as they finish; re-running
+  with the same --output skips files that were already scored
+- at most --max-in-flight decoded images are held at once, bounding memory
+
+Usage:
+  python score_images.py scans/ --output scores.jsonl
+  python score_images.py scans/ --output scores.csv --workers 8 --batch-size 32
+  python score_images.py stacks/ --output stacks.jsonl --multi-log
+
+Models are selected with the same ML_* environment variables as app.py.
+"""
+
+import argparse
+import csv
+import json
+import multiprocessing
+import os
+import sys
+import time
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import numpy as np
+
+import app as ml_app
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.webp')
+CSV_FIELDS = [
+    'file', 'detectedClass', 'confidence', 'height', 'width', 'diameter', 'estimatedLumber',
+    'quality', 'detectionMethod', 'error', 'modelVersion', 'rawPredictions',
+    'logCount', 'totalLumber', 'logs'
+]
+PROGRESS_INTERVAL_S = 5.0
+
+
+class SegmentationSummary:
+    """
+    The parts of a brown segmentation that classify_image() reads, without the
+    intermediate masks, so only a few numbers travel back from the workers
+    """
+
+    def __init__(self, segmentation):
+        self.shape = segmentation.shape
+        self.brown_ratio = segmentation.brown_ratio
+        self.edge_ratio = segmentation.edge_ratio
+        self.brown_pixel_count = segmentation.brown_pixel_count
+        self.largest_object = segmentation.largest_object
+        self.component_stats = segmentation.component_stats
+
+
+# ==================== WORKERS ====================
+def decode_and_analyze(path):
+    """
+    Worker process: decode one file to the 224x224 model image and run the
+    OpenCV analysis. Returns (path, 224x224 PIL image, summary, error)
+    """
+    try:
+        with open(path, 'rb') as f:
+            image_bytes = f.read()
+        _, image_pil = ml_app.preprocess_image_bytes(memoryview(image_bytes))
+        return path, image_pil, SegmentationSummary(ml_app.analyze_image(image_pil)), None
+    except Exception as e:
+        return path, None, None, f'Could not decode image: {e}'
+
+
+# ==================== FILES ====================
+def list_images(directory):
+    """Image files under directory (recursive), in sorted order"""
+    paths = []
+    for root, dirs, files in os.walk(directory):
+        dirs.sort()
+        paths.extend(
+            os.path.join(root, name) for name in sorted(files)
+            if name.lower().endswith(IMAGE_EXTENSIONS)
+        )
+    return paths
+
+
+def output_format(path, requested=None):
+    if requested:
+        return requested
+    return 'csv' if path.lower().endswith('.csv') else 'jsonl'
+
+
+def read_scored(output_path, fmt):
+    """
+    Files already scored successfully in an existing output, and the model
+    versions they were scored with. Failed files are retried.
+    """
+    scored, versions = set(), set()
+    if not os.path.exists(output_path):
+        return scored, versions
+
+    with open(output_path, newline='') as f:
+        if fmt == 'csv':
+            records = csv.DictReader(f)
+        else:
+            records = (json.loads(line) for line in f if line.strip())
+        try:
+            for record in records:
+                if record.get('detectedClass'):
+                    scored.add(record['file'])
+                    versions.add(record.get('modelVersion'))
+        except (json.JSONDecodeError, csv.Error) as e:
+            # A run killed mid-write can leave a truncated last line
+            print(f"⚠️  Stopped reading {output_path} at a malformed record: {e}")
+    return scored, versions
+
+
+class ResultWriter:
+    """Appends one record per image to a JSONL or CSV file, flushed after every batch"""
+
+    def __init__(self, path, fmt):
+        self.fmt = fmt
+        is_new = not os.path.exists(path) or os.path.getsize(path) == 0
+        self._file = open(path, 'a', newline='')
+        self._csv = None
+        if fmt == 'csv':
+            self._csv = csv.DictWriter(self._file, fieldnames=CSV_FIELDS, extrasaction='ignore')
+            if is_new:
+                self._csv.writeheader()
+
+    def write(self, record):
+        if self._csv is not None:
+            row = dict(record)
+            for field in ('rawPredictions', 'logs'):
+                if field in row:
+                    row[field] = json.dumps(row[field])
+            self._csv.writerow(row)
+        else:
+            self._file.write(json.dumps(record) + '\n')
+
+    def flush(self):
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+# ==================== SCORING ====================
+def score_batch(decoded, base_dir):
+    """
+    Model inference for a batch of decoded images, then the predict() rules
+    decoded: list of (path, image_pil, summary)
+    Returns: one record per image
+    """
+    items = []
+    for _, image_pil, _ in decoded:
+        items.append(ml_app.model_inputs(np.asarray(image_pil), image_pil, with_brown=not ml_app.CASCADE))
+
+    model_outputs = ml_app.run_model_batch(items)
+    summaries = ml_app.get_category_index().summarize(
+        np.concatenate([predictions for predictions, _, _ in model_outputs]), top=10
+    )
+    # Same detection cascade as the service: the brown model only runs where it can change the answer
+    brown_predictions = ml_app.complete_brown_predictions(
+        [image_pil for _, image_pil, _ in decoded], model_outputs, summaries,
+        [segmentation for _, _, segmentation in decoded]
+    )
+
+    records = []
+    for (path, image_pil, segmentation), (predictions, _, backend), brown_prediction, summary in zip(
+            decoded, model_outputs, brown_predictions, summaries):
+        # The workers ran the whole OpenCV analysis
+        result = ml_app._safe_classify(image_pil, predictions, brown_prediction, summary, segmentation,
+                                       ml_app.ANALYSIS_STAGES)
+        records.append(dict(result, file=os.path.relpath(path, base_dir), modelVersion=backend.model_version))
+    return records
+
+
+class Progress:
+    """Periodic progress / throughput line"""
+
+    def __init__(self, total):
+        self.total = total
+        self.done = 0
+        self.failed = 0
+        self.classes = Counter()
+        self.started = time.perf_counter()
+        self._last_report = self.started
+
+    def update(self, records):
+        for record in records:
+            self.done += 1
+            if record.get('detectedClass'):
+                self.classes[record['detectedClass']] += 1
+            else:
+                self.failed += 1
+        now = time.perf_counter()
+        if now - self._last_report >= PROGRESS_INTERVAL_S:
+            self._last_report = now
+            self.report()
+
+    def rate(self):
+        elapsed = time.perf_counter() - self.started
+        return self.done / elapsed if elapsed > 0 else 0.0
+
+    def report(self):
+        rate = self.rate()
+        eta = (self.total - self.done) / rate if rate > 0 else 0
+        print(f"📊 {self.done}/{self.total} images | {rate:.1f} images/s | "
+              f"{self.failed} failed | ETA {int(eta // 60)}m{int(eta % 60):02d}s")
+
+
+def score_directory(image_dir, output_path, fmt=None, workers=None, batch_size=32, max_in_flight=None):
+    """Score every image under image_dir into output_path; returns the Progress totals"""
+    fmt = output_format(output_path, fmt)
+    workers = workers or os.cpu_count() or 1
+    max_in_flight = max_in_flight or 2 * batch_size + workers
+    batch_size = min(batch_size, max_in_flight)
+
+    paths = list_images(image_dir)
+    scored, versions = read_scored(output_path, fmt)
+    pending = [path for path in paths if os.path.relpath(path, image_dir) not in scored]
+    print(f"📂 {len(paths)} images in {image_dir}, {len(paths) - len(pending)} already scored")
+
+    ml_app.load_models(warmup=False)
+    if not ml_app.models_ready():
+        raise RuntimeError(f"Model loading failed: {ml_app.model_state['error']}")
+    stale = versions - {ml_app.MODEL_VERSION}
+    if stale:
+        print(f"⚠️  {output_path} has results from other model versions ({', '.join(sorted(map(str, stale)))}); "
+              f"those files are not re-scored - use a new --output to re-score everything")
+
+    progress = Progress(len(pending))
+    writer = ResultWriter(output_path, fmt)
+    batch = []
+
+    def flush_batch():
+        records = score_batch(batch, image_dir)
+        for record in records:
+            writer.write(record)
+        writer.flush()
+        progress.update(records)
+        batch.clear()
+
+    # spawn: the workers must not inherit the parent's TensorFlow runtime
+    context = multiprocessing.get_context('spawn')
+    try:
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+            queued = iter(pending)
+            running = set()
+            while True:
+                # Keep at most max_in_flight images decoded or decoding
+                while len(running) + len(batch) < max_in_flight:
+                    path = next(queued, None)
+                    if path is None:
+                        break
+                    running.add(pool.submit(decode_and_analyze, path))
+                if not running:
+                    # Nothing left to decode (or the in-flight cap is reached): score the partial batch
+                    if not batch:
+                        break
+                    flush_batch()
+                    continue
+
+                finished, running = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    path, image_pil, summary, error = future.result()
+                    if error is not None:
+                        record = {'file': os.path.relpath(path, image_dir), 'error': error}
+                        writer.write(record)
+                        progress.update([record])
+                    else:
+                        batch.append((path, image_pil, summary))
+                    if len(batch) >= batch_size:
+                        flush_batch()
+    finally:
+        writer.close()
+
+    progress.report()
+    elapsed = time.perf_counter() - progress.started
+    print(f"✅ Scored {progress.done} images in {elapsed:.1f}s ({progress.rate():.1f} images/s)")
+    print(f"   {dict(progress.classes)}, {progress.failed} failed -> {output_path}")
+    return progress
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Score a directory of images offline')
+    parser.add_argument('image_dir', help='Directory of images (searched recursively)')
+    parser.add_argument('--output', '-o', default='scores.jsonl', help='Results file (.jsonl or .csv)')
+    parser.add_argument('--format', choices=['jsonl', 'csv'], help='Output format (default: from --output)')
+    parser.add_argument('--workers', type=int, default=None, help='Decode/analysis processes (default: CPU count)')
+    parser.add_argument('--batch-size', type=int, default=32, help='Images per model call')
+    parser.add_argument('--max-in-flight', type=int, default=None,
+                        help='Max decoded images held in memory (default: 2 x batch size + workers)')
+    parser.add_argument('--multi-log', action='store_true',
+                        help='Measure every log in the frame (same as ML_MULTI_LOG=1)')
+    args = parser.parse_args()
+    if args.multi_log:
+        ml_app.MULTI_LOG = True
+
+    if not os.path.isdir(args.image_dir):
+        print(f"❌ Not a directory: {args.image_dir}")
+        sys.exit(1)
+
+    print("🌴 Cocolumber Batch Scoring")
+    score_directory(args.image_dir, args.output, args.format, args.workers, args.batch_size, args.max_in_flight)
+
+
+if __name__ == '__main__':
+    main()
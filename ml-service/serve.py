@@ -0,0 +1,112 @@
+"""
+Production server for the Cocolumber ML service
+Runs app.py under gunicorn with a pre-fork worker model:
+
+- The parent imports the app once (preload_app) and calls
+  app.preload_for_fork(), so the TensorFlow import, the ImageNet category
+  index and the raw TFLite model files are loaded a single time and shared
+  copy-on-write by every worker.
+- Each worker then builds its own models in the background (TensorFlow's
+  runtime and thread pools cannot be shared across fork()) and reports ready
+  on /health/ready once warmed up.
+- TensorFlow threads are split between workers so N workers don't each start
+  one thread per core and oversubscribe the CPU.
+- SIGTERM stops accepting connections and lets in-flight requests finish
+  (up to ML_GRACEFUL_TIMEOUT seconds) before workers exit.
+
+Usage:
+  python serve.py
+  ML_WORKERS=4 ML_PORT=5000 python serve.py
+"""
+
+import os
+import sys
+
+# ==================== CONFIGURATION ====================
+CPU_COUNT = os.cpu_count() or 1
+WORKERS = int(os.environ.get('ML_WORKERS', min(4, CPU_COUNT)))
+# Request threads per worker: enough for app.py's admission limit plus its wait
+# queue, so overload is rejected with 503 + Retry-After by the app instead of
+# piling up unseen in gunicorn's connection backlog
+WORKER_THREADS = int(os.environ.get(
+    'ML_WORKER_THREADS',
+    max(4, int(os.environ.get('ML_MAX_CONCURRENT', os.environ.get('ML_BATCH_MAX_SIZE', 8)))
+        + int(os.environ.get('ML_ADMISSION_QUEUE_SIZE', 16)))
+))
+BIND = os.environ.get('ML_BIND', f"0.0.0.0:{os.environ.get('ML_PORT', 5000)}")
+# Seconds a worker may stay silent (e.g. during model loading) before it is restarted
+TIMEOUT = int(os.environ.get('ML_WORKER_TIMEOUT', 120))
+GRACEFUL_TIMEOUT = int(os.environ.get('ML_GRACEFUL_TIMEOUT', 30))
+
+# Give every worker an equal share of the cores unless set explicitly.
+# Must happen before app (and TensorFlow) is imported.
+os.environ.setdefault('ML_TF_INTRA_THREADS', str(max(1, CPU_COUNT // WORKERS)))
+os.environ.setdefault('ML_TF_INTER_THREADS', '1')
+os.environ.setdefault('ML_TFLITE_THREADS', os.environ['ML_TF_INTRA_THREADS'])
+os.environ.setdefault('TF_NUM_INTRAOP_THREADS', os.environ['ML_TF_INTRA_THREADS'])
+os.environ.setdefault('TF_NUM_INTEROP_THREADS', os.environ['ML_TF_INTER_THREADS'])
+os.environ.setdefault('OMP_NUM_THREADS', os.environ['ML_TF_INTRA_THREADS'])
+
+
+def post_worker_init(worker):
+    import app as ml_app
+    ml_app.start_model_loading()
+    print(f"⏳ Worker {worker.pid}: loading models in the background (see /health/ready)...")
+
+
+def worker_exit(server, worker):
+    import app as ml_app
+    # Let queued decode/analysis work finish before the process goes away
+    ml_app.decode_pool.shutdown(wait=True)
+    ml_app.analysis_pool.shutdown(wait=True)
+    print(f"👋 Worker {worker.pid} stopped")
+
+
+def run_gunicorn():
+    from gunicorn.app.base import BaseApplication
+
+    class MLServiceApplication(BaseApplication):
+        def load_config(self):
+            settings = {
+                'bind': BIND,
+                'workers': WORKERS,
+                'threads': WORKER_THREADS,
+                'worker_class': 'gthread',
+                'preload_app': True,
+                'timeout': TIMEOUT,
+                'graceful_timeout': GRACEFUL_TIMEOUT,
+                'post_worker_init': post_worker_init,
+                'worker_exit': worker_exit,
+            }
+            for key, value in settings.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            import app as ml_app
+            ml_app.preload_for_fork()
+            return ml_app.app
+
+    print("🌴 Cocolumber ML Detection Service Starting (production)...")
+    print(f"📡 {WORKERS} workers x {WORKER_THREADS} threads on {BIND}, "
+          f"{os.environ['ML_TF_INTRA_THREADS']} TensorFlow threads per worker")
+    MLServiceApplication().run()
+
+
+def run_single_process():
+    """Fallback where gunicorn is unavailable (e.g. Windows): one threaded process"""
+    import app as ml_app
+
+    host, _, port = BIND.rpartition(':')
+    print("⚠️  gunicorn not available - serving from a single process")
+    print(f"📡 Server running on http://{host}:{port}")
+    ml_app.start_model_loading()
+    ml_app.app.run(host=host, port=int(port), debug=False, threaded=True)
+
+
+if __name__ == '__main__':
+    try:
+        import gunicorn  # noqa: F401
+    except ImportError:
+        run_single_process()
+        sys.exit(0)
+    run_gunicorn()
@@ -0,0 +1,172 @@
+"""
+Camera streaming sessions
+A phone pointed at the same log sends near-identical frames many times a
+second. Each session remembers the last fully processed frame, and a cheap
+check on a downscaled copy (grayscale difference + color histogram) decides
+whether the scene changed enough to re-run the models and measurements.
+"""
+
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+import numpy as np
+from PIL import Image
+
+SIGNATURE_SIZE = (32, 32)
+HISTOGRAM_BINS = 16
+
+# Measurement fields smoothed across frames, with their response formatting
+SMOOTHED_FIELDS = {
+    'height': lambda value: str(round(value, 1)),
+    'width': lambda value: str(int(value)),
+    'diameter': lambda value: str(int(value)),
+    'estimatedLumber': lambda value: str(int(value)),
+}
+
+
+class FrameSignature:
+    """Downscaled grayscale frame plus a normalized per-channel color histogram"""
+
+    def __init__(self, image_pil):
+        thumbnail = np.asarray(image_pil.convert('RGB').resize(SIGNATURE_SIZE, Image.BILINEAR), dtype=np.float32)
+        self.gray = thumbnail @ np.array([0.299, 0.587, 0.114], dtype=np.float32)
+        histograms = [
+            np.histogram(thumbnail[..., channel], bins=HISTOGRAM_BINS, range=(0, 256))[0]
+            for channel in range(3)
+        ]
+        self.histogram = np.concatenate(histograms).astype(np.float32) / (thumbnail.shape[0] * thumbnail.shape[1])
+
+    def difference(self, other):
+        """
+        0 (identical) .. 1 (completely different): the larger of the mean
+        absolute grayscale difference and the color histogram distance
+        """
+        pixel_change = float(np.abs(self.gray - other.gray).mean()) / 255.0
+        # Each channel histogram sums to 1, so the total L1 distance is at most 6
+        histogram_change = float(np.abs(self.histogram - other.histogram).sum()) / 6.0
+        return max(pixel_change, histogram_change)
+
+
+class StreamSession:
+    """
+    State for one camera stream.
+
+    A frame is re-analyzed when its difference from the last processed frame
+    exceeds `change_threshold`, or when the previous result is older than
+    `max_reuse_s`. Otherwise the previous result is returned.
+    With `smoothing` (0..1, exponential moving average weight of the newest
+    frame) cocolumber measurements are averaged across processed frames.
+    """
+
+    def __init__(self, change_threshold, max_reuse_s, smoothing=0.0, session_id=None):
+        self.id = session_id or uuid.uuid4().hex
+        self.change_threshold = change_threshold
+        self.max_reuse_s = max_reuse_s
+        self.smoothing = smoothing
+        self.lock = threading.Lock()
+        self.frames = 0
+        self.processed = 0
+        self.last_signature = None
+        self.last_result = None
+        self.last_processed_at = 0.0
+        self._smoothed = None
+
+    def needs_processing(self, signature):
+        """(should re-run the pipeline, change score vs the last processed frame)"""
+        if self.last_signature is None or self.last_result is None:
+            return True, 1.0
+        change = signature.difference(self.last_signature)
+        if change > self.change_threshold:
+            return True, change
+        return time.monotonic() - self.last_processed_at > self.max_reuse_s, change
+
+    def record(self, signature, result):
+        """Store a freshly computed result; returns it (smoothed if enabled)"""
+        self.last_signature = signature
+        self.last_processed_at = time.monotonic()
+        self.processed += 1
+        self.last_result = self._smooth(result)
+        return self.last_result
+
+    def _smooth(self, result):
+        if not self.smoothing or result.get('detectedClass') != 'cocolumber':
+            self._smoothed = None
+            return result
+
+        try:
+            values = {field: float(result[field]) for field in SMOOTHED_FIELDS}
+        except (KeyError, TypeError, ValueError):
+            return result
+
+        if self._smoothed is None:
+            self._smoothed = values
+        else:
+            alpha = self.smoothing
+            self._smoothed = {
+                field: alpha * values[field] + (1 - alpha) * self._smoothed[field]
+                for field in SMOOTHED_FIELDS
+            }
+
+        smoothed = dict(result)
+        for field, format_value in SMOOTHED_FIELDS.items():
+            smoothed[field] = format_value(self._smoothed[field])
+        return smoothed
+
+
+class StreamSessionStore:
+    """Bounded set of sessions; idle sessions expire after `ttl_seconds`"""
+
+    def __init__(self, max_sessions=100, ttl_seconds=60):
+        self.max_sessions = int(max_sessions)
+        self.ttl = float(ttl_seconds)
+        self._sessions = OrderedDict()
+        self._last_seen = {}
+        self._lock = threading.Lock()
+
+    def _expire(self, now):
+        for session_id in [sid for sid, seen in self._last_seen.items() if now - seen > self.ttl]:
+            del self._sessions[session_id]
+            del self._last_seen[session_id]
+
+    def create(self, **options):
+        session = StreamSession(**options)
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            while len(self._sessions) >= self.max_sessions:
+                oldest, _ = self._sessions.popitem(last=False)
+                del self._last_seen[oldest]
+            self._sessions[session.id] = session
+            self._last_seen[session.id] = now
+        return session
+
+    def get(self, session_id):
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            session = self._sessions.get(session_id)
+            if session is not None:
+                self._sessions.move_to_end(session_id)
+                self._last_seen[session_id] = now
+            return session
+
+    def get_or_create(self, session_id, **options):
+        """
+        Existing session, or a fresh one under the same id (after expiry, or
+        when another worker process created it)
+        """
+        session = self.get(session_id)
+        if session is None:
+            session = self.create(session_id=session_id, **options)
+        return session
+
+    def close(self, session_id):
+        with self._lock:
+            self._last_seen.pop(session_id, None)
+            return self._sessions.pop(session_id, None) is not None
+
+    def __len__(self):
+        with self._lock:
+            return len(self._sessions)
@@ -0,0 +1,386 @@
+"""
+Hyperparameter sweep for the brown detector
+Trains train_brown_detector.py trials over a search space in parallel worker
+processes and writes a leaderboard of validation AUC against inference latency:
+
+- every worker process gets its own TensorFlow thread budget
+  (--threads-per-trial), so parallel trials don't oversubscribe the CPU
+- images are decoded once into an on-disk cache (--cache-dir) that every
+  trial reads, whatever its batch size
+- a median stopping rule ends trials whose best val AUC so far is below the
+  median of the other trials at the same epoch
+- single-image latency is measured per architecture after the trials, one
+  at a time, so running trials don't distort it
+- results go to sweeps/<timestamp>/: leaderboard.json / .csv, plus each
+  trial's result, training log and (with --save-models) model
+
+Usage:
+  python sweep_brown_detector.py --trials 12 --workers 3
+  python sweep_brown_detector.py --space sweep_space.json --trials 20 --workers 4 --threads-per-trial 2
+
+A search space is a JSON object of parameter -> list of candidate values
+(or a single fixed value), e.g.
+  {"learning_rate": [0.0001, 0.0003, 0.001], "batch_size": [16, 32],
+   "head_units": [[256, 128, 64], [128, 64]], "finetune_layers": [0, 30]}
+Parameters not in the space keep the defaults of a plain
+train_brown_detector.py --train run (finetune_layers 0: no fine-tuning).
+"""
+
+import argparse
+import contextlib
+import csv
+import itertools
+import json
+import multiprocessing
+import os
+import random
+import statistics
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+# Parameters a search space may set; head_units / head_dropout values are lists themselves
+SWEEP_PARAMS = ('learning_rate', 'batch_size', 'epochs', 'head_units', 'head_dropout',
+                'finetune_layers', 'finetune_epochs', 'alpha')
+LIST_PARAMS = ('head_units', 'head_dropout')
+
+DEFAULT_SPACE = {
+    'learning_rate': [0.0001, 0.0003, 0.001],
+    'batch_size': [16, 32],
+    'head_units': [[256, 128, 64], [128, 64], [64]],
+    'finetune_layers': [0, 30],
+}
+
+
+# ==================== SEARCH SPACE ====================
+def _candidates(name, value):
+    if name in LIST_PARAMS:
+        return value if value and all(isinstance(item, list) for item in value) else [value]
+    return value if isinstance(value, list) else [value]
+
+
+def sample_trials(space, trials=None, seed=42):
+    """
+    Parameter sets for the sweep: the full grid of the space, or a random
+    sample of `trials` of them when the grid is larger
+    """
+    unknown = set(space) - set(SWEEP_PARAMS)
+    if unknown:
+        raise ValueError(f'Unknown sweep parameters: {sorted(unknown)} (allowed: {", ".join(SWEEP_PARAMS)})')
+
+    names = sorted(space)
+    grid = [dict(zip(names, values)) for values in itertools.product(*(_candidates(n, space[n]) for n in names))]
+    if trials and trials < len(grid):
+        grid = random.Random(seed).sample(grid, trials)
+    return grid
+
+
+class MedianStoppingRule:
+    """
+    Median stopping rule shared by all worker processes through a Manager
+    dict of trial -> val AUC per epoch. After grace_epochs, a trial stops
+    when its best value so far is below the median of the other trials' best
+    values at the same epoch (once at least min_trials of them got that far).
+    """
+
+    def __init__(self, curves, grace_epochs=3, min_trials=3, trial_id=None):
+        self.curves = curves
+        self.grace_epochs = grace_epochs
+        self.min_trials = min_trials
+        self.trial_id = trial_id
+
+    def for_trial(self, trial_id):
+        return MedianStoppingRule(self.curves, self.grace_epochs, self.min_trials, trial_id)
+
+    def __call__(self, value):
+        curve = list(self.curves.get(self.trial_id, ())) + [value]
+        self.curves[self.trial_id] = curve
+        epoch = len(curve)
+        if epoch <= self.grace_epochs:
+            return False
+
+        others = [
+            max(other[:epoch]) for trial_id, other in self.curves.items()
+            if trial_id != self.trial_id and len(other) >= epoch
+        ]
+        if len(others) < self.min_trials:
+            return False
+        return max(curve) < statistics.median(others)
+
+
+# ==================== WORKERS ====================
+def _init_worker(threads):
+    """Pin this worker's thread budget; runs before TensorFlow is imported in the process"""
+    os.environ['OMP_NUM_THREADS'] = str(threads)
+    os.environ.setdefault('TF_CPP_MIN_LOG_LEVEL', '2')
+    import tensorflow as tf
+    tf.config.threading.set_intra_op_parallelism_threads(threads)
+    tf.config.threading.set_inter_op_parallelism_threads(1)
+    # The trainer prints its banner on import
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        import train_brown_detector  # noqa: F401
+
+
+def _limit_threads(dataset, threads):
+    import tensorflow as tf
+    options = tf.data.Options()
+    options.threading.private_threadpool_size = threads
+    return dataset.with_options(options)
+
+
+def warm_dataset_cache(data_dir, cache_dir, seed):
+    """Decode every image once into the on-disk cache the trials share"""
+    import train_brown_detector as trainer
+
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        train_data, val_data = trainer.load_training_data(data_dir, 'rescale', cache_dir, seed)
+        for dataset in (train_data, val_data):
+            for _ in dataset:
+                pass
+    return len(trainer.list_image_files(data_dir, 'training')), len(trainer.list_image_files(data_dir, 'validation'))
+
+
+def resolve_params(params):
+    """
+    Trial parameters with the train_brown_detector.py defaults filled in.
+    finetune_layers defaults to 0 (no fine-tuning), like a plain --train run
+    """
+    import train_brown_detector as trainer
+
+    return {
+        'learning_rate': params.get('learning_rate', trainer.LEARNING_RATE),
+        'batch_size': params.get('batch_size', trainer.BATCH_SIZE),
+        'epochs': params.get('epochs', trainer.EPOCHS),
+        'head_units': list(params.get('head_units', trainer.HEAD_UNITS)),
+        'head_dropout': list(params.get('head_dropout', trainer.HEAD_DROPOUT)),
+        'finetune_layers': params.get('finetune_layers', 0),
+        'finetune_epochs': params.get('finetune_epochs', trainer.FINETUNE_EPOCHS),
+        'alpha': params.get('alpha', 1.0),
+    }
+
+
+def run_trial(trial_id, params, config, stopping_rule):
+    """
+    Worker process: train one trial (output goes to its train.log)
+    Returns: result dict (status completed / pruned / failed)
+    """
+    import train_brown_detector as trainer
+    from tensorflow import keras
+
+    trial_dir = os.path.join(config['sweep_dir'], 'trials', trial_id)
+    os.makedirs(trial_dir, exist_ok=True)
+    keras.backend.clear_session()
+    trainer.RUN_LOG_PATH = os.path.join(trial_dir, 'training_runs.jsonl')
+
+    params = resolve_params(params)
+    result = {'trial': trial_id, 'status': 'failed', 'params': params}
+    reporter = trainer.EpochReporter(stopping_rule.for_trial(trial_id))
+    started = time.perf_counter()
+
+    with open(os.path.join(trial_dir, 'train.log'), 'w') as log, \
+            contextlib.redirect_stdout(log), contextlib.redirect_stderr(log):
+        try:
+            train_data, val_data = trainer.load_training_data(
+                config['data_dir'], 'rescale', config['cache_dir'], config['seed'], params['batch_size']
+            )
+            train_data = _limit_threads(train_data, config['threads'])
+            val_data = _limit_threads(val_data, config['threads'])
+
+            model, base_model = trainer.build_brown_detector(
+                config['weights'], head_units=params['head_units'], head_dropout=params['head_dropout'],
+                learning_rate=params['learning_rate'], alpha=params['alpha']
+            )
+            trainer.train_model(model, train_data, val_data, params['epochs'], callbacks=[reporter],
+                                batch_size=params['batch_size'])
+            if params['finetune_layers'] > 0 and not reporter.stopped:
+                trainer.finetune_model(
+                    model, base_model, train_data, val_data, finetune_layers=params['finetune_layers'],
+                    learning_rate=params['learning_rate'] / 10, epochs=params['finetune_epochs'],
+                    callbacks=[reporter], batch_size=params['batch_size']
+                )
+
+            result['validation'] = trainer.evaluate_model(model, val_data)
+            result['parameters'] = model.count_params()
+            result['epochs'] = len(stopping_rule.curves.get(trial_id, ()))
+            if config['save_models']:
+                result['model'] = os.path.join(trial_dir, 'brown_detector_model.h5')
+                model.save(result['model'])
+            result['status'] = 'pruned' if reporter.stopped else 'completed'
+        except Exception as e:
+            traceback.print_exc()
+            result['error'] = str(e)
+
+    result['seconds'] = round(time.perf_counter() - started, 1)
+    with open(os.path.join(trial_dir, 'result.json'), 'w') as f:
+        json.dump(result, f, indent=2)
+    return result
+
+
+def architecture_key(params):
+    """Inference cost depends on the architecture only, not on the trained weights"""
+    return json.dumps({'alpha': params['alpha'], 'head_units': params['head_units']})
+
+
+def measure_latencies(architectures, runs=30):
+    """
+    Worker process: median single-image latency (ms) of each architecture,
+    built with random weights and measured one after another
+    """
+    import numpy as np
+    import train_brown_detector as trainer
+    from tensorflow import keras
+
+    latencies = {}
+    batch = np.random.default_rng(0).random((8,) + trainer.IMAGE_SIZE + (3,), dtype=np.float32)
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        for key in architectures:
+            architecture = json.loads(key)
+            keras.backend.clear_session()
+            model, _ = trainer.build_brown_detector(
+                None, head_units=architecture['head_units'], alpha=architecture['alpha']
+            )
+            latencies[key] = round(trainer._latency_ms(lambda x: model(x, training=False), batch, runs), 2)
+    return latencies
+
+
+# ==================== LEADERBOARD ====================
+def mark_pareto(results):
+    """Flag completed trials no other completed trial beats on both val AUC and latency"""
+    completed = [r for r in results if r['status'] == 'completed' and r.get('latency_ms') is not None]
+    for result in results:
+        result['pareto'] = result in completed and not any(
+            other['validation']['auc'] >= result['validation']['auc']
+            and other['latency_ms'] <= result['latency_ms']
+            and (other['validation']['auc'] > result['validation']['auc'] or other['latency_ms'] < result['latency_ms'])
+            for other in completed
+        )
+
+
+def write_leaderboard(sweep_dir, results, swept):
+    """leaderboard.json / leaderboard.csv, best val AUC first (ties: faster first)"""
+    def sort_key(result):
+        auc = result.get('validation', {}).get('auc', -1)
+        return -auc, result.get('latency_ms') or float('inf')
+
+    ranked = sorted(results, key=sort_key)
+    for rank, result in enumerate(ranked, 1):
+        result['rank'] = rank
+
+    with open(os.path.join(sweep_dir, 'leaderboard.json'), 'w') as f:
+        json.dump(ranked, f, indent=2)
+
+    fields = ['rank', 'trial', 'status', 'val_auc', 'val_accuracy', 'latency_ms', 'pareto',
+              'parameters', 'epochs', 'seconds'] + list(swept)
+    with open(os.path.join(sweep_dir, 'leaderboard.csv'), 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=fields, extrasaction='ignore')
+        writer.writeheader()
+        for result in ranked:
+            validation = result.get('validation', {})
+            row = dict(result, val_auc=validation.get('auc'), val_accuracy=validation.get('accuracy'))
+            row.update({name: json.dumps(result['params'][name]) for name in swept if name in result['params']})
+            writer.writerow(row)
+    return ranked
+
+
+def print_leaderboard(ranked, swept, limit=15):
+    print("\n🏆 Leaderboard (val AUC vs single-image latency, ⭐ = Pareto-optimal)")
+    print(f"   {'#':>3}  {'trial':<10} {'status':<10} {'AUC':>7} {'acc':>7} {'latency':>10}  params")
+    for result in ranked[:limit]:
+        validation = result.get('validation', {})
+        auc = f"{validation['auc']:.4f}" if 'auc' in validation else '-'
+        accuracy = f"{validation['accuracy']:.3f}" if 'accuracy' in validation else '-'
+        latency = f"{result['latency_ms']:.1f} ms" if result.get('latency_ms') is not None else '-'
+        params = ', '.join(f"{name}={json.dumps(result['params'][name])}" for name in swept)
+        marker = '⭐' if result.get('pareto') else '  '
+        print(f" {marker}{result['rank']:>3}  {result['trial']:<10} {result['status']:<10} "
+              f"{auc:>7} {accuracy:>7} {latency:>10}  {params}")
+
+
+# ==================== MAIN ====================
+def run_sweep(space, trials=None, workers=2, threads_per_trial=None, data_dir='training_data',
+              cache_dir='.train_cache', output_dir='sweeps', weights='imagenet', seed=42,
+              grace_epochs=3, min_trials=3, save_models=False):
+    """Run the sweep; returns the ranked trial results"""
+    threads = threads_per_trial or max(1, (os.cpu_count() or 1) // workers)
+    parameter_sets = sample_trials(space, trials, seed)
+    swept = sorted(name for name in space if len(_candidates(name, space[name])) > 1)
+
+    sweep_dir = os.path.join(output_dir, time.strftime('%Y%m%d-%H%M%S'))
+    os.makedirs(sweep_dir, exist_ok=True)
+    with open(os.path.join(sweep_dir, 'space.json'), 'w') as f:
+        json.dump({'space': space, 'trials': parameter_sets, 'seed': seed, 'weights': weights}, f, indent=2)
+
+    print("🧪 Brown Detector Hyperparameter Sweep")
+    print(f"   {len(parameter_sets)} trials, {workers} in parallel x {threads} threads -> {sweep_dir}/")
+
+    config = {
+        'sweep_dir': sweep_dir, 'data_dir': data_dir, 'cache_dir': cache_dir, 'seed': seed,
+        'threads': threads, 'weights': None if weights == 'none' else weights, 'save_models': save_models,
+    }
+    # spawn: every worker starts its own TensorFlow runtime with its own thread budget
+    context = multiprocessing.get_context('spawn')
+    started = time.perf_counter()
+    results = []
+    with context.Manager() as manager, ProcessPoolExecutor(
+            max_workers=workers, mp_context=context, initializer=_init_worker, initargs=(threads,)) as pool:
+        train_count, val_count = pool.submit(warm_dataset_cache, data_dir, cache_dir, seed).result()
+        print(f"📂 {train_count} training / {val_count} validation images decoded into {cache_dir}/")
+
+        stopping_rule = MedianStoppingRule(manager.dict(), grace_epochs, min_trials)
+        futures = [
+            pool.submit(run_trial, f'trial-{i:03d}', params, config, stopping_rule)
+            for i, params in enumerate(parameter_sets)
+        ]
+        for future in as_completed(futures):
+            result = future.result()
+            results.append(result)
+            icon = {'completed': '✅', 'pruned': '✂️ ', 'failed': '❌'}[result['status']]
+            detail = (f"val AUC {result['validation']['auc']:.4f}, {result['epochs']} epochs"
+                      if 'validation' in result else result.get('error', ''))
+            print(f"{icon} [{len(results)}/{len(futures)}] {result['trial']} {result['status']}: "
+                  f"{detail} ({result['seconds']}s)")
+
+        architectures = sorted({architecture_key(r['params']) for r in results if r['status'] != 'failed'})
+        print(f"\n⏱️  Measuring latency of {len(architectures)} architectures...")
+        latencies = pool.submit(measure_latencies, architectures).result() if architectures else {}
+
+    for result in results:
+        result['latency_ms'] = latencies.get(architecture_key(result['params']))
+    mark_pareto(results)
+    ranked = write_leaderboard(sweep_dir, results, swept)
+    print_leaderboard(ranked, swept)
+    print(f"\n✅ Sweep finished in {time.perf_counter() - started:.0f}s")
+    print(f"   📄 {os.path.join(sweep_dir, 'leaderboard.csv')}")
+    return ranked
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Parallel hyperparameter sweep for the brown detector')
+    parser.add_argument('--space', help='Search space JSON file (default: a built-in space)')
+    parser.add_argument('--trials', type=int, default=12, help='Random sample of this many grid points (0 = full grid)')
+    parser.add_argument('--workers', type=int, default=2, help='Trials trained in parallel')
+    parser.add_argument('--threads-per-trial', type=int, default=None,
+                        help='TensorFlow threads per trial (default: CPU count / workers)')
+    parser.add_argument('--data-dir', default='training_data', help='Training data directory')
+    parser.add_argument('--cache-dir', default='.train_cache', help='Shared decoded-image cache')
+    parser.add_argument('--output-dir', default='sweeps', help='Where sweep results are written')
+    parser.add_argument('--weights', choices=['imagenet', 'none'], default='imagenet',
+                        help='Backbone initialization (none: random, for quick pipeline checks)')
+    parser.add_argument('--grace-epochs', type=int, default=3, help='Epochs before a trial can be stopped early')
+    parser.add_argument('--min-trials', type=int, default=3,
+                        help='Other trials needed at an epoch before the median rule applies')
+    parser.add_argument('--save-models', action='store_true', help="Save every trial's model (.h5)")
+    parser.add_argument('--seed', type=int, default=42, help='Trial sampling / training seed')
+    args = parser.parse_args()
+
+    space = DEFAULT_SPACE
+    if args.space:
+        with open(args.space) as f:
+            space = json.load(f)
+
+    run_sweep(space, args.trials or None, args.workers, args.threads_per_trial, args.data_dir, args.cache_dir,
+              args.output_dir, args.weights, args.seed, args.grace_epochs, args.min_trials, args.save_models)
+
+
+if __name__ == '__main__':
+    main()
@@ -2,14 +2,19 @@
 # This script fine-tunes a MobileNetV2 model specifically for brown object detection
 
 import os
+import time
 import numpy as np
 import tensorflow as tf
 from tensorflow import keras
 from tensorflow.keras import layers, models
-from tensorflow.keras.preprocessing.image import ImageDataGenerator
 from tensorflow.keras.applications import MobileNetV2
 from pathlib import Path
 import argparse
+import hashlib
+import json
+import re
+
+from model_registry import ModelRegistry
 
 print("🟤 Brown Object Detection Model Trainer")
 print("=" * 50)
@@ -19,8 +24,18 @@ IMAGE_SIZE = (224, 224)
 BATCH_SIZE = 16
 EPOCHS = 20
 LEARNING_RATE = 0.0001
+# Dense head after the pooled backbone features; dropout per dense layer (missing = none)
+HEAD_UNITS = (256, 128, 64)
+HEAD_DROPOUT = (0.3, 0.2)
+# Fine-tuning unfreezes this many backbone layers (from the top)
+FINETUNE_LAYERS = 50
+FINETUNE_EPOCHS = 5
 VALIDATION_SPLIT = 0.2
 TEST_SPLIT = 0.1
+SEED = 42
+AUTOTUNE = tf.data.AUTOTUNE
+# Step time and final metrics of every training phase are appended here
+RUN_LOG_PATH = 'training_runs.jsonl'
 
 # ==================== DATA COLLECTION ====================
 def create_default_training_data():
@@ -102,15 +117,20 @@ python train_brown_detector.py --train
     return data_dir
 
 # ==================== MODEL BUILDING ====================
-def build_brown_detector(pretrained_weights='imagenet'):
+def build_brown_detector(pretrained_weights='imagenet', jit_compile=False, head_units=HEAD_UNITS,
+                         head_dropout=HEAD_DROPOUT, learning_rate=LEARNING_RATE, alpha=1.0):
     """
     Build a custom brown detector using MobileNetV2 + transfer learning
+    jit_compile: compile the training step with XLA
+    head_units / head_dropout: dense head layer widths and their dropout rates
+    alpha: MobileNetV2 width multiplier (smaller = faster, less accurate)
     """
     print("\n🏗️  Building Brown Detection Model...")
     
     # Load pre-trained MobileNetV2 (no top classification layer)
     base_model = MobileNetV2(
         input_shape=IMAGE_SIZE + (3,),
+        alpha=alpha,
         include_top=False,
         weights=pretrained_weights
     )
@@ -119,106 +139,332 @@ def build_brown_detector(pretrained_weights='imagenet'):
     base_model.trainable = False
     
     # Build custom classification head
+    head = []
+    for i, units in enumerate(head_units):
+        # Dense layers for brown detection
+        head += [layers.Dense(units, activation='relu'), layers.BatchNormalization()]
+        if i < len(head_dropout) and head_dropout[i] > 0:
+            head.append(layers.Dropout(head_dropout[i]))
+    
     model = models.Sequential([
         base_model,
         layers.GlobalAveragePooling2D(),
-        
-        # Dense layers for brown detection
-        layers.Dense(256, activation='relu'),
-        layers.BatchNormalization(),
-        layers.Dropout(0.3),
-        
-        layers.Dense(128, activation='relu'),
-        layers.BatchNormalization(),
-        layers.Dropout(0.2),
-        
-        layers.Dense(64, activation='relu'),
-        layers.BatchNormalization(),
-        
+        *head,
         # Binary classification: Brown vs Not Brown
-        layers.Dense(1, activation='sigmoid')
+        # (kept in float32 under mixed precision for a numerically stable sigmoid/loss)
+        layers.Dense(1, activation='sigmoid', dtype='float32')
     ])
     
     # Compile model
     model.compile(
-        optimizer=keras.optimizers.Adam(learning_rate=LEARNING_RATE),
+        optimizer=keras.optimizers.Adam(learning_rate=learning_rate),
         loss='binary_crossentropy',
         metrics=[
             'accuracy',
             keras.metrics.Precision(),
             keras.metrics.Recall(),
             keras.metrics.AUC()
-        ]
+        ],
+        jit_compile=jit_compile
     )
     
     print("✅ Model built successfully!")
     print(f"   📊 Total parameters: {model.count_params():,}")
     print(f"   🔒 Base model frozen (transfer learning)")
+    print(f"   🧮 Precision: {keras.mixed_precision.global_policy().name}, XLA: {'on' if jit_compile else 'off'}")
     
     return model, base_model
 
-# ==================== DATA LOADING ====================
-def load_training_data(data_dir):
+# ==================== PRECISION / XLA ====================
+PRECISION_POLICIES = {'off': 'float32', 'bfloat16': 'mixed_bfloat16', 'float16': 'mixed_float16'}
+
+def cpu_supports_bfloat16():
+    """True when the CPU has native bfloat16 instructions (AVX512-BF16 or AMX)"""
+    try:
+        with open('/proc/cpuinfo') as f:
+            flags = f.read()
+    except OSError:
+        return False
+    return 'avx512_bf16' in flags or 'amx_bf16' in flags
+
+def resolve_precision(mode):
     """
-    Load training data from directory structure
+    --mixed-precision value -> Keras dtype policy name
+    'auto' picks float16 on a GPU, bfloat16 on CPUs with native support, else float32
+    """
+    if mode != 'auto':
+        return PRECISION_POLICIES[mode]
+    if tf.config.list_physical_devices('GPU'):
+        return 'mixed_float16'
+    if cpu_supports_bfloat16():
+        return 'mixed_bfloat16'
+    print("ℹ️  This CPU has no native bfloat16 support - training in float32")
+    return 'float32'
+
+def set_precision(policy):
+    """Set the global Keras dtype policy; must run before the model is built"""
+    if policy == 'mixed_bfloat16' and not tf.config.list_physical_devices('GPU') and not cpu_supports_bfloat16():
+        print("⚠️  bfloat16 is emulated on this CPU and will likely be slower than float32")
+    keras.mixed_precision.set_global_policy(policy)
+
+def to_float32_model(model, jit_compile=False):
+    """
+    Copy a mixed-precision model's weights (stored in float32) into a float32
+    model, so the saved .h5 runs in full precision in app.py and TFLite export
+    """
+    keras.mixed_precision.set_global_policy('float32')
+    float32_model, _ = build_brown_detector(pretrained_weights=None, jit_compile=jit_compile)
+    float32_model.set_weights(model.get_weights())
+    return float32_model
+
+class StepTimer(keras.callbacks.Callback):
+    """
+    Wall time of each training step, skipping the first (tracing / XLA compilation)
+    batch_size: images per step, for the images_per_s throughput
     """
-    print("\n📂 Loading training data...")
     
-    # Create image generator with augmentation
-    train_datagen = ImageDataGenerator(
-        rotation_range=20,
-        width_shift_range=0.2,
-        height_shift_range=0.2,
-        shear_range=0.2,
-        zoom_range=0.2,
-        horizontal_flip=True,
-        fill_mode='nearest',
-        rescale=1./255,
-        validation_split=VALIDATION_SPLIT
-    )
+    def __init__(self, batch_size=BATCH_SIZE, skip_steps=1):
+        super().__init__()
+        self.batch_size = batch_size
+        self.skip_steps = skip_steps
+        self.step_times = []
+        self._steps = 0
+        self._started = None
     
-    # Load training data
-    train_generator = train_datagen.flow_from_directory(
-        data_dir,
-        target_size=IMAGE_SIZE,
-        batch_size=BATCH_SIZE,
-        class_mode='binary',  # Brown=1, Not Brown=0
-        subset='training',
-        shuffle=True
+    def on_train_batch_begin(self, batch, logs=None):
+        self._started = time.perf_counter()
+    
+    def on_train_batch_end(self, batch, logs=None):
+        self._steps += 1
+        if self._steps > self.skip_steps:
+            self.step_times.append(time.perf_counter() - self._started)
+    
+    def summary(self):
+        if not self.step_times:
+            return {'steps_timed': 0}
+        times_ms = np.array(self.step_times) * 1000
+        return {
+            'steps_timed': len(times_ms),
+            'step_ms_median': round(float(np.median(times_ms)), 2),
+            'step_ms_mean': round(float(times_ms.mean()), 2),
+            'images_per_s': round(self.batch_size * 1000 / float(np.median(times_ms)), 1),
+        }
+
+class EpochReporter(keras.callbacks.Callback):
+    """
+    Passes the monitored validation metric to should_stop(value) after every
+    epoch (e.g. a sweep's median stopping rule) and ends training when it
+    returns True
+    """
+    
+    def __init__(self, should_stop, monitor='val_auc'):
+        super().__init__()
+        self.should_stop = should_stop
+        self.monitor = monitor
+        self.stopped = False
+    
+    def on_epoch_end(self, epoch, logs=None):
+        # Keras suffixes repeated metric names (val_auc_2)
+        value = next((v for k, v in (logs or {}).items() if re.sub(r'_\d+$', '', k) == self.monitor), None)
+        if value is not None and self.should_stop(float(value)):
+            print(f"\n✂️  Stopping early: {self.monitor} {float(value):.4f} is not competitive")
+            self.stopped = True
+            self.model.stop_training = True
+
+def log_training_run(phase, model, timer, history, log_path=None):
+    """Print and append (jsonl) the step time and final metrics of one training phase"""
+    record = {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'phase': phase,
+        'precision': keras.mixed_precision.global_policy().name,
+        'jit_compile': bool(getattr(model, 'jit_compile', False)),
+        'epochs_run': len(history.epoch),
+        **timer.summary(),
+        # Keras suffixes repeated metric names (precision_2); strip it so runs compare
+        'final_metrics': {
+            re.sub(r'_\d+$', '', name): round(float(values[-1]), 4) for name, values in history.history.items()
+        },
+    }
+    
+    print(f"\n⏱️  {phase}: {record['precision']}, XLA {'on' if record['jit_compile'] else 'off'}")
+    if record['steps_timed']:
+        print(f"   Step time: {record['step_ms_median']} ms median ({record['images_per_s']} images/s)")
+    print(f"   Final metrics: {record['final_metrics']}")
+    
+    with open(log_path or RUN_LOG_PATH, 'a') as f:
+        f.write(json.dumps(record) + '\n')
+    return record
+
+# ==================== DATA LOADING ====================
+IMAGE_EXTENSIONS = ('png', 'jpg', 'jpeg', 'bmp', 'ppm', 'tif', 'tiff')
+# Formats tf.io.decode_image reads natively; anything else is decoded with PIL
+TF_IMAGE_EXTENSIONS = ('png', 'jpg', 'jpeg', 'bmp', 'gif')
+
+def list_image_files(data_dir, subset=None):
+    """
+    List (path, label) pairs the same way flow_from_directory does:
+    classes are the sorted sub-folders (label = class index), files are walked
+    in sorted order, and the first VALIDATION_SPLIT of each class is the
+    'validation' subset while the rest is 'training'.
+    """
+    classes = sorted(
+        name for name in os.listdir(data_dir)
+        if os.path.isdir(os.path.join(data_dir, name))
     )
     
-    # Load validation data
-    validation_generator = train_datagen.flow_from_directory(
-        data_dir,
-        target_size=IMAGE_SIZE,
-        batch_size=BATCH_SIZE,
-        class_mode='binary',
-        subset='validation',
-        shuffle=False
+    files = []
+    for label, class_name in enumerate(classes):
+        class_dir = os.path.join(data_dir, class_name)
+        class_files = [
+            os.path.join(root, fname)
+            for root, _, fnames in sorted(os.walk(class_dir), key=lambda walk: walk[0])
+            for fname in sorted(fnames)
+            if fname.lower().endswith(tuple('.' + ext for ext in IMAGE_EXTENSIONS))
+        ]
+        split_at = int(VALIDATION_SPLIT * len(class_files))
+        if subset == 'validation':
+            class_files = class_files[:split_at]
+        elif subset == 'training':
+            class_files = class_files[split_at:]
+        files.extend((path, label) for path in class_files)
+    
+    return files
+
+def _read_image_pil(path):
+    from PIL import Image
+    return np.array(Image.open(path.decode()).convert('RGB'), dtype=np.uint8)
+
+def _decode_and_resize(path, label, use_pil=False):
+    """File -> IMAGE_SIZE uint8 RGB, resized with nearest neighbour like
+    flow_from_directory's default (nearest keeps the uint8 pixel values)"""
+    if use_pil:
+        image = tf.numpy_function(_read_image_pil, [path], tf.uint8)
+        image.set_shape([None, None, 3])
+    else:
+        data = tf.io.read_file(path)
+        # INTEGER_ACCURATE matches PIL's JPEG decoder (TF defaults to a faster, less exact IDCT)
+        image = tf.cond(
+            tf.io.is_jpeg(data),
+            lambda: tf.io.decode_jpeg(data, channels=3, dct_method='INTEGER_ACCURATE'),
+            lambda: tf.io.decode_image(data, channels=3, expand_animations=False)
+        )
+    return tf.image.resize(image, IMAGE_SIZE, method='nearest'), label
+
+def build_augmentation(seed=SEED):
+    """
+    Batched equivalent of the old ImageDataGenerator settings: rotation 20°,
+    width/height shift 0.2, zoom 0.2, horizontal flip, 'nearest' fill.
+    (The 0.2° shear was too small to matter and is not reproduced.)
+    Runs in float32 in the input pipeline regardless of the mixed-precision policy.
+    """
+    return keras.Sequential([
+        layers.RandomFlip('horizontal', seed=seed, dtype='float32'),
+        layers.RandomRotation(20 / 360, fill_mode='nearest', seed=seed, dtype='float32'),
+        layers.RandomTranslation(0.2, 0.2, fill_mode='nearest', seed=seed, dtype='float32'),
+        layers.RandomZoom((-0.2, 0.2), (-0.2, 0.2), fill_mode='nearest', seed=seed, dtype='float32'),
+    ], name='augmentation')
+
+def _scaling_fn(preprocessing):
+    if preprocessing == 'mobilenet':
+        # Same input scaling as the ImageNet classifier in app.py ([-1, 1])
+        return keras.applications.mobilenet_v2.preprocess_input
+    return lambda images: images / 255.0
+
+def _cache_path(cache_dir, subset, files):
+    """Cache file name tied to the file list (paths + mtimes), so new data invalidates it"""
+    digest = hashlib.sha1()
+    for path, label in files:
+        digest.update(f'{path}|{os.path.getmtime(path)}|{label}\n'.encode())
+    os.makedirs(cache_dir, exist_ok=True)
+    return os.path.join(cache_dir, f'{subset}_{IMAGE_SIZE[0]}x{IMAGE_SIZE[1]}_uint8_{digest.hexdigest()[:12]}')
+
+def make_dataset(files, preprocessing='rescale', training=False, cache_dir=None, seed=SEED, batch_size=BATCH_SIZE):
+    """
+    tf.data pipeline over (path, label) pairs:
+    parallel decode + resize -> optional cache (uint8, a quarter of the float32
+    size) -> (training: shuffle) -> batch -> float32 -> (training: batched
+    augmentation) -> scaling -> prefetch
+    """
+    paths = [path for path, _ in files]
+    labels = np.array([label for _, label in files], dtype=np.float32)
+    use_pil = any(not path.lower().endswith(TF_IMAGE_EXTENSIONS) for path in paths)
+    
+    dataset = tf.data.Dataset.from_tensor_slices((paths, labels))
+    dataset = dataset.map(
+        lambda path, label: _decode_and_resize(path, label, use_pil),
+        num_parallel_calls=AUTOTUNE,
+        deterministic=not training
     )
     
-    print(f"✅ Training samples: {train_generator.samples}")
-    print(f"✅ Validation samples: {validation_generator.samples}")
-    print(f"✅ Batch size: {BATCH_SIZE}")
+    # Decoded images are cached (in memory, or on disk with cache_dir); augmentation happens after
+    if cache_dir:
+        dataset = dataset.cache(_cache_path(cache_dir, 'training' if training else 'validation', files))
+    else:
+        dataset = dataset.cache()
+    
+    if training:
+        dataset = dataset.shuffle(len(files), seed=seed, reshuffle_each_iteration=True)
+    dataset = dataset.batch(batch_size)
+    dataset = dataset.map(lambda images, batch_labels: (tf.cast(images, tf.float32), batch_labels),
+                          num_parallel_calls=AUTOTUNE)
     
-    return train_generator, validation_generator
+    if training:
+        augmentation = build_augmentation(seed)
+        dataset = dataset.map(
+            lambda images, batch_labels: (augmentation(images, training=True), batch_labels),
+            num_parallel_calls=AUTOTUNE
+        )
+    
+    scale = _scaling_fn(preprocessing)
+    dataset = dataset.map(lambda images, batch_labels: (scale(images), batch_labels), num_parallel_calls=AUTOTUNE)
+    return dataset.prefetch(AUTOTUNE)
+
+def load_training_data(data_dir, preprocessing='rescale', cache_dir=None, seed=SEED, batch_size=BATCH_SIZE):
+    """
+    Load training data from directory structure
+    preprocessing: 'rescale' (/255, standalone model) or
+                   'mobilenet' (preprocess_input, shared-backbone combined model)
+    cache_dir: keep decoded images on disk between runs (default: in memory)
+    The train/validation split is the one flow_from_directory made (see list_image_files);
+    only the training split is augmented.
+    """
+    print("\n📂 Loading training data...")
+    
+    train_files = list_image_files(data_dir, 'training')
+    val_files = list_image_files(data_dir, 'validation')
+    
+    train_dataset = make_dataset(train_files, preprocessing, True, cache_dir, seed, batch_size)
+    val_dataset = make_dataset(val_files, preprocessing, False, cache_dir, seed, batch_size)
+    
+    print(f"✅ Training samples: {len(train_files)}")
+    print(f"✅ Validation samples: {len(val_files)}")
+    print(f"✅ Batch size: {batch_size}")
+    if cache_dir:
+        print(f"✅ Decoded image cache: {cache_dir}/")
+    
+    return train_dataset, val_dataset
 
 # ==================== TRAINING ====================
-def train_model(model, train_gen, val_gen):
+def train_model(model, train_gen, val_gen, epochs=EPOCHS, callbacks=(), batch_size=BATCH_SIZE):
     """
     Train the brown detector model
+    callbacks: extra Keras callbacks (e.g. an EpochReporter)
+    batch_size: the datasets' batch size (for the logged throughput)
     """
     print("\n🎓 Starting Training...")
-    print(f"   📈 Epochs: {EPOCHS}")
-    print(f"   🔄 Learning rate: {LEARNING_RATE}")
+    print(f"   📈 Epochs: {epochs}")
+    print(f"   🔄 Learning rate: {float(keras.backend.get_value(model.optimizer.learning_rate)):g}")
     print("   ⏱️  This may take several minutes...")
     
+    timer = StepTimer(batch_size)
     history = model.fit(
         train_gen,
         validation_data=val_gen,
-        epochs=EPOCHS,
+        epochs=epochs,
         verbose=1,
         callbacks=[
+            *callbacks,
+            timer,
             keras.callbacks.EarlyStopping(
                 monitor='val_loss',
                 patience=3,
@@ -235,25 +481,509 @@ def train_model(model, train_gen, val_gen):
         ]
     )
     
+    log_training_run('train', model, timer, history)
+    return history
+
+# ==================== CACHED FEATURES ====================
+class FeatureCache:
+    """
+    Pooled backbone features on disk, one row per (image content hash, copy).
+    
+    Copy 0 is the plain image, copies 1..N are augmented versions. Rows live
+    in a float32 memory-mapped file (features.f32) that grows as new images
+    are added; index.json maps "sha256:copy" to the row. The cache directory
+    is specific to the backbone weights, input scaling and image size, so a
+    change to any of them starts a new cache.
+    """
+    
+    def __init__(self, cache_dir, feature_dim):
+        self.cache_dir = cache_dir
+        self.feature_dim = feature_dim
+        self.index_path = os.path.join(cache_dir, 'index.json')
+        self.data_path = os.path.join(cache_dir, 'features.f32')
+        os.makedirs(cache_dir, exist_ok=True)
+        
+        self.index = {}
+        if os.path.exists(self.index_path):
+            with open(self.index_path) as f:
+                self.index = json.load(f)
+        self.rows = len(self.index)
+        self._features = None
+    
+    @staticmethod
+    def key(file_hash, copy):
+        return f'{file_hash}:{copy}'
+    
+    def __contains__(self, key):
+        return key in self.index
+    
+    def _resize(self, rows):
+        # Grow the backing file, then re-map it at the new size
+        self._features = None
+        with open(self.data_path, 'ab') as f:
+            f.truncate(rows * self.feature_dim * 4)
+    
+    @property
+    def features(self):
+        if self._features is None:
+            self._features = np.memmap(self.data_path, dtype=np.float32, mode='r+',
+                                       shape=(self.rows, self.feature_dim))
+        return self._features
+    
+    def add(self, keys, features):
+        start = self.rows
+        self.rows += len(keys)
+        self._resize(self.rows)
+        self.features[start:self.rows] = features
+        for offset, key in enumerate(keys):
+            self.index[key] = start + offset
+    
+    def get(self, keys):
+        return self.features[[self.index[key] for key in keys]]
+    
+    def save(self):
+        if self._features is not None:
+            self._features.flush()
+        tmp_path = self.index_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.index, f)
+        os.replace(tmp_path, self.index_path)
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def feature_cache_dir(root, preprocessing, pretrained_weights='imagenet', alpha=1.0, precision='float32'):
+    """One cache per backbone (width, weights, precision policy) and input scaling/size"""
+    return os.path.join(root, f'mobilenetv2_{alpha:.2f}_{pretrained_weights}_{preprocessing}_{precision}_'
+                              f'{IMAGE_SIZE[0]}x{IMAGE_SIZE[1]}')
+
+def compute_features(model, cache, files, copies, preprocessing='rescale', seed=SEED):
+    """
+    Run the frozen backbone (+ pooling) over every (image, copy) missing from
+    the cache. Returns the cache keys for `files`, copy by copy.
+    """
+    extractor = keras.Model(model.inputs, model.layers[1].output)
+    augmentation = build_augmentation(seed)
+    scale = _scaling_fn(preprocessing)
+    
+    hashes = [file_sha256(path) for path, _ in files]
+    missing = [
+        i for i, file_hash in enumerate(hashes)
+        if any(FeatureCache.key(file_hash, copy) not in cache for copy in range(copies + 1))
+    ]
+    print(f"   🧮 Features cached for {len(files) - len(missing)}/{len(files)} images, "
+          f"computing {len(missing)} x {copies + 1} copies...")
+    
+    if missing:
+        paths = [files[i][0] for i in missing]
+        use_pil = any(not path.lower().endswith(TF_IMAGE_EXTENSIONS) for path in paths)
+        dataset = tf.data.Dataset.from_tensor_slices((paths, np.zeros(len(paths), np.float32)))
+        dataset = dataset.map(lambda path, label: _decode_and_resize(path, label, use_pil),
+                              num_parallel_calls=AUTOTUNE)
+        dataset = dataset.batch(BATCH_SIZE * 2).prefetch(AUTOTUNE)
+        
+        position = 0
+        for images, _ in dataset:
+            images = tf.cast(images, tf.float32)
+            batch_hashes = [hashes[i] for i in missing[position:position + len(images)]]
+            position += len(images)
+            for copy in range(copies + 1):
+                batch = augmentation(images, training=True) if copy else images
+                features = extractor.predict(scale(batch), verbose=0)
+                keys = [FeatureCache.key(file_hash, copy) for file_hash in batch_hashes]
+                new = [j for j, key in enumerate(keys) if key not in cache]
+                cache.add([keys[j] for j in new], features[new])
+        cache.save()
+    
+    return [[FeatureCache.key(file_hash, copy) for file_hash in hashes] for copy in range(copies + 1)]
+
+def train_head_from_features(model, data_dir, preprocessing='rescale', copies=2,
+                             cache_root='feature_cache', seed=SEED, jit_compile=False, alpha=1.0):
+    """
+    Frozen-base training from cached features: the backbone runs once per
+    image (and augmented copy) and is then skipped; only the dense head is
+    trained. The head layers are shared with `model`, so `model` ends up with
+    the trained head.
+    alpha: the backbone's width multiplier (as passed to build_brown_detector)
+    """
+    print("\n🎓 Starting head-only training from cached backbone features...")
+    print(f"   📈 Epochs: {EPOCHS}")
+    print(f"   🔁 Augmented copies per training image: {copies}")
+    
+    train_files = list_image_files(data_dir, 'training')
+    val_files = list_image_files(data_dir, 'validation')
+    
+    feature_dim = int(model.layers[1].output.shape[-1])
+    precision = keras.mixed_precision.global_policy().name
+    cache = FeatureCache(feature_cache_dir(cache_root, preprocessing, alpha=alpha, precision=precision), feature_dim)
+    print(f"   💾 Feature cache: {cache.cache_dir}/")
+    
+    started = time.perf_counter()
+    train_keys = compute_features(model, cache, train_files, copies, preprocessing, seed)
+    val_keys = compute_features(model, cache, val_files, 0, preprocessing, seed)[0]
+    print(f"   ⏱️  Features ready in {time.perf_counter() - started:.1f}s")
+    
+    train_labels = np.array([label for _, label in train_files], dtype=np.float32)
+    x_train = np.concatenate([cache.get(keys) for keys in train_keys])
+    y_train = np.tile(train_labels, copies + 1)
+    x_val = cache.get(val_keys)
+    y_val = np.array([label for _, label in val_files], dtype=np.float32)
+    
+    head = keras.Sequential([keras.Input(shape=(feature_dim,))] + model.layers[2:], name='brown_head')
+    head.compile(
+        optimizer=keras.optimizers.Adam(learning_rate=LEARNING_RATE),
+        loss='binary_crossentropy',
+        metrics=['accuracy', keras.metrics.Precision(), keras.metrics.Recall(), keras.metrics.AUC()],
+        jit_compile=jit_compile
+    )
+    
+    timer = StepTimer(BATCH_SIZE)
+    started = time.perf_counter()
+    history = head.fit(
+        x_train, y_train,
+        validation_data=(x_val, y_val),
+        batch_size=BATCH_SIZE,
+        epochs=EPOCHS,
+        shuffle=True,
+        verbose=1,
+        callbacks=[
+            timer,
+            keras.callbacks.EarlyStopping(monitor='val_loss', patience=3, restore_best_weights=True, verbose=1),
+            keras.callbacks.ReduceLROnPlateau(monitor='val_loss', factor=0.5, patience=2, min_lr=1e-6, verbose=1)
+        ]
+    )
+    print(f"   ⏱️  Head trained in {time.perf_counter() - started:.1f}s")
+    
+    log_training_run('train_head_cached_features', head, timer, history)
     return history
 
 # ==================== MODEL SAVING ====================
-def save_model(model, model_path='brown_detector_model.h5'):
+def save_model(model, model_path='brown_detector_model.h5', registry_dir=None, combined_path=None,
+               metadata=None, activate=True):
     """
     Save trained model
+    With registry_dir, the model is also registered there as a new version
+    with its metadata; activate makes it the version running services switch
+    to. With combined_path only the combined model is registered: the head
+    was trained on [-1, 1] input and must not be served as the /255 'brown'
+    model.
     """
     print(f"\n💾 Saving model to: {model_path}")
     model.save(model_path)
-    print(f"✅ Model saved successfully!")
+    print("✅ Model saved successfully!")
     print(f"   📦 Size: {os.path.getsize(model_path) / 1024 / 1024:.2f} MB")
     
     # Also save as TensorFlow SavedModel format
     tf_model_path = model_path.replace('.h5', '_tf')
     model.save(tf_model_path)
-    print(f"\n💾 Saving TFLite model to: {tf_model_path}")
+    print(f"\n💾 Saved TensorFlow SavedModel to: {tf_model_path}")
+    print("   💡 For quantized TFLite models run: python train_brown_detector.py --export-tflite")
+    
+    if registry_dir:
+        files = {'combined': combined_path} if combined_path else {'brown': model_path}
+        version = ModelRegistry(registry_dir).register(files, metadata or {}, activate=activate)
+        print(f"\n🗂️  Registered model version {version} in {registry_dir}/"
+              f"{' (active)' if activate else ''}")
     
     return model_path
 
+def export_combined_model(model, combined_path='brown_detector_combined.h5'):
+    """
+    Export a shared-backbone model for the ML service.
+    
+    The brown head (everything after the backbone's pooling) is attached to the
+    pooled features of the ImageNet MobileNetV2 classifier, so one backbone
+    pass yields both the 1000-class probabilities and the brown probability.
+    Only valid when the backbone stayed frozen (ImageNet weights) and the head
+    was trained on mobilenet_v2.preprocess_input inputs (--combined).
+    """
+    print(f"\n🔗 Exporting combined ImageNet + brown model to: {combined_path}")
+    
+    imagenet_model = MobileNetV2(
+        input_shape=IMAGE_SIZE + (3,),
+        include_top=True,
+        weights='imagenet'
+    )
+    
+    # layers[-2] is the GlobalAveragePooling2D feeding the 'predictions' layer
+    pooled = imagenet_model.layers[-2].output
+    
+    # Reuse the trained head layers (skip the backbone and its pooling layer)
+    brown_output = pooled
+    for layer in model.layers[2:]:
+        brown_output = layer(brown_output)
+    
+    combined = keras.Model(
+        inputs=imagenet_model.input,
+        outputs=[imagenet_model.output, brown_output],
+        name='cocolumber_combined'
+    )
+    combined.save(combined_path)
+    
+    print("✅ Combined model saved!")
+    print(f"   📦 Size: {os.path.getsize(combined_path) / 1024 / 1024:.2f} MB")
+    print(f"   🧠 Outputs: ImageNet {tuple(combined.outputs[0].shape)}, brown {tuple(combined.outputs[1].shape)}")
+    
+    return combined_path
+
+# ==================== TFLITE EXPORT ====================
+TFLITE_PRECISIONS = ('float16', 'int8')
+
+def load_image_batch(paths, preprocessing='rescale'):
+    """Load images resized like app.py and scaled for the target model"""
+    from PIL import Image
+    
+    images = []
+    for path in paths:
+        img = Image.open(path).convert('RGB').resize(IMAGE_SIZE)
+        images.append(np.array(img, dtype=np.float32))
+    batch = np.stack(images)
+    
+    if preprocessing == 'mobilenet':
+        return keras.applications.mobilenet_v2.preprocess_input(batch)
+    return batch / 255.0
+
+def calibration_paths(data_dir, samples=100, seed=SEED):
+    """Deterministic sample of training-split images for int8 calibration"""
+    paths = [path for path, _ in list_image_files(data_dir, 'training')]
+    rng = np.random.default_rng(seed)
+    rng.shuffle(paths)
+    return paths[:samples]
+
+def convert_to_tflite(model, output_path, precision, calibration_images=None, preprocessing='rescale'):
+    """
+    Post-training quantization of a Keras model to TFLite
+    precision: 'float16' (weights in float16) or 'int8' (full integer, calibrated)
+    Inputs and outputs stay float32, so the service feeds the same arrays as Keras.
+    """
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    
+    if precision == 'float16':
+        converter.target_spec.supported_types = [tf.float16]
+    elif precision == 'int8':
+        if not calibration_images:
+            raise ValueError('int8 quantization needs calibration images')
+        
+        def representative_dataset():
+            for path in calibration_images:
+                yield [load_image_batch([path], preprocessing)]
+        
+        converter.representative_dataset = representative_dataset
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+    else:
+        raise ValueError(f'Unknown TFLite precision: {precision}')
+    
+    tflite_model = converter.convert()
+    with open(output_path, 'wb') as f:
+        f.write(tflite_model)
+    
+    print(f"   ✅ {output_path} ({len(tflite_model) / 1024 / 1024:.2f} MB)")
+    return output_path
+
+def export_tflite_models(data_dir, output_dir='tflite_models', precisions=TFLITE_PRECISIONS,
+                         brown_model_path='brown_detector_model.h5',
+                         combined_model_path='brown_detector_combined.h5',
+                         preprocessing='rescale', calibration_samples=100):
+    """
+    Export float16/int8 TFLite versions of the ImageNet classifier, the brown
+    detector and (if present) the combined shared-backbone model.
+    File names match what app.py looks for with ML_BACKEND=tflite.
+    """
+    print(f"\n📦 Exporting TFLite models to: {output_dir}/")
+    os.makedirs(output_dir, exist_ok=True)
+    
+    calibration = calibration_paths(data_dir, calibration_samples)
+    print(f"   🎯 Calibration images: {len(calibration)} (from {data_dir}/, training split)")
+    
+    # (name, keras model, input preprocessing)
+    exports = [(
+        'imagenet_classifier',
+        MobileNetV2(input_shape=IMAGE_SIZE + (3,), include_top=True, weights='imagenet'),
+        'mobilenet'
+    )]
+    if os.path.exists(brown_model_path):
+        exports.append(('brown_detector', keras.models.load_model(brown_model_path), preprocessing))
+    else:
+        print(f"   ℹ️  No brown detector at {brown_model_path}, exporting ImageNet classifier only")
+    if combined_model_path and os.path.exists(combined_model_path):
+        exports.append(('brown_detector_combined', keras.models.load_model(combined_model_path), 'mobilenet'))
+    
+    written = []
+    for name, model, model_preprocessing in exports:
+        for precision in precisions:
+            output_path = os.path.join(output_dir, f'{name}_{precision}.tflite')
+            written.append(convert_to_tflite(model, output_path, precision, calibration, model_preprocessing))
+    
+    return written
+
+def binary_auc(labels, scores):
+    """ROC AUC via the rank-sum (Mann-Whitney U) statistic"""
+    labels = np.asarray(labels)
+    scores = np.asarray(scores, dtype=np.float64)
+    positives = labels == 1
+    n_pos, n_neg = int(positives.sum()), int((~positives).sum())
+    if n_pos == 0 or n_neg == 0:
+        return None
+    
+    # Average ranks, so tied scores share the same rank
+    order = np.argsort(scores, kind='mergesort')
+    _, inverse, counts = np.unique(scores[order], return_inverse=True, return_counts=True)
+    average_ranks = np.cumsum(counts) - (counts - 1) / 2.0
+    ranks = np.empty(len(scores), dtype=np.float64)
+    ranks[order] = average_ranks[inverse]
+    
+    return float((ranks[positives].sum() - n_pos * (n_pos + 1) / 2) / (n_pos * n_neg))
+
+def _latency_ms(predict_one, batch, runs=20):
+    """Median single-image latency in milliseconds (after one warm-up call)"""
+    predict_one(batch[:1])
+    timings = []
+    for i in range(runs):
+        sample = batch[i % len(batch):i % len(batch) + 1]
+        start = time.perf_counter()
+        predict_one(sample)
+        timings.append((time.perf_counter() - start) * 1000)
+    return float(np.median(timings))
+
+def _split_combined(outputs):
+    """(ImageNet probabilities, brown probabilities) of a combined model; TFLite may reorder outputs"""
+    imagenet = next(output for output in outputs if output.shape[-1] == 1000)
+    brown = next(output for output in outputs if output.shape[-1] == 1)
+    return imagenet, brown[:, 0]
+
+def compare_backends(data_dir, tflite_dir='tflite_models', precisions=TFLITE_PRECISIONS,
+                     brown_model_path='brown_detector_model.h5', preprocessing='rescale',
+                     report_path=None, max_images=200, combined_model_path='brown_detector_combined.h5'):
+    """
+    Accuracy/latency report of the TFLite exports against the Keras models on
+    the validation split: ImageNet top-1/top-5 agreement, brown accuracy/AUC,
+    decision agreement, single-image latency and file size. The combined
+    shared-backbone model is reported under combined_* keys when it exists.
+    """
+    from model_backends import TFLiteModel
+    
+    print("\n📊 Comparing Keras and TFLite backends...")
+    files = list_image_files(data_dir, 'validation')[:max_images]
+    if not files:
+        print("⚠️  No validation images found")
+        return None
+    paths = [path for path, _ in files]
+    labels = np.array([label for _, label in files])
+    print(f"   🖼️  Validation images: {len(paths)}")
+    
+    imagenet_inputs = load_image_batch(paths, 'mobilenet')
+    brown_inputs = load_image_batch(paths, preprocessing)
+    
+    imagenet_model = MobileNetV2(input_shape=IMAGE_SIZE + (3,), include_top=True, weights='imagenet')
+    keras_imagenet = imagenet_model.predict(imagenet_inputs, batch_size=BATCH_SIZE, verbose=0)
+    keras_top1 = keras_imagenet.argmax(axis=1)
+    
+    brown_model = keras.models.load_model(brown_model_path) if os.path.exists(brown_model_path) else None
+    keras_brown = None
+    report = {'images': len(paths), 'backends': {}}
+    
+    keras_entry = {
+        'imagenet_latency_ms': _latency_ms(lambda x: imagenet_model(x, training=False), imagenet_inputs),
+    }
+    if brown_model is not None:
+        keras_brown = brown_model.predict(brown_inputs, batch_size=BATCH_SIZE, verbose=0)[:, 0]
+        keras_entry.update({
+            'brown_accuracy': float(((keras_brown > 0.5) == labels).mean()),
+            'brown_auc': binary_auc(labels, keras_brown),
+            'brown_latency_ms': _latency_ms(lambda x: brown_model(x, training=False), brown_inputs),
+            'brown_size_mb': os.path.getsize(brown_model_path) / 1024 / 1024,
+        })
+    combined_model = keras.models.load_model(combined_model_path) \
+        if combined_model_path and os.path.exists(combined_model_path) else None
+    keras_combined_top1 = keras_combined_brown = None
+    if combined_model is not None:
+        keras_combined_imagenet, keras_combined_brown = _split_combined(
+            combined_model.predict(imagenet_inputs, batch_size=BATCH_SIZE, verbose=0))
+        keras_combined_top1 = keras_combined_imagenet.argmax(axis=1)
+        keras_entry.update({
+            'combined_imagenet_top1_agreement': float((keras_combined_top1 == keras_top1).mean()),
+            'combined_brown_accuracy': float(((keras_combined_brown > 0.5) == labels).mean()),
+            'combined_brown_auc': binary_auc(labels, keras_combined_brown),
+            'combined_latency_ms': _latency_ms(lambda x: combined_model(x, training=False), imagenet_inputs),
+            'combined_size_mb': os.path.getsize(combined_model_path) / 1024 / 1024,
+        })
+    report['backends']['keras'] = keras_entry
+    
+    for precision in precisions:
+        imagenet_path = os.path.join(tflite_dir, f'imagenet_classifier_{precision}.tflite')
+        if not os.path.exists(imagenet_path):
+            print(f"   ⚠️  Missing {imagenet_path}, skipping {precision}")
+            continue
+        
+        tflite_imagenet = TFLiteModel(imagenet_path)
+        tflite_probs = np.concatenate([
+            tflite_imagenet.predict(imagenet_inputs[i:i + BATCH_SIZE])[0]
+            for i in range(0, len(paths), BATCH_SIZE)
+        ])
+        tflite_top5 = np.argsort(-tflite_probs, axis=1)[:, :5]
+        entry = {
+            'imagenet_top1_agreement': float((tflite_probs.argmax(axis=1) == keras_top1).mean()),
+            'imagenet_top5_agreement': float((tflite_top5 == keras_top1[:, None]).any(axis=1).mean()),
+            'imagenet_mean_abs_diff': float(np.abs(tflite_probs - keras_imagenet).mean()),
+            'imagenet_latency_ms': _latency_ms(tflite_imagenet.predict, imagenet_inputs),
+            'imagenet_size_mb': os.path.getsize(imagenet_path) / 1024 / 1024,
+        }
+        
+        brown_path = os.path.join(tflite_dir, f'brown_detector_{precision}.tflite')
+        if keras_brown is not None and os.path.exists(brown_path):
+            tflite_brown_model = TFLiteModel(brown_path)
+            tflite_brown = np.concatenate([
+                tflite_brown_model.predict(brown_inputs[i:i + BATCH_SIZE])[0][:, 0]
+                for i in range(0, len(paths), BATCH_SIZE)
+            ])
+            entry.update({
+                'brown_accuracy': float(((tflite_brown > 0.5) == labels).mean()),
+                'brown_auc': binary_auc(labels, tflite_brown),
+                'brown_decision_agreement': float(((tflite_brown > 0.5) == (keras_brown > 0.5)).mean()),
+                'brown_mean_abs_diff': float(np.abs(tflite_brown - keras_brown).mean()),
+                'brown_latency_ms': _latency_ms(tflite_brown_model.predict, brown_inputs),
+                'brown_size_mb': os.path.getsize(brown_path) / 1024 / 1024,
+            })
+        
+        combined_path = os.path.join(tflite_dir, f'brown_detector_combined_{precision}.tflite')
+        if combined_model is not None and os.path.exists(combined_path):
+            tflite_combined_model = TFLiteModel(combined_path)
+            tflite_combined = [
+                _split_combined(tflite_combined_model.predict(imagenet_inputs[i:i + BATCH_SIZE]))
+                for i in range(0, len(paths), BATCH_SIZE)
+            ]
+            combined_probs = np.concatenate([imagenet for imagenet, _ in tflite_combined])
+            combined_brown = np.concatenate([brown for _, brown in tflite_combined])
+            entry.update({
+                'combined_imagenet_top1_agreement': float((combined_probs.argmax(axis=1) == keras_combined_top1).mean()),
+                'combined_brown_accuracy': float(((combined_brown > 0.5) == labels).mean()),
+                'combined_brown_auc': binary_auc(labels, combined_brown),
+                'combined_brown_decision_agreement': float(
+                    ((combined_brown > 0.5) == (keras_combined_brown > 0.5)).mean()),
+                'combined_brown_mean_abs_diff': float(np.abs(combined_brown - keras_combined_brown).mean()),
+                'combined_latency_ms': _latency_ms(tflite_combined_model.predict, imagenet_inputs),
+                'combined_size_mb': os.path.getsize(combined_path) / 1024 / 1024,
+            })
+        
+        report['backends'][f'tflite_{precision}'] = entry
+    
+    for name, entry in report['backends'].items():
+        print(f"\n   🧠 {name}")
+        for key, value in entry.items():
+            print(f"      {key}: {value:.4f}" if isinstance(value, float) else f"      {key}: {value}")
+    
+    report_path = report_path or os.path.join(tflite_dir, 'backend_report.json')
+    with open(report_path, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"\n📝 Report saved: {report_path}")
+    
+    return report
+
 # ==================== EVALUATION ====================
 def evaluate_model(model, val_gen):
     """
@@ -261,15 +991,19 @@ def evaluate_model(model, val_gen):
     """
     print("\n📊 Evaluating Model...")
     
-    results = model.evaluate(val_gen, verbose=0)
+    results = model.evaluate(val_gen, verbose=0, return_dict=True)
+    # Keras suffixes repeated metric names (precision_1); strip it
+    results = {re.sub(r'_\d+$', '', name): round(float(value), 4) for name, value in results.items()}
     
-    print(f"✅ Validation Accuracy: {results[1]*100:.2f}%")
-    print(f"✅ Validation Precision: {results[2]*100:.2f}%")
-    print(f"✅ Validation Recall: {results[3]*100:.2f}%")
-    print(f"✅ Validation AUC: {results[4]:.4f}")
+    print(f"✅ Validation Accuracy: {results['accuracy']*100:.2f}%")
+    print(f"✅ Validation Precision: {results['precision']*100:.2f}%")
+    print(f"✅ Validation Recall: {results['recall']*100:.2f}%")
+    if 'auc' in results:
+        print(f"✅ Validation AUC: {results['auc']:.4f}")
+    return results
 
 # ==================== TEST PREDICTION ====================
-def test_prediction(model, image_path):
+def test_prediction(model, image_path, preprocessing='rescale'):
     """
     Test the model on a single image
     """
@@ -281,7 +1015,10 @@ def test_prediction(model, image_path):
         # Load and preprocess image
         img = Image.open(image_path).convert('RGB')
         img = img.resize(IMAGE_SIZE)
-        img_array = np.array(img) / 255.0
+        if preprocessing == 'mobilenet':
+            img_array = keras.applications.mobilenet_v2.preprocess_input(np.array(img, dtype=np.float32))
+        else:
+            img_array = np.array(img) / 255.0
         img_batch = np.expand_dims(img_array, axis=0)
         
         # Predict
@@ -300,32 +1037,40 @@ def test_prediction(model, image_path):
         return None, None
 
 # ==================== FINE-TUNING ====================
-def finetune_model(model, base_model, train_gen, val_gen):
+def finetune_model(model, base_model, train_gen, val_gen, jit_compile=False, finetune_layers=FINETUNE_LAYERS,
+                   learning_rate=LEARNING_RATE / 10, epochs=FINETUNE_EPOCHS, callbacks=(), batch_size=BATCH_SIZE):
     """
     Fine-tune base model weights (after initial training)
+    finetune_layers: how many of the top backbone layers to unfreeze
+    batch_size: the datasets' batch size (for the logged throughput)
     """
     print("\n🔄 Fine-tuning Model...")
-    print("   🔓 Unfreezing base model layers...")
+    print(f"   🔓 Unfreezing the last {finetune_layers} base model layers...")
     
-    # Unfreeze last 50 layers
-    for layer in base_model.layers[-50:]:
-        layer.trainable = True
+    # Sublayer flags only count once the backbone itself is trainable again
+    base_model.trainable = True
+    for layer in base_model.layers[:max(0, len(base_model.layers) - finetune_layers)]:
+        layer.trainable = False
     
     # Recompile with lower learning rate
     model.compile(
-        optimizer=keras.optimizers.Adam(learning_rate=LEARNING_RATE / 10),
+        optimizer=keras.optimizers.Adam(learning_rate=learning_rate),
         loss='binary_crossentropy',
-        metrics=['accuracy', keras.metrics.Precision(), keras.metrics.Recall()]
+        metrics=['accuracy', keras.metrics.Precision(), keras.metrics.Recall(), keras.metrics.AUC()],
+        jit_compile=jit_compile
     )
     
     # Train again with lower learning rate
+    timer = StepTimer(batch_size)
     history = model.fit(
         train_gen,
         validation_data=val_gen,
-        epochs=5,
-        verbose=1
+        epochs=epochs,
+        verbose=1,
+        callbacks=[*callbacks, timer]
     )
     
+    log_training_run('finetune', model, timer, history)
     return history
 
 # ==================== MAIN ====================
@@ -336,8 +1081,47 @@ def main():
     parser.add_argument('--finetune', action='store_true', help='Fine-tune existing model')
     parser.add_argument('--data-dir', default='training_data', help='Training data directory')
     parser.add_argument('--model', default='brown_detector_model.h5', help='Model save path')
+    parser.add_argument('--combined', action='store_true',
+                        help='Train on the ImageNet input scaling and export a shared-backbone model for app.py')
+    parser.add_argument('--combined-model', default='brown_detector_combined.h5', help='Combined model save path')
+    parser.add_argument('--combined-head', default='brown_detector_combined_head.h5',
+                        help='Where --combined saves the trained brown head (takes ImageNet-scaled input, '
+                             'so it never replaces --model)')
+    parser.add_argument('--export-tflite', action='store_true',
+                        help='Export float16/int8 TFLite models (ImageNet classifier + brown detector)')
+    parser.add_argument('--compare-backends', action='store_true',
+                        help='Write an accuracy/latency report of the TFLite exports vs Keras')
+    parser.add_argument('--tflite-dir', default='tflite_models', help='TFLite output directory')
+    parser.add_argument('--tflite-precision', choices=['float16', 'int8', 'both'], default='both',
+                        help='TFLite quantization to export/compare')
+    parser.add_argument('--calibration-samples', type=int, default=100,
+                        help='Training images used to calibrate int8 quantization')
+    parser.add_argument('--cache-dir', default=None,
+                        help='Cache decoded training images on disk here (default: in memory)')
+    parser.add_argument('--seed', type=int, default=SEED, help='Shuffle/augmentation seed')
+    parser.add_argument('--cached-features', action='store_true',
+                        help='Frozen-base training: compute backbone features once, then train only the head')
+    parser.add_argument('--augmented-copies', type=int, default=2,
+                        help='Augmented copies per training image in --cached-features mode')
+    parser.add_argument('--feature-cache-dir', default='feature_cache',
+                        help='Where --cached-features stores backbone features')
+    parser.add_argument('--mixed-precision', choices=['off', 'auto', 'bfloat16', 'float16'], default='off',
+                        help='Mixed-precision training (auto: float16 on GPU, bfloat16 on supporting CPUs)')
+    parser.add_argument('--xla', action='store_true', help='Compile training steps with XLA (jit_compile)')
+    parser.add_argument('--registry', default='model_registry',
+                        help='Model registry directory trained models are registered in')
+    parser.add_argument('--no-register', action='store_true', help='Do not register the trained model')
+    parser.add_argument('--no-activate', action='store_true',
+                        help='Register without making it the active version')
     
     args = parser.parse_args()
+    preprocessing = 'mobilenet' if args.combined else 'rescale'
+    # The standalone brown model (app.py, TFLite export, registry 'brown' role) takes /255 input
+    model_path = args.combined_head if args.combined else args.model
+    
+    if args.combined and args.finetune:
+        print("❌ --combined needs the ImageNet backbone unchanged; it cannot be used with --finetune")
+        return
     
     # Create data directories if they don't exist
     if not os.path.exists(args.data_dir):
@@ -358,42 +1142,98 @@ def main():
         print(f"   ⚪ Not-brown images: {not_brown_count} (need at least 50)")
         return
     
+    precisions = TFLITE_PRECISIONS if args.tflite_precision == 'both' else (args.tflite_precision,)
+    
+    # TFLite export / backend comparison (without --train: use the saved models)
+    if (args.export_tflite or args.compare_backends) and not args.train:
+        if args.export_tflite:
+            export_tflite_models(args.data_dir, args.tflite_dir, precisions, args.model,
+                                 args.combined_model, calibration_samples=args.calibration_samples)
+        if args.compare_backends:
+            compare_backends(args.data_dir, args.tflite_dir, precisions, args.model,
+                             combined_model_path=args.combined_model)
+        return
+    
+    # Precision policy has to be set before any model is built
+    precision_policy = resolve_precision(args.mixed_precision) if args.train else 'float32'
+    set_precision(precision_policy)
+    
     # Build or load model
-    if args.finetune and os.path.exists(args.model):
-        print(f"\n📦 Loading existing model: {args.model}")
-        model = keras.models.load_model(args.model)
+    if args.finetune and os.path.exists(model_path):
+        print(f"\n📦 Loading existing model: {model_path}")
+        # Rebuilt and re-weighted so the precision/XLA settings and base_model apply
+        model, base_model = build_brown_detector(pretrained_weights=None, jit_compile=args.xla)
+        model.set_weights(keras.models.load_model(model_path).get_weights())
     else:
-        model, base_model = build_brown_detector()
+        model, base_model = build_brown_detector(jit_compile=args.xla)
     
     # Test mode
     if args.test:
-        if os.path.exists(args.model):
-            model = keras.models.load_model(args.model)
-            test_prediction(model, args.test)
+        if os.path.exists(model_path):
+            model = keras.models.load_model(model_path)
+            test_prediction(model, args.test, preprocessing)
         else:
-            print(f"❌ Model not found: {args.model}")
+            print(f"❌ Model not found: {model_path}")
         return
     
     # Training mode
     if args.train:
-        train_gen, val_gen = load_training_data(args.data_dir)
+        train_gen, val_gen = load_training_data(args.data_dir, preprocessing, args.cache_dir, args.seed)
         
         # Train model
-        if not args.finetune:
-            history = train_model(model, train_gen, val_gen)
+        if not args.finetune and args.cached_features:
+            train_head_from_features(model, args.data_dir, preprocessing, args.augmented_copies,
+                                     args.feature_cache_dir, args.seed, args.xla)
+        elif not args.finetune:
+            train_model(model, train_gen, val_gen)
         
         # Evaluate
-        evaluate_model(model, val_gen)
+        validation = evaluate_model(model, val_gen)
         
         # Fine-tune if requested
         if args.finetune:
-            finetune_model(model, base_model, train_gen, val_gen)
+            finetune_model(model, base_model, train_gen, val_gen, args.xla)
+            validation = evaluate_model(model, val_gen)
+        
+        # Saved models always run in float32 (app.py, combined and TFLite export)
+        if precision_policy != 'float32':
+            model = to_float32_model(model)
+        
+        if args.combined:
+            export_combined_model(model, args.combined_model)
+        
+        # Save model (and register it with what produced it)
+        metadata = {
+            'validation': validation,
+            'training': {
+                'data_dir': args.data_dir,
+                'images': {'brown': brown_count, 'not_brown': not_brown_count},
+                'preprocessing': preprocessing,
+                'combined': args.combined,
+                'finetune': args.finetune,
+                'cached_features': args.cached_features,
+                'precision': precision_policy,
+                'xla': args.xla,
+                'seed': args.seed,
+                'image_size': list(IMAGE_SIZE),
+                'tensorflow': tf.__version__,
+            },
+        }
+        save_model(model, model_path, None if args.no_register else args.registry,
+                   args.combined_model if args.combined else None, metadata, not args.no_activate)
         
-        # Save model
-        save_model(model, args.model)
+        if args.export_tflite:
+            export_tflite_models(args.data_dir, args.tflite_dir, precisions, args.model,
+                                 args.combined_model if args.combined else None,
+                                 calibration_samples=args.calibration_samples)
+        if args.compare_backends:
+            compare_backends(args.data_dir, args.tflite_dir, precisions, args.model,
+                             combined_model_path=args.combined_model if args.combined else None)
         
         print("\n✅ Training Complete!")
-        print(f"   📦 Model saved: {args.model}")
+        print(f"   📦 Model saved: {model_path}")
+        if args.combined:
+            print(f"   🔗 Combined model saved: {args.combined_model}")
         print(f"   🚀 Ready for deployment!")
         
         return
@@ -406,6 +1246,8 @@ def main():
         print("   3. Run training: python train_brown_detector.py --train")
         print("   4. Test model: python train_brown_detector.py --test <image_path>")
         print("   5. Fine-tune: python train_brown_detector.py --finetune --train")
+        print("   6. Shared-backbone model for app.py: python train_brown_detector.py --train --combined")
+        print("   7. Quantized TFLite models: python train_brown_detector.py --export-tflite --compare-backends")
 
 if __name__ == '__main__':
     main()